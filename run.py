@@ -1,21 +1,78 @@
 #!/usr/bin/env python3
 """
 ReceiptToBooks - Simple runner script
+
+Usage:
+    python run.py                          # Check once for new emails
+    python run.py continuous 60            # Check every 60 seconds
+    python run.py --workers 8              # Process up to 8 attachments in parallel
+    python run.py continuous 60 --incremental   # Only look at emails added since last check
+    python run.py pipeline 60 [--incremental]   # Overlapping async stages, Ctrl+C drains
+    python run.py batch receipts/ --workers 16  # OCR a folder of receipts on 16 processes
+    python run.py reconcile [--full]            # Sync the local ledger with the sheet
 """
 import sys
 from src.email_processor import EmailProcessor
 
+
+def pop_option(args, name, default=None):
+    """Remove '--name VALUE' from args and return VALUE (or default)"""
+    if name in args:
+        idx = args.index(name)
+        if idx + 1 < len(args):
+            value = args[idx + 1]
+            del args[idx:idx + 2]
+            return value
+        del args[idx]
+    return default
+
+
+def pop_flag(args, name):
+    """Remove '--name' from args and return whether it was present"""
+    if name in args:
+        args.remove(name)
+        return True
+    return False
+
+
 def main():
     """Run the email processor"""
-    processor = EmailProcessor()
-    
-    if len(sys.argv) > 1 and sys.argv[1] == 'continuous':
+    args = sys.argv[1:]
+    workers = pop_option(args, '--workers')
+    incremental = pop_flag(args, '--incremental')
+
+    if args and args[0] == 'batch':
+        # Backfill a folder of receipt images (no Gmail needed)
+        from src.batch_processor import run_batch
+        save = not pop_flag(args, '--no-save')
+        directory = args[1] if len(args) > 1 else None
+        run_batch(directory, workers=int(workers) if workers else None, save=save)
+        return
+
+    if args and args[0] == 'reconcile':
+        # Pull rows added to the sheet elsewhere into the local ledger
+        from src.sheets_helper import SheetsManager
+        SheetsManager().reconcile(full=pop_flag(args, '--full'))
+        return
+
+    if workers is not None:
+        processor = EmailProcessor(max_workers=int(workers))
+    else:
+        processor = EmailProcessor()
+
+    if args and args[0] == 'pipeline':
+        # Fetch, OCR, extraction and sheet writes overlap (see src/pipeline.py)
+        from src.pipeline import run_pipeline
+        interval = int(args[1]) if len(args) > 1 else 60
+        options = {'ocr_workers': int(workers)} if workers else {}
+        run_pipeline(interval, incremental=incremental, processor=processor, **options)
+    elif args and args[0] == 'continuous':
         # Run continuously
-        interval = int(sys.argv[2]) if len(sys.argv) > 2 else 60
-        processor.run_continuous(interval)
+        interval = int(args[1]) if len(args) > 1 else 60
+        processor.run_continuous(interval, incremental=incremental)
     else:
         # Run once
-        processor.run_once()
+        processor.run_once(incremental=incremental)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
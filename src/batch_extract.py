@@ -0,0 +1,99 @@
+"""
+Multi-receipt extraction: several OCR texts in one OpenAI request
+
+Texts are packed greedily into batches that stay under a token budget, so
+many short receipts share a request while a long one goes on its own.
+Each receipt carries an id; the model returns one object per id and the
+answers are mapped back by that id (anything missing or malformed is
+retried on its own by the caller).
+"""
+import json
+
+# Rough size of one extracted receipt in the response
+OUTPUT_TOKENS_PER_RECEIPT = 200
+# Separator / id / field list added around each receipt text
+OVERHEAD_TOKENS_PER_RECEIPT = 30
+
+BATCH_INSTRUCTIONS = """
+You will receive several receipts, each starting with a line
+"### Receipt <id> (fields: ...)". Extract each one separately, only the
+listed fields, and answer with a single JSON object:
+{"receipts": [{"id": "<id>", ...fields...}, ...]}
+Return exactly one entry per receipt id."""
+
+
+def estimate_tokens(text):
+    """Approximate token count (about 4 characters per token for receipt text)"""
+    return len(text) // 4 + 1
+
+
+def item_cost(text):
+    """Tokens one receipt adds to a batched request (input and output)"""
+    return estimate_tokens(text) + OVERHEAD_TOKENS_PER_RECEIPT + OUTPUT_TOKENS_PER_RECEIPT
+
+
+def pack_batches(items, max_tokens, max_items):
+    """
+    Split (id, text, fields) items into batches within the token budget
+
+    Batch size adapts to the texts: many short receipts fit in one request,
+    a receipt larger than the budget goes alone.
+    """
+    batches = []
+    current = []
+    used = 0
+    for item in items:
+        cost = item_cost(item[1])
+        if current and (used + cost > max_tokens or len(current) >= max_items):
+            batches.append(current)
+            current = []
+            used = 0
+        current.append(item)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def build_batch_messages(base_prompt, batch, all_fields):
+    """Chat messages for one batched request"""
+    parts = []
+    for item_id, text, fields in batch:
+        parts.append(f"### Receipt {item_id} (fields: {', '.join(fields or all_fields)})\n{text}")
+    return [
+        {"role": "system", "content": base_prompt + "\n" + BATCH_INSTRUCTIONS},
+        {"role": "user", "content": "\n\n".join(parts)},
+    ]
+
+
+def parse_batch_response(content, expected_ids):
+    """
+    Map a batched response back to receipt ids
+
+    Returns {id: data} for every well-formed entry with a known id;
+    ids that are missing, duplicated or not objects are left out.
+    """
+    try:
+        payload = json.loads(content)
+    except (TypeError, ValueError):
+        return {}
+
+    entries = payload.get('receipts') if isinstance(payload, dict) else payload
+    if not isinstance(entries, list):
+        return {}
+
+    answers = {}
+    repeated = set()
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        item_id = str(entry.get('id', ''))
+        if item_id not in expected_ids:
+            continue
+        if item_id in answers:
+            repeated.add(item_id)
+        answers[item_id] = {key: value for key, value in entry.items() if key != 'id'}
+
+    for item_id in repeated:
+        del answers[item_id]
+    return answers
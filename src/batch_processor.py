@@ -0,0 +1,249 @@
+"""
+Batch mode: OCR a whole folder of receipts across CPU cores
+and stream the results into AI extraction and the sheet writer
+
+OCR'd texts are grouped into packs that fill one OpenAI request each
+(see batch_extract.py) before they go to extraction.
+"""
+import os
+import time
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from config import RECEIPTS_DIR, MAX_WORKERS, DEDUP_ENABLED, EXTRACTION_BATCH_TOKENS, EXTRACTION_BATCH_MAX
+from process_receipt import receipt_to_text, extract_many, ocr_cache, extraction_cache, fast_path_stats
+from batch_extract import item_cost
+from dedup import get_dedup_index, image_fingerprint, expense_key
+from sheets_helper import SheetsManager, BufferedSheetWriter
+import rate_limit
+
+RECEIPT_PATTERNS = ['*.jpg', '*.jpeg', '*.png', '*.pdf']
+
+
+def find_receipts(directory):
+    """All receipt files in directory, sorted by name"""
+    directory = Path(directory)
+    files = set()
+    for pattern in RECEIPT_PATTERNS:
+        files.update(directory.glob(pattern))
+        files.update(directory.glob(pattern.upper()))
+    return sorted(files)
+
+
+def ocr_file(data):
+    """
+    OCR one file's bytes (runs in a worker process)
+
+    Returns (text, seconds, OCR cache hits, OCR cache misses); the cache
+    counters live in the worker, so they are sent back for the summary.
+    """
+    hits, misses = ocr_cache.hits, ocr_cache.misses
+    start = time.perf_counter()
+    text = receipt_to_text(data)
+    return text, time.perf_counter() - start, ocr_cache.hits - hits, ocr_cache.misses - misses
+
+
+def timed_extract(texts):
+    """AI extraction of a pack of texts with timing (runs in a worker thread)"""
+    start = time.perf_counter()
+    outcomes = extract_many(texts, workers=1)
+    return outcomes, time.perf_counter() - start
+
+
+class StageStats:
+    """Item count, busy time and wall-clock window of one pipeline stage"""
+
+    def __init__(self, name):
+        self.name = name
+        self.done = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.first_start = None
+        self.last_end = None
+
+    def started(self):
+        if self.first_start is None:
+            self.first_start = time.perf_counter()
+
+    def finished(self, seconds=0.0, ok=True):
+        self.last_end = time.perf_counter()
+        self.busy += seconds
+        if ok:
+            self.done += 1
+        else:
+            self.failed += 1
+
+    def report(self, unit='item'):
+        wall = (self.last_end - self.first_start) if self.first_start and self.last_end else 0.0
+        rate = self.done / wall if wall else 0.0
+        avg = self.busy / (self.done + self.failed) if (self.done + self.failed) else 0.0
+        return (f"{self.name:<11} {self.done} {unit}(s) ok, {self.failed} failed in {wall:.1f}s "
+                f"→ {rate:.2f}/s (avg {avg:.2f}s each)")
+
+
+def run_batch(directory=None, workers=None, extract_workers=MAX_WORKERS, save=True):
+    """
+    Process every receipt in directory (default: RECEIPTS_DIR)
+
+    OCR runs in a pool of `workers` processes (default: one per CPU core).
+    OCR'd texts are collected until they fill one OpenAI request (or OCR
+    runs out of work), then the pack goes to a thread pool for AI
+    extraction, and each extracted receipt is queued for the sheet writer.
+    Receipts already in the sheet (same image, or same vendor/date/total)
+    are skipped.
+    """
+    directory = Path(directory or RECEIPTS_DIR)
+    workers = workers or os.cpu_count() or 1
+
+    print(f"\n📁 Looking for receipts in: {directory}")
+    receipt_files = find_receipts(directory)
+    if not receipt_files:
+        print(f"❌ No receipt images or PDFs found in {directory}")
+        return []
+
+    print(f"🧪 Batch processing {len(receipt_files)} receipt(s) "
+          f"with {workers} OCR process(es) and {extract_workers} extraction thread(s)\n")
+
+    ocr_stats = StageStats('OCR')
+    extract_stats = StageStats('Extraction')
+    flushes = []
+    queued = {}   # tag (file name) → result waiting for the sheet write
+
+    def on_flush(landed):
+        """Settle queued results: success only for rows that reached the sheet"""
+        flushes.append(sum(1 for entry in landed if not entry.get('duplicate')))
+        for entry in landed:
+            result = queued.pop(entry['tag'], None)
+            if result is None:
+                continue
+            if entry.get('duplicate'):
+                result.update(status="duplicate", message="Already in the sheet")
+            else:
+                result.update(status="success", row=entry['row'])
+
+    writer = None
+    if save:
+        writer = BufferedSheetWriter(SheetsManager(), on_flush=on_flush)
+
+    dedup = get_dedup_index() if DEDUP_ENABLED else None
+    fingerprints = {}
+    results = []
+    batch_start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as ocr_pool, \
+            ThreadPoolExecutor(max_workers=extract_workers) as extract_pool:
+        ocr_stats.started()
+        ocr_futures = {}
+        for path in receipt_files:
+            # Read once: the same bytes are hashed here and OCR'd in the worker
+            data = path.read_bytes()
+            fingerprints[path] = image_fingerprint(data)
+            seen = dedup.find_image(fingerprints[path]) if dedup else None
+            if seen:
+                print(f"♻️  Duplicate image, skipping OCR: {path.name} (already saved as {seen})")
+                results.append({"file": path.name, "status": "duplicate", "message": f"Same image as {seen}"})
+                continue
+            ocr_futures[ocr_pool.submit(ocr_file, data)] = path
+        extract_futures = {}
+        pending = set(ocr_futures)
+        ready = []
+        ready_tokens = 0
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                if future in ocr_futures:
+                    path = ocr_futures.pop(future)
+                    try:
+                        text, seconds, cache_hits, cache_misses = future.result()
+                    except Exception as e:
+                        ocr_stats.finished(ok=False)
+                        print(f"❌ OCR failed for {path.name}: {str(e)}")
+                        results.append({"file": path.name, "status": "error", "message": f"OCR failed: {str(e)}"})
+                        continue
+
+                    ocr_stats.finished(seconds)
+                    ocr_cache.record(cache_hits, cache_misses)
+                    print(f"📸 OCR done: {path.name} ({len(text)} chars, {seconds:.2f}s)")
+
+                    ready.append((path, text))
+                    ready_tokens += item_cost(text)
+
+                else:
+                    paths = extract_futures.pop(future)
+                    try:
+                        outcomes, seconds = future.result()
+                    except Exception as e:
+                        outcomes, seconds = [e] * len(paths), 0.0
+
+                    for path, outcome in zip(paths, outcomes):
+                        if isinstance(outcome, Exception):
+                            extract_stats.finished(ok=False)
+                            print(f"❌ AI extraction failed for {path.name}: {str(outcome)}")
+                            results.append({"file": path.name, "status": "error",
+                                            "message": f"AI extraction failed: {str(outcome)}"})
+                            continue
+
+                        data = outcome[0]
+                        extract_stats.finished(seconds / len(paths))
+                        print(f"🤖 Extracted: {path.name} → {data.get('vendor')} {data.get('total')}")
+
+                        seen = dedup.find_expense(expense_key(data)) if dedup else None
+                        if seen:
+                            print(f"♻️  Duplicate expense, skipping: {path.name} (already saved as {seen})")
+                            results.append({"file": path.name, "status": "duplicate", "data": data,
+                                            "message": f"Same expense as {seen}"})
+                            continue
+                        if writer:
+                            # Success is only decided once the row is in the sheet (on_flush)
+                            result = {"file": path.name, "status": "queued", "data": data}
+                            queued[path.name] = result
+                            results.append(result)
+                            writer.add(data, tag=path.name, fingerprint=fingerprints[path])
+                        else:
+                            results.append({"file": path.name, "status": "success", "data": data})
+
+            # Send a pack once it fills a request, or when OCR has nothing left
+            if ready and (ready_tokens >= EXTRACTION_BATCH_TOKENS or len(ready) >= EXTRACTION_BATCH_MAX
+                          or not ocr_futures):
+                extract_stats.started()
+                extract_future = extract_pool.submit(timed_extract, [text for _, text in ready])
+                extract_futures[extract_future] = [path for path, _ in ready]
+                pending.add(extract_future)
+                ready = []
+                ready_tokens = 0
+
+    if writer:
+        writer.flush()
+        # Rows of a failed append never reach on_flush
+        for result in queued.values():
+            result.update(status="error", message="Could not write to the sheet")
+        queued.clear()
+
+    total = time.perf_counter() - batch_start
+    successful = sum(1 for r in results if r["status"] == "success")
+    duplicates = sum(1 for r in results if r["status"] == "duplicate")
+
+    print(f"\n{'='*60}")
+    print("📈 BATCH SUMMARY")
+    print(f"{'='*60}")
+    print(f"✅ Successful: {successful}/{len(receipt_files)} in {total:.1f}s "
+          f"({successful / total if total else 0:.2f} receipts/s)")
+    print(f"♻️  Duplicates skipped: {duplicates}")
+    print(f"   {ocr_stats.report('file')}")
+    print(f"   {extract_stats.report('receipt')}")
+    if writer:
+        print(f"   {'Sheets':<11} {sum(flushes)} row(s) saved in {len(flushes)} request(s)")
+    print(f"⚡ {ocr_cache.summary()}")
+    print(f"⚡ {extraction_cache.summary()}")
+    print(f"⚡ {fast_path_stats.summary()}")
+    for line in rate_limit.summary():
+        print(f"🚦 {line}")
+    print(f"{'='*60}\n")
+
+    return results
+
+
+if __name__ == "__main__":
+    run_batch()
@@ -0,0 +1,433 @@
+"""
+End-to-end throughput benchmark: EmailProcessor against local fakes
+
+Gmail, Sheets, OpenAI and the OCR engine are replaced by the fakes in
+fake_gmail.py and fake_services.py (configurable latency and error rates),
+fed with a synthetic corpus of receipt emails. Reports receipts/second,
+p50 / p95 / p99 latency per stage and peak memory. Usage:
+    python bench_pipeline.py [--emails 20] [--attachments 2] [--mode once|batched|pipeline]
+                             [--save results.json] [--compare baseline.json]
+
+Caches, ledger and dedup index live in a scratch directory, so every run
+starts cold and the real ones are never touched. Saved results include the
+git commit, so runs from different commits can be compared with --compare.
+"""
+import io
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import functools
+import threading
+import contextlib
+import subprocess
+import tracemalloc
+from pathlib import Path
+
+SRC_DIR = Path(__file__).parent.resolve()
+
+# (vendor, category, items) for the synthetic receipts
+VENDORS = [
+    ('Blue Tokai Coffee', 'Food', ['Latte', 'Croissant', 'Cold Brew', 'Muffin']),
+    ('Pizza Palace', 'Food', ['Margherita', 'Garlic Bread', 'Coke']),
+    ('Uber Trip', 'Transport', ['Trip fare', 'Booking fee']),
+    ('Shell Petrol Pump', 'Transport', ['Petrol 10L']),
+    ('Metro Supermarket', 'Shopping', ['Milk', 'Bread', 'Eggs', 'Rice 5kg', 'Soap']),
+    ('Apollo Pharmacy', 'Shopping', ['Paracetamol', 'Bandages', 'Vitamin C']),
+    ('Style Salon', 'Services', ['Haircut', 'Beard trim']),
+]
+
+# Stage names, in report order
+STAGES = ['fetch', 'download', 'receipt', 'ocr', 'extract', 'extract_batch', 'openai_request',
+          'sheets_append', 'mark_read', 'confirm']
+
+
+def make_receipt(number, rng, messy=False):
+    """
+    Synthetic receipt → (ocr_text, data)
+
+    Clean receipts are complete enough for the rule-based fast path; messy
+    ones lose the date, the Total keyword and the currency, so OpenAI is
+    asked for those fields.
+    """
+    vendor, category, menu = rng.choice(VENDORS)
+    items = rng.sample(menu, rng.randint(1, len(menu)))
+    prices = [round(rng.uniform(20, 900), 2) for _ in items]
+    subtotal = round(sum(prices), 2)
+    tax = round(subtotal * 0.05, 2)
+    total = round(subtotal + tax, 2)
+    receipt_date = f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+
+    lines = [vendor, f"Bill No: {number}"]
+    lines.append(f"Date: {receipt_date}" if not messy else "Cashier: 04")
+    lines += [f"{item} {price:.2f}" for item, price in zip(items, prices)]
+    if messy:
+        lines.append(f"Amt {total:.1f}".replace('0', 'O'))
+    else:
+        lines += [f"Subtotal {subtotal:.2f}", f"GST {tax:.2f}", f"Total INR {total:.2f}", "Thank you"]
+
+    data = {'vendor': vendor, 'date': receipt_date, 'total': total, 'currency': 'INR',
+            'category': category, 'tax': tax, 'items': items}
+    return '\n'.join(lines), data
+
+
+def render_receipt(text, size, rng):
+    """Receipt text drawn on a white image with some sensor noise, as PNG bytes"""
+    from PIL import Image, ImageDraw
+
+    image = Image.new('L', size, 255)
+    draw = ImageDraw.Draw(image)
+    for index, line in enumerate(text.splitlines()):
+        draw.text((20, 20 + index * 18), line, fill=0)
+    for _ in range(size[0] * size[1] // 500):
+        image.putpixel((rng.randrange(size[0]), rng.randrange(size[1])), rng.randint(150, 230))
+    output = io.BytesIO()
+    image.save(output, format='PNG')
+    return output.getvalue()
+
+
+def build_corpus(emails, attachments, messy=0.3, duplicates=0.05, image_size=(600, 900), seed=0):
+    """
+    Synthetic receipt emails
+
+    Returns (messages, answers): messages are (subject, sender, [(filename, bytes)])
+    and answers maps each bill number to its text, data and image. A share
+    of the attachments (duplicates) re-sends an earlier receipt image.
+    """
+    rng = random.Random(seed)
+    messages = []
+    answers = {}
+    sent = []
+    for index in range(emails):
+        files = []
+        for part in range(attachments):
+            if sent and rng.random() < duplicates:
+                files.append((f"resent_{index}_{part}.png", rng.choice(sent)))
+                continue
+            number = f"B{len(answers) + 1:05d}"
+            text, data = make_receipt(number, rng, messy=rng.random() < messy)
+            image = render_receipt(text, image_size, rng)
+            answers[number] = {'text': text, 'data': data, 'image': image}
+            sent.append(image)
+            files.append((f"receipt_{number}.png", image))
+        messages.append((f"Your receipt #{index + 1}", f"Shop {index % 7} <shop{index % 7}@example.com>", files))
+    return messages, answers
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+class StageTimes:
+    """Latency samples per stage, recorded by wrapping the functions of each stage"""
+
+    def __init__(self):
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def wrap(self, stage, func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                with self.lock:
+                    self.samples.setdefault(stage, []).append(seconds)
+        return timed
+
+    def report(self):
+        """{stage: {count, mean_ms, p50_ms, p95_ms, p99_ms, max_ms}}"""
+        report = {}
+        for stage in STAGES:
+            values = sorted(self.samples.get(stage, []))
+            if not values:
+                continue
+            report[stage] = {
+                'count': len(values),
+                'mean_ms': 1000 * sum(values) / len(values),
+                'p50_ms': 1000 * percentile(values, 0.50),
+                'p95_ms': 1000 * percentile(values, 0.95),
+                'p99_ms': 1000 * percentile(values, 0.99),
+                'max_ms': 1000 * values[-1],
+            }
+        return report
+
+
+def git_commit():
+    """Short hash of HEAD ('+dirty' with uncommitted changes), or None outside git"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SRC_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=SRC_DIR,
+                               capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('+dirty' if dirty else '')
+
+
+def max_rss_mb():
+    """Peak resident memory of this process in MB (None where unsupported)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def run_pipeline_once(processor, gmail_service, workers):
+    """One poll through the asyncio pipeline, drained as if Ctrl+C came right after it"""
+    from pipeline import ReceiptPipeline
+
+    pipeline = ReceiptPipeline(processor, ocr_workers=workers)
+
+    async def main():
+        run = asyncio.create_task(pipeline.run(interval=3600))
+        while not any(call[0] == 'messages.list' for call in gmail_service.calls):
+            await asyncio.sleep(0.01)
+        pipeline.stopping.set()
+        await run
+
+    asyncio.run(main())
+
+
+def run_benchmark(options):
+    """Build the corpus and fakes, run the processor once over it and return the results dict"""
+    scratch = Path(tempfile.mkdtemp(prefix='receipt-bench-'))
+    os.environ.update({
+        'CACHE_DIR': str(scratch / 'cache'),
+        'DATA_DIR': str(scratch / 'data'),
+        'GOOGLE_SHEET_ID': 'bench-sheet',
+        'OPENAI_API_KEY': 'bench',
+    })
+    if 'config' in sys.modules:
+        print("⚠️  config was imported before the benchmark; caches may not be isolated")
+
+    try:
+        # Imported only now so config picks up the scratch directories
+        import ocr_engine
+        import process_receipt
+        from PIL import Image
+        from config import PREPROCESS_IMAGES
+        from image_preprocess import preprocess
+        from fake_gmail import FakeGmailService
+        from fake_services import Faults, FakeSheetsService, FakeOpenAIClient, FakeOCREngine, image_digest
+        from gmail_monitor import GmailMonitor
+        from sheets_helper import SheetsManager
+        from email_processor import EmailProcessor
+        import rate_limit
+        import metrics
+
+        print(f"🧪 Building corpus: {options.emails} email(s) × {options.attachments} attachment(s)...")
+        messages, answers = build_corpus(
+            options.emails, options.attachments, options.messy, options.duplicates,
+            (options.image_width, options.image_height), options.seed
+        )
+
+        def ocr_view(data):
+            # The image run_ocr hands to the engine
+            return preprocess(data)[0] if PREPROCESS_IMAGES else Image.open(io.BytesIO(data))
+
+        texts = {image_digest(ocr_view(answer['image'])): answer['text'] for answer in answers.values()}
+
+        def faults(latency, offset):
+            return Faults(latency, jitter=latency * options.jitter, error_rate=options.error_rate,
+                          error_status=options.error_status, retry_after=options.retry_after,
+                          seed=options.seed + offset)
+
+        gmail_service = FakeGmailService(faults=faults(options.gmail_latency, 1))
+        for subject, sender, files in messages:
+            gmail_service.add_message(subject, filenames=[name for name, _ in files],
+                                      data=[data for _, data in files], sender=sender,
+                                      mime_type='image/png', inline=False)
+        sheets_service = FakeSheetsService(faults=faults(options.sheets_latency, 2))
+        openai_client = FakeOpenAIClient({number: answer['data'] for number, answer in answers.items()},
+                                         faults=faults(options.openai_latency, 3),
+                                         per_receipt=options.openai_per_receipt)
+        ocr = FakeOCREngine(texts, faults=Faults(options.ocr_latency, jitter=options.ocr_latency * options.jitter,
+                                                 seed=options.seed + 4))
+        ocr_engine._engine = ocr
+        process_receipt.client = openai_client
+
+        timings = StageTimes()
+        devnull = open(os.devnull, 'w')
+        output = contextlib.nullcontext() if options.verbose else contextlib.redirect_stdout(devnull)
+
+        with output:
+            processor = EmailProcessor(max_workers=options.workers,
+                                       gmail=GmailMonitor(gmail_service),
+                                       sheets=SheetsManager(sheets_service))
+
+            gmail = processor.gmail
+            gmail.get_unread_receipts = timings.wrap('fetch', gmail.get_unread_receipts)
+            gmail.get_attachments = timings.wrap('download', gmail.get_attachments)
+            gmail.flush_read = timings.wrap('mark_read', gmail.flush_read)
+            gmail.send_confirmation = timings.wrap('confirm', gmail.send_confirmation)
+            processor.sheets.add_expenses = timings.wrap('sheets_append', processor.sheets.add_expenses)
+            processor.process_attachment = timings.wrap('receipt', processor.process_attachment)
+            openai_client.chat.completions.create = timings.wrap('openai_request', openai_client.create)
+
+            # Module-level functions are looked up at call time, so patch them where they are used
+            patched = {
+                'receipt_to_text': timings.wrap('ocr', process_receipt.receipt_to_text),
+                'extract_fields': timings.wrap('extract', process_receipt.extract_fields),
+                'extract_many': timings.wrap('extract_batch', process_receipt.extract_many),
+            }
+            modules = [process_receipt]
+            if options.mode == 'pipeline':
+                import pipeline
+                modules.append(pipeline)
+            for module in modules:
+                for name, func in patched.items():
+                    if hasattr(module, name):
+                        setattr(module, name, func)
+
+            tracemalloc.start()
+            start = time.perf_counter()
+            if options.mode == 'pipeline':
+                run_pipeline_once(processor, gmail_service, options.workers)
+            else:
+                processor.run_once(batch_extraction=options.mode == 'batched')
+            seconds = time.perf_counter() - start
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        devnull.close()
+
+        receipts = sum(len(files) for _, _, files in messages)
+        saved = processor.writer.total_saved
+        duplicates = processor.duplicates + processor.writer.total_duplicates
+        unread = sum(1 for message in gmail_service.mailbox.values() if 'UNREAD' in message['labelIds'])
+
+        return {
+            'timestamp': time.time(),
+            'commit': git_commit(),
+            'options': vars(options),
+            'seconds': seconds,
+            'receipts': receipts,
+            'rows_saved': saved,
+            'duplicates': duplicates,
+            'failed': receipts - saved - duplicates,
+            'emails_left_unread': unread,
+            'receipts_per_second': (saved + duplicates) / seconds if seconds else 0.0,
+            'peak_traced_memory_mb': peak_memory / (1024 * 1024),
+            'max_rss_mb': max_rss_mb(),
+            'stages': timings.report(),
+            'calls': {
+                # API calls as Gmail's quota (and RATE_LIMIT_GMAIL) counts them: each
+                # batch sub-request is one, the batch envelope none
+                'gmail': sum(1 for call in gmail_service.calls if call[0] != 'batch'),
+                'gmail_round_trips': gmail_service.faults.calls,
+                'gmail_bytes': gmail_service.bytes_sent,
+                'sheets': sheets_service.faults.calls,
+                'openai': openai_client.faults.calls,
+                'ocr_misses': ocr.misses,
+                'openai_tokens': sum(value for _, value in metrics.collect('openai_tokens_total')),
+            },
+            'injected_errors': {
+                'gmail': gmail_service.faults.injected,
+                'sheets': sheets_service.faults.injected,
+                'openai': openai_client.faults.injected,
+            },
+            'rate_limit': rate_limit.summary(),
+        }
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def print_results(results):
+    print(f"\n{'='*60}")
+    print(f"📈 PIPELINE BENCHMARK ({results['options']['mode']}, commit {results['commit'] or 'unknown'})")
+    print(f"{'='*60}")
+    print(f"✅ {results['rows_saved'] + results['duplicates']}/{results['receipts']} receipt(s) in "
+          f"{results['seconds']:.2f}s → {results['receipts_per_second']:.2f} receipts/s "
+          f"({results['rows_saved']} saved, {results['duplicates']} duplicate(s), {results['failed']} failed)")
+    if results['emails_left_unread']:
+        print(f"⚠️  {results['emails_left_unread']} email(s) left unread")
+    print(f"📨 Gmail: {results['calls']['gmail']} call(s) in {results['calls'].get('gmail_round_trips', '?')} "
+          f"round trip(s), {results['calls'].get('gmail_bytes', 0) / 1024:.0f} KB received")
+    print(f"🧠 Peak traced memory {results['peak_traced_memory_mb']:.1f} MB"
+          + (f", max RSS {results['max_rss_mb']:.1f} MB" if results['max_rss_mb'] else ""))
+    print(f"\n   {'stage':<15}{'count':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for stage, stats in results['stages'].items():
+        print(f"   {stage:<15}{stats['count']:>6}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}"
+              f"{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}")
+    injected = sum(results['injected_errors'].values())
+    if injected:
+        print(f"\n💥 Injected errors: " + ", ".join(f"{k} {v}" for k, v in results['injected_errors'].items()))
+    for line in results['rate_limit']:
+        print(f"🚦 {line}")
+    print(f"{'='*60}\n")
+
+
+def change(new, old):
+    if not old:
+        return 'n/a'
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def compare(results, baseline):
+    """Print the change of throughput, memory and stage p95 against an earlier run"""
+    print(f"📊 Compared with {baseline.get('commit') or 'baseline'}:")
+    print(f"   receipts/s  {baseline['receipts_per_second']:.2f} → {results['receipts_per_second']:.2f} "
+          f"({change(results['receipts_per_second'], baseline['receipts_per_second'])})")
+    print(f"   peak memory {baseline['peak_traced_memory_mb']:.1f} → {results['peak_traced_memory_mb']:.1f} MB "
+          f"({change(results['peak_traced_memory_mb'], baseline['peak_traced_memory_mb'])})")
+    for stage, stats in results['stages'].items():
+        old = baseline.get('stages', {}).get(stage)
+        if old:
+            print(f"   {stage:<15} p95 {old['p95_ms']:.1f} → {stats['p95_ms']:.1f} ms "
+                  f"({change(stats['p95_ms'], old['p95_ms'])})")
+    if baseline.get('options') != results['options']:
+        print("   ⚠️  Options differ from the baseline run")
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark against local fakes")
+    parser.add_argument('--mode', choices=['once', 'batched', 'pipeline'], default='once',
+                        help="run_once per email, run_once with batched extraction, or the asyncio pipeline")
+    parser.add_argument('--emails', type=int, default=20)
+    parser.add_argument('--attachments', type=int, default=2, help="receipts per email")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--messy', type=float, default=0.3, help="share of receipts the fast path cannot read")
+    parser.add_argument('--duplicates', type=float, default=0.05, help="share of attachments that re-send a receipt")
+    parser.add_argument('--image-width', type=int, default=600)
+    parser.add_argument('--image-height', type=int, default=900)
+    parser.add_argument('--gmail-latency', type=float, default=0.05, help="seconds per Gmail request")
+    parser.add_argument('--sheets-latency', type=float, default=0.2, help="seconds per Sheets request")
+    parser.add_argument('--openai-latency', type=float, default=0.6, help="seconds per OpenAI request")
+    parser.add_argument('--openai-per-receipt', type=float, default=0.2,
+                        help="extra OpenAI seconds per receipt in a request")
+    parser.add_argument('--ocr-latency', type=float, default=0.3, help="seconds per OCR call")
+    parser.add_argument('--jitter', type=float, default=0.5, help="random extra latency, as a share of latency")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of API calls that fail")
+    parser.add_argument('--error-status', type=int, default=429)
+    parser.add_argument('--retry-after', type=float, default=None, help="Retry-After sent with injected errors")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', metavar='PATH', help="write the results as JSON")
+    parser.add_argument('--compare', metavar='PATH', help="JSON results of an earlier run to compare with")
+    parser.add_argument('--verbose', action='store_true', help="show the processor's own output")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    options = parse_args(sys.argv[1:])
+    results = run_benchmark(options)
+    print_results(results)
+
+    if options.compare:
+        with open(options.compare) as f:
+            compare(results, json.load(f))
+
+    if options.save:
+        with open(options.save, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Saved results to {options.save}")
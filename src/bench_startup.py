@@ -0,0 +1,116 @@
+"""
+Startup-time benchmark: how long until the processor is ready to poll
+
+Each measurement runs in a fresh interpreter (like a cron invocation), so
+nothing is shared between runs. Usage:
+    python bench_startup.py [runs] [--save results.json]
+
+DATA_DIR and CACHE_DIR point at a scratch directory, so EmailProcessor()
+never opens (or creates) the real ledger, dedup index and journal.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+
+SRC_DIR = Path(__file__).parent.resolve()
+
+# What each step measures, run with `python -c` inside src/
+STEPS = {
+    'import config': "import config",
+    'import process_receipt': "import process_receipt",
+    'import email_processor': "import email_processor",
+    'EmailProcessor()': "import email_processor; email_processor.EmailProcessor()",
+}
+
+TIMER = """
+import time, sys
+start = time.perf_counter()
+{code}
+sys.stderr.write('STARTUP_SECONDS=%f\\n' % (time.perf_counter() - start))
+"""
+
+
+def scratch_env(scratch):
+    """Environment whose config reads and writes only inside scratch"""
+    env = dict(os.environ)
+    env.update({'CACHE_DIR': str(scratch / 'cache'), 'DATA_DIR': str(scratch / 'data')})
+    return env
+
+
+def time_step(code, env=None):
+    """Seconds spent running code in a fresh interpreter (excluding interpreter boot)"""
+    result = subprocess.run(
+        [sys.executable, '-c', TIMER.format(code=code)],
+        cwd=SRC_DIR, capture_output=True, text=True, env=env
+    )
+    for line in result.stderr.splitlines():
+        if line.startswith('STARTUP_SECONDS='):
+            return float(line.split('=', 1)[1])
+    raise RuntimeError(f"'{code}' failed:\n{result.stderr.strip()}")
+
+
+def slowest_imports(module='email_processor', top=10, env=None):
+    """Largest cumulative import times reported by python -X importtime"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+        cwd=SRC_DIR, capture_output=True, text=True, env=env
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        # "import time:  self_us | cumulative_us | module"
+        _, cumulative_us, name = [part.strip() for part in line.split(':', 1)[1].split('|')]
+        rows.append((int(cumulative_us), name))
+    rows.sort(reverse=True)
+    return rows[:top]
+
+
+def run_benchmark(runs=5, save_path=None):
+    """Time every step `runs` times and print min / median"""
+    print(f"\n⏱️  Startup benchmark ({runs} run(s) per step, fresh interpreter each time)\n")
+
+    scratch = Path(tempfile.mkdtemp(prefix='startup-bench-'))
+    env = scratch_env(scratch)
+    results = {}
+    try:
+        for label, code in STEPS.items():
+            try:
+                timings = [time_step(code, env) for _ in range(runs)]
+            except RuntimeError as e:
+                print(f"❌ {label}: {str(e).splitlines()[-1]}")
+                continue
+            results[label] = {
+                'min': min(timings),
+                'median': statistics.median(timings),
+            }
+            print(f"   {label:<24} min {min(timings)*1000:7.0f} ms | median {statistics.median(timings)*1000:7.0f} ms")
+
+        print("\n🐢 Slowest imports for email_processor (cumulative):")
+        for cumulative_us, name in slowest_imports(env=env):
+            print(f"   {cumulative_us/1000:7.0f} ms  {name}")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    if save_path:
+        with open(save_path, 'w') as f:
+            json.dump({'timestamp': time.time(), 'runs': runs, 'steps': results}, f, indent=2)
+        print(f"\n💾 Saved results to {save_path}")
+
+    return results
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    save_path = None
+    if '--save' in args:
+        idx = args.index('--save')
+        save_path = args[idx + 1]
+        del args[idx:idx + 2]
+    run_benchmark(int(args[0]) if args else 5, save_path)
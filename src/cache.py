@@ -0,0 +1,144 @@
+"""
+Small on-disk cache - one JSON file per key, size-based LRU eviction
+"""
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+
+
+class DiskCache:
+    """
+    Content-addressed JSON cache stored under a directory
+
+    Entries are evicted least-recently-used first (file mtime is bumped on
+    every hit) once the directory grows past max_bytes. With ttl (seconds)
+    entries older than ttl count as misses.
+    """
+
+    def __init__(self, directory, max_bytes, name='cache', ttl=None):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.name = name
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.size = None  # computed lazily on first write
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def make_key(*parts):
+        """Hash bytes/str parts into a hex key"""
+        digest = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode('utf-8')
+            digest.update(hashlib.sha256(part).digest())
+        return digest.hexdigest()
+
+    def path_for(self, key):
+        return self.directory / key[:2] / f"{key}.json"
+
+    def get(self, key):
+        """Return the cached value or None"""
+        path = self.path_for(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                entry = json.load(f)
+            value = entry['value']
+            if self.ttl is not None and time.time() - entry['created'] > self.ttl:
+                value = None
+            else:
+                os.utime(path)  # mark as recently used
+        except (OSError, ValueError, KeyError, TypeError):
+            value = None
+
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """Store a JSON-serialisable value"""
+        path = self.path_for(key)
+        tmp_path = None
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            data = json.dumps({'created': time.time(), 'value': value}).encode('utf-8')
+            # Unique temp name across threads and processes (batch mode's
+            # worker processes share the OCR cache), then an atomic rename
+            with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f".{key[:8]}-", suffix='.tmp',
+                                             delete=False) as f:
+                tmp_path = f.name
+                f.write(data)
+            old_size = path.stat().st_size if path.exists() else 0
+            os.replace(tmp_path, path)
+        except OSError as e:
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            print(f"⚠️  Could not write {self.name} entry: {str(e)}")
+            return
+
+        with self.lock:
+            if self.size is None:
+                self.size = self.scan_size()
+            else:
+                self.size += len(data) - old_size
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def scan_size(self):
+        """Total size of all cache files"""
+        return sum(f.stat().st_size for f in self.directory.glob('*/*.json'))
+
+    def evict(self):
+        """Delete least-recently-used entries until below 90% of max_bytes"""
+        entries = []
+        for f in self.directory.glob('*/*.json'):
+            try:
+                stat = f.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, f))
+        entries.sort()
+
+        self.size = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, size, f in entries:
+            if self.size <= target:
+                break
+            try:
+                f.unlink()
+                self.size -= size
+            except OSError:
+                pass
+
+    def stats(self):
+        """Hit/miss counters since start"""
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+    def record(self, hits=0, misses=0):
+        """Add hits / misses counted elsewhere (e.g. by the same cache in a worker process)"""
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+
+    def summary(self):
+        """One-line hit/miss report"""
+        stats = self.stats()
+        return (f"{self.name}: {stats['hits']} hit(s), {stats['misses']} miss(es) "
+                f"({stats['hit_rate']*100:.0f}% hit rate)")
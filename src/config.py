@@ -14,29 +14,141 @@ load_dotenv(PROJECT_ROOT / '.env')
 # File paths (all absolute)
 CREDENTIALS_PATH = PROJECT_ROOT / 'credentials' / 'service_account.json'
 RECEIPTS_DIR = PROJECT_ROOT / 'receipts'
+# Caches and local databases (overridable, e.g. benchmarks use a scratch directory)
+CACHE_DIR = Path(os.getenv('CACHE_DIR', PROJECT_ROOT / '.cache'))
+DATA_DIR = Path(os.getenv('DATA_DIR', PROJECT_ROOT / 'data'))
 
 # Add after CREDENTIALS_PATH line:
 GMAIL_CREDENTIALS_PATH = PROJECT_ROOT / 'credentials' / 'gmail_credentials.json'
 GMAIL_TOKEN_PATH = PROJECT_ROOT / 'credentials' / 'gmail_token.json'
+# Last synced mailbox history ID (incremental sync checkpoint)
+GMAIL_HISTORY_PATH = GMAIL_TOKEN_PATH.parent / 'gmail_history.json'
 
-# Add after the existing verification:
-if not GMAIL_CREDENTIALS_PATH.exists():
-    print(f"⚠️  WARNING: Gmail credentials not found at: {GMAIL_CREDENTIALS_PATH}")
-    print(f"💡 You'll need this for email monitoring (Day 3)")
-    
 # Environment variables
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 GOOGLE_SHEET_ID = os.getenv('GOOGLE_SHEET_ID')
 
-# Verify critical files exist
-if not CREDENTIALS_PATH.exists():
-    raise FileNotFoundError(
-        f"❌ Google credentials not found at: {CREDENTIALS_PATH}\n"
-        f"💡 Make sure you downloaded the JSON file and saved it as:\n"
-        f"   {CREDENTIALS_PATH}"
-    )
+# Number of attachments processed in parallel per email (1 = serial)
+MAX_WORKERS = int(os.getenv('MAX_WORKERS', '4'))
 
-# Print config on import (for debugging)
+# Buffered sheet writes: flush after this many rows or this many seconds
+SHEETS_BATCH_SIZE = int(os.getenv('SHEETS_BATCH_SIZE', '50'))
+SHEETS_BATCH_MAX_AGE = float(os.getenv('SHEETS_BATCH_MAX_AGE', '30'))
+
+# Local SQLite mirror of the expense sheet (written on every append, used for reads)
+LEDGER_ENABLED = os.getenv('LEDGER_ENABLED', '1') == '1'
+LEDGER_PATH = DATA_DIR / 'ledger.sqlite3'
+
+# Skip receipts already in the sheet (same image before OCR, same vendor/date/total after extraction)
+DEDUP_ENABLED = os.getenv('DEDUP_ENABLED', '1') == '1'
+DEDUP_PATH = DATA_DIR / 'dedup.sqlite3'
+
+# Crash-safe journal of per-email / per-attachment progress, so a restart
+# resumes instead of running OCR + AI again or appending duplicate rows
+JOURNAL_ENABLED = os.getenv('JOURNAL_ENABLED', '1') == '1'
+JOURNAL_PATH = DATA_DIR / 'journal.sqlite3'
+JOURNAL_KEEP_DAYS = int(os.getenv('JOURNAL_KEEP_DAYS', '30'))
+
+# Fetch Gmail messages with batch HTTP requests (up to GMAIL_BATCH_SIZE per request)
+GMAIL_BATCH_FETCH = os.getenv('GMAIL_BATCH_FETCH', '1') == '1'
+GMAIL_BATCH_SIZE = int(os.getenv('GMAIL_BATCH_SIZE', '50'))
+
+# Processed emails are marked read with one batchModify per cycle (or as soon
+# as this many are waiting); GMAIL_PROCESSED_LABEL, if set, is added in the same
+# call and excluded from the receipt search
+GMAIL_MARK_READ_BATCH = int(os.getenv('GMAIL_MARK_READ_BATCH', '100'))
+GMAIL_PROCESSED_LABEL = os.getenv('GMAIL_PROCESSED_LABEL', '')
+
+# Attachment downloads: parallel fetches per email; parts outside these sizes
+# (tracking pixels, logos, huge files) are skipped before downloading them.
+# The minimum applies to images only, small text PDFs are kept
+ATTACHMENT_DOWNLOAD_WORKERS = int(os.getenv('ATTACHMENT_DOWNLOAD_WORKERS', '4'))
+ATTACHMENT_MIN_BYTES = int(os.getenv('ATTACHMENT_MIN_BYTES', '5000'))
+ATTACHMENT_MAX_BYTES = int(os.getenv('ATTACHMENT_MAX_MB', '20')) * 1024 * 1024
+# Images below this size named like decoration (logo, icon, ...) are skipped; PDFs never are
+ATTACHMENT_DECORATION_MAX_BYTES = int(os.getenv('ATTACHMENT_DECORATION_MAX_KB', '50')) * 1024
+
+# OCR engine: auto (tesserocr if installed, else pytesseract), tesserocr or pytesseract
+OCR_ENGINE = os.getenv('OCR_ENGINE', 'auto')
+# Most Tesseract API objects (each holds a loaded model) tesserocr keeps at once
+OCR_API_POOL_SIZE = int(os.getenv('OCR_API_POOL_SIZE', str(os.cpu_count() or 4)))
+
+# Downscale / deskew / binarize images before OCR (longest side in pixels, ~300 DPI for receipts)
+PREPROCESS_IMAGES = os.getenv('PREPROCESS_IMAGES', '1') == '1'
+PREPROCESS_MAX_SIDE = int(os.getenv('PREPROCESS_MAX_SIDE', '2000'))
+
+# Resolution used to rasterize scanned PDF pages for OCR
+PDF_RENDER_DPI = int(os.getenv('PDF_RENDER_DPI', '200'))
+# Pages of a PDF read as one receipt (longer statements are cut off here)
+PDF_MAX_PAGES = int(os.getenv('PDF_MAX_PAGES', '5'))
+
+# On-disk OCR result cache (keyed by image bytes + Tesseract version/config)
+OCR_CACHE_ENABLED = os.getenv('OCR_CACHE_ENABLED', '1') == '1'
+OCR_CACHE_MAX_MB = float(os.getenv('OCR_CACHE_MAX_MB', '100'))
+
+# On-disk AI extraction cache (keyed by normalized OCR text + model + prompt version)
+EXTRACTION_CACHE_ENABLED = os.getenv('EXTRACTION_CACHE_ENABLED', '1') == '1'
+EXTRACTION_CACHE_BYPASS = os.getenv('EXTRACTION_CACHE_BYPASS', '0') == '1'
+EXTRACTION_CACHE_MAX_MB = float(os.getenv('EXTRACTION_CACHE_MAX_MB', '50'))
+EXTRACTION_CACHE_TTL_DAYS = float(os.getenv('EXTRACTION_CACHE_TTL_DAYS', '30'))
+
+# Rule-based extraction before the LLM: fields read with at least this
+# confidence are kept, only the rest are asked from OpenAI
+FAST_PATH_ENABLED = os.getenv('FAST_PATH_ENABLED', '1') == '1'
+FAST_PATH_MIN_CONFIDENCE = float(os.getenv('FAST_PATH_MIN_CONFIDENCE', '0.8'))
+
+# Pack several receipts into one OpenAI request (token budget and receipt
+# limit per request); used by batch mode and, with EXTRACTION_BATCHING=1,
+# by the email processor
+EXTRACTION_BATCHING = os.getenv('EXTRACTION_BATCHING', '0') == '1'
+EXTRACTION_BATCH_TOKENS = int(os.getenv('EXTRACTION_BATCH_TOKENS', '6000'))
+EXTRACTION_BATCH_MAX = int(os.getenv('EXTRACTION_BATCH_MAX', '10'))
+
+# Requests per second allowed per service (0 = unlimited); throttled and
+# failed calls are retried up to RATE_LIMIT_MAX_RETRIES times with backoff
+RATE_LIMIT_OPENAI = float(os.getenv('RATE_LIMIT_OPENAI', '8'))
+RATE_LIMIT_GMAIL = float(os.getenv('RATE_LIMIT_GMAIL', '40'))
+RATE_LIMIT_SHEETS = float(os.getenv('RATE_LIMIT_SHEETS', '1'))
+RATE_LIMIT_MAX_CONCURRENCY = int(os.getenv('RATE_LIMIT_MAX_CONCURRENCY', '8'))
+RATE_LIMIT_MAX_RETRIES = int(os.getenv('RATE_LIMIT_MAX_RETRIES', '5'))
+
+# Asyncio pipeline (python run.py pipeline): items waiting between stages
+# and concurrent workers per stage
+PIPELINE_QUEUE_SIZE = int(os.getenv('PIPELINE_QUEUE_SIZE', '20'))
+PIPELINE_DOWNLOAD_WORKERS = int(os.getenv('PIPELINE_DOWNLOAD_WORKERS', '4'))
+PIPELINE_OCR_WORKERS = int(os.getenv('PIPELINE_OCR_WORKERS', str(MAX_WORKERS)))
+PIPELINE_EXTRACT_WORKERS = int(os.getenv('PIPELINE_EXTRACT_WORKERS', '4'))
+PIPELINE_CONFIRM_WORKERS = int(os.getenv('PIPELINE_CONFIRM_WORKERS', '2'))
+
+# Stage latency / counter metrics (see metrics.py); METRICS_PORT > 0 serves
+# them on http://127.0.0.1:PORT/metrics, continuous mode prints a summary
+# every METRICS_SUMMARY_INTERVAL seconds
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+METRICS_SUMMARY_INTERVAL = float(os.getenv('METRICS_SUMMARY_INTERVAL', '300'))
+
+# Incremental sync still runs a full search every N polls to pick up
+# unread emails that failed earlier
+GMAIL_FULL_SYNC_EVERY = int(os.getenv('GMAIL_FULL_SYNC_EVERY', '60'))
+
+
+def require_credentials():
+    """Verify the Google service account file exists (called before connecting to Sheets)"""
+    if not CREDENTIALS_PATH.exists():
+        raise FileNotFoundError(
+            f"❌ Google credentials not found at: {CREDENTIALS_PATH}\n"
+            f"💡 Make sure you downloaded the JSON file and saved it as:\n"
+            f"   {CREDENTIALS_PATH}"
+        )
+
+
+def check_gmail_credentials():
+    """Warn if the Gmail OAuth client file is missing (called before connecting to Gmail)"""
+    if not GMAIL_CREDENTIALS_PATH.exists():
+        print(f"⚠️  WARNING: Gmail credentials not found at: {GMAIL_CREDENTIALS_PATH}")
+        print(f"💡 You'll need this for email monitoring (Day 3)")
+
+# Print config when run directly (for debugging)
 if __name__ == "__main__":
     print("📁 Project Configuration:")
     print(f"  Root: {PROJECT_ROOT}")
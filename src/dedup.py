@@ -0,0 +1,137 @@
+"""
+Duplicate-receipt index
+
+Two checks, both answered by indexed SQLite lookups (no sheet scans):
+- before OCR: SHA-256 of the file bytes, so a re-sent copy of the same
+  file is skipped without OCR or AI
+- before writing: (vendor, date, total, currency) of the extracted data
+
+Only byte-identical files are skipped before OCR: a perceptual hash also
+matches different receipts photographed on the same background. A
+re-compressed copy is caught by the expense check after extraction.
+"""
+import re
+import hashlib
+import sqlite3
+import threading
+from datetime import datetime
+
+from config import DEDUP_PATH
+
+# PRAGMA user_version of an up-to-date index; MIGRATIONS[v] brings an older file to v
+SCHEMA_VERSION = 1
+MIGRATIONS = {
+    # Perceptual image hashes replaced by content_hashes
+    1: "DROP TABLE IF EXISTS image_hashes",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS content_hashes (
+    hash       TEXT PRIMARY KEY,
+    label      TEXT,
+    created_at TEXT
+);
+CREATE TABLE IF NOT EXISTS expense_keys (
+    key        TEXT PRIMARY KEY,
+    label      TEXT,
+    created_at TEXT
+);
+"""
+
+
+def image_fingerprint(data):
+    """SHA-256 of the file bytes as 64 hex chars (matches exact copies only)"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def expense_key(data):
+    """
+    (vendor, date, total, currency) identity of an extracted receipt,
+    or None when the data is too incomplete to tell duplicates apart
+    """
+    if not data or data.get('date') in (None, '') or data.get('total') in (None, ''):
+        return None
+    try:
+        total = f"{float(data['total']):.2f}"
+    except (TypeError, ValueError):
+        return None
+    vendor = re.sub(r'[^a-z0-9]', '', str(data.get('vendor') or '').lower())
+    currency = str(data.get('currency') or '').upper()
+    return f"{vendor}|{data['date']}|{total}|{currency}"
+
+
+class DedupIndex:
+    """Persistent index of receipts that made it into the sheet"""
+
+    def __init__(self, path=DEDUP_PATH):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.image_hits = 0
+        self.expense_hits = 0
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            version = self.db.execute("PRAGMA user_version").fetchone()[0]
+            for target in range(version + 1, SCHEMA_VERSION + 1):
+                self.db.execute(MIGRATIONS[target])
+            self.db.executescript(SCHEMA)
+            self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def find_image(self, fingerprint):
+        """Label of a recorded file with the same content hash, or None"""
+        if not fingerprint:
+            return None
+        with self.lock:
+            row = self.db.execute("SELECT label FROM content_hashes WHERE hash = ?", (fingerprint,)).fetchone()
+            if row:
+                self.image_hits += 1
+        return (row[0] or fingerprint) if row else None
+
+    def find_expense(self, key):
+        """Label of a recorded expense with the same key, or None"""
+        if not key:
+            return None
+        with self.lock:
+            row = self.db.execute("SELECT label FROM expense_keys WHERE key = ?", (key,)).fetchone()
+            if row:
+                self.expense_hits += 1
+        return (row[0] or key) if row else None
+
+    def register(self, data, fingerprint=None, label=''):
+        """Remember an expense (and its image) once it is in the sheet"""
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        key = expense_key(data)
+        with self.lock, self.db:
+            if key:
+                self.db.execute(
+                    "INSERT OR IGNORE INTO expense_keys (key, label, created_at) VALUES (?, ?, ?)",
+                    (key, label, now)
+                )
+            if fingerprint:
+                self.db.execute(
+                    "INSERT OR IGNORE INTO content_hashes (hash, label, created_at) VALUES (?, ?, ?)",
+                    (fingerprint, label, now)
+                )
+
+    def summary(self):
+        """One-line report of duplicates caught this run"""
+        return (f"Duplicates skipped: {self.image_hits} same image (before OCR), "
+                f"{self.expense_hits} same vendor/date/total")
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_dedup_index():
+    """Process-wide dedup index (opened on first use)"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = DedupIndex()
+        return _index
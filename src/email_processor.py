@@ -2,38 +2,93 @@
 Email-to-Sheet Pipeline: Monitor Gmail → Process Receipts → Update Sheets
 """
 import time
-from pathlib import Path
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
-from config import RECEIPTS_DIR
+from config import (
+    MAX_WORKERS, GMAIL_FULL_SYNC_EVERY, EXTRACTION_BATCHING, METRICS_SUMMARY_INTERVAL, JOURNAL_ENABLED
+)
 from gmail_monitor import GmailMonitor
-from process_receipt import process_receipt
-from sheets_helper import SheetsManager
+from process_receipt import process_receipt, process_receipts, ocr_cache, extraction_cache, fast_path_stats
+from sheets_helper import SheetsManager, BufferedSheetWriter
+from journal import get_journal, attachment_key
+import rate_limit
+import metrics
+
+
+def header(email, name, default=''):
+    """Value of a top-level header of a Gmail message"""
+    headers = email.get('payload', {}).get('headers', [])
+    return next((h['value'] for h in headers if h['name'] == name), default)
 
 
 class EmailProcessor:
     """Process receipt emails automatically"""
     
-    def __init__(self):
-        """Initialize all services"""
+    def __init__(self, max_workers=MAX_WORKERS, gmail=None, sheets=None, journal=None):
+        """
+        Initialize all services
+        
+        Args:
+            max_workers: attachments processed in parallel per email (1 = serial)
+            gmail: GmailMonitor to use (default: one on the shared Gmail client)
+            sheets: SheetsManager to use (default: one on the shared Sheets client)
+            journal: Journal that progress is recorded in (default: the shared
+                     one, unless JOURNAL_ENABLED=0)
+        """
         print("🚀 Initializing ReceiptToBooks Email Processor...")
         print()
         
-        self.gmail = GmailMonitor()
-        self.sheets = SheetsManager()
+        self.gmail = gmail or GmailMonitor()
+        self.sheets = sheets or SheetsManager()
+        self.max_workers = max(1, int(max_workers))
+        self.duplicates = 0
         
-        # Make sure receipts directory exists
-        RECEIPTS_DIR.mkdir(parents=True, exist_ok=True)
+        if journal is None and JOURNAL_ENABLED:
+            journal = get_journal()
+        self.journal = journal
         
-        print("✅ All services ready")
+        # Rows are buffered and appended in bulk; emails are marked read
+        # only once their rows have actually landed in the sheet
+        self.writer = BufferedSheetWriter(self.sheets, on_flush=self.on_rows_saved)
+        
+        print("✅ Ready (Gmail, Sheets and OpenAI connect on first use)")
         print()
     
-    def process_single_email(self, email):
-        """Process one receipt email"""
+    def process_attachment(self, att):
+        """Run one attachment through OCR + AI (safe to call from worker threads)"""
+        try:
+            # Decoded attachment bytes go straight to the pipeline, no temp file
+            return process_receipt(att['data'], name=att['filename'])
+        except Exception as e:
+            return {"status": "error", "message": str(e)}
+    
+    def process_attachments(self, attachments):
+        """
+        Yield (attachment, result) pairs in attachment order.
+        
+        With more than one worker, attachments run in a bounded thread pool so
+        OCR of one receipt overlaps with OCR / AI calls of the others; rows
+        still reach the sheet in the order the attachments have in the email.
+        """
+        workers = min(self.max_workers, len(attachments))
+        
+        if workers <= 1:
+            for att in attachments:
+                print(f"\n📎 Processing attachment: {att['filename']}")
+                yield att, self.process_attachment(att)
+            return
+        
+        print(f"\n⚡ Processing {len(attachments)} attachments with {workers} workers")
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [(att, pool.submit(self.process_attachment, att)) for att in attachments]
+            for att, future in futures:
+                yield att, future.result()
+    
+    def open_email(self, email):
+        """Print an email's details and return (email_id, sender, attachments)"""
         # Get email details
-        headers = email['payload']['headers']
-        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'No subject')
-        sender = next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown')
+        subject = header(email, 'Subject', 'No subject')
+        sender = header(email, 'From', 'Unknown')
         email_id = email['id']
         
         print(f"\n{'='*60}")
@@ -47,55 +102,190 @@ class EmailProcessor:
         
         if not attachments:
             print("⚠️  No image attachments found, skipping")
+        return email_id, sender, attachments
+    
+    def resume_email(self, email):
+        """
+        Finish an email whose rows were saved before a restart (mark read,
+        confirm) without downloading or processing it again. Returns True if
+        the journal knew the email was past that point.
+        """
+        if self.journal is None or self.journal.stage(email['id']) in (None, 'processing'):
+            return False
+        email_id = email['id']
+        sender = header(email, 'From', 'Unknown')
+        print(f"\n↩️  Rows of email {email_id} from {sender} were already saved, finishing it")
+        self.journal.resumed += 1
+        expense = self.journal.saved_expense(email_id)
+        self.confirm_emails([{'tag': (email_id, sender), 'data': expense, 'duplicate': expense is None}])
+        return True
+    
+    def journaled_results(self, email_id, attachments):
+        """Split attachments into ({key: stored result}, [still to process]) using the journal"""
+        if self.journal is None:
+            return {}, attachments
+        stored = self.journal.results(email_id)
+        known = {attachment_key(att): stored[attachment_key(att)][1]
+                 for att in attachments if attachment_key(att) in stored}
+        if known:
+            print(f"↩️  Reusing {len(known)} result(s) from an earlier run, no OCR / AI needed")
+            self.journal.reused += len(known)
+        return known, [att for att in attachments if attachment_key(att) not in known]
+    
+    def process_single_email(self, email):
+        """Process one receipt email"""
+        if self.resume_email(email):
+            return True
+        email_id, sender, attachments = self.open_email(email)
+        if not attachments:
             return False
+        known, todo = self.journaled_results(email_id, attachments)
+        results = (result for _, result in self.process_attachments(todo))
+        pairs = ((att, known[attachment_key(att)] if attachment_key(att) in known else next(results))
+                 for att in attachments)
+        return self.handle_results(email_id, sender, pairs)
+    
+    def process_emails_batched(self, emails):
+        """
+        Process several emails together: all attachments are OCR'd first, then
+        their texts are extracted with as few (batched) OpenAI requests as
+        possible. Returns the number of emails handled.
+        """
+        processed = 0
+        opened = []
+        for email in emails:
+            if self.resume_email(email):
+                processed += 1
+                continue
+            email_id, sender, atts = self.open_email(email)
+            opened.append((email_id, sender, atts) + self.journaled_results(email_id, atts))
+        attachments = [att for _, _, _, _, todo in opened for att in todo]
         
-        # Process each attachment
-        success_count = 0
-        for att in attachments:
-            print(f"\n📎 Processing attachment: {att['filename']}")
-            
-            # Save attachment temporarily
-            temp_path = RECEIPTS_DIR / f"temp_{datetime.now().timestamp()}_{att['filename']}"
-            with open(temp_path, 'wb') as f:
-                f.write(att['data'])
-            
-            try:
-                # Process receipt
-                result = process_receipt(temp_path)
-                
-                if result['status'] == 'success':
-                    # Save to sheets
-                    self.sheets.add_expense(result['data'])
-                    print(f"✅ Receipt processed and saved!")
-                    success_count += 1
+        if attachments:
+            print(f"\n📦 Processing {len(attachments)} attachment(s) from {len(emails)} email(s) together")
+        results = iter(process_receipts(
+            [att['data'] for att in attachments],
+            names=[att['filename'] for att in attachments],
+            workers=self.max_workers
+        ) if attachments else [])
+        
+        for email_id, sender, atts, known, _ in opened:
+            if not atts:
+                continue
+            pairs = [(att, known[attachment_key(att)] if attachment_key(att) in known else next(results))
+                     for att in atts]
+            if self.handle_results(email_id, sender, pairs):
+                processed += 1
+        return processed
+    
+    def handle_results(self, email_id, sender, pairs):
+        """Queue an email's successful (attachment, result) pairs for the sheet"""
+        # Each result is journaled as it arrives, so a crash never repeats its OCR / AI
+        stored = self.journal.results(email_id) if self.journal is not None else {}
+        
+        # Process attachments; successful results are queued for the sheet
+        expenses = []
+        fingerprints = []
+        duplicates = 0
+        for att, result in pairs:
+            metrics.inc('attachments_total')
+            metrics.inc('receipts_total', status=result['status'])
+            stage = stored.get(attachment_key(att), (None,))[0]
+            if self.journal is not None and stage is None:
+                self.journal.record_result(email_id, sender, att, result)
+            if result['status'] == 'success' and stage == 'written':
+                print(f"♻️  Already saved in an earlier run, skipped {att['filename']}")
+                duplicates += 1
+            elif result['status'] == 'success':
+                print(f"✅ Receipt processed! ({att['filename']})")
+                expenses.append(result['data'])
+                fingerprints.append(result.get('fingerprint'))
+            elif result['status'] == 'duplicate':
+                print(f"♻️  Already saved, skipped {att['filename']}: {result.get('message')}")
+                duplicates += 1
+            else:
+                print(f"❌ Processing failed for {att['filename']}: {result.get('message')}")
+        self.duplicates += duplicates
+        metrics.inc('emails_total')
+        
+        # Email is marked read / confirmed in on_rows_saved after the flush
+        if expenses:
+            self.writer.add_many(expenses, tag=(email_id, sender), fingerprints=fingerprints)
+        elif duplicates:
+            # Nothing new in it: already handled, no confirmation needed
+            self.mark_read(email_id)
+        
+        return len(expenses) > 0 or duplicates > 0
+    
+    def mark_read(self, email_id):
+        """Queue an email for the next batched read-mark (see flush_read)"""
+        self.journal_read(self.gmail.mark_read_later(email_id))
+    
+    def flush_read(self):
+        """Mark every queued email read in one request; returns the ids marked"""
+        return self.journal_read(self.gmail.flush_read())
+    
+    def journal_read(self, email_ids):
+        """Journal the emails whose read-mark went through"""
+        if self.journal is not None:
+            for email_id in email_ids:
+                self.journal.advance(email_id, 'read')
+        return email_ids
+    
+    def on_rows_saved(self, landed):
+        """Writer callback: journal the saved rows, then mark emails read and confirm"""
+        self.record_written(landed)
+        self.confirm_emails(landed)
+    
+    def record_written(self, landed):
+        """Journal emails whose rows just landed in the sheet (before anything else can fail)"""
+        if self.journal is None:
+            return
+        for email_id, sender in {entry['tag'] for entry in landed if entry['tag']}:
+            self.journal.mark_written(email_id, sender)
+    
+    def confirm_emails(self, landed):
+        """Mark emails read and confirm once their rows are in the sheet"""
+        emails = {}
+        for entry in landed:
+            if entry['tag']:
+                # Keep the last saved expense per email for the confirmation
+                if entry.get('duplicate'):
+                    emails.setdefault(entry['tag'], None)
                 else:
-                    print(f"❌ Processing failed: {result.get('message')}")
-                
-            except Exception as e:
-                print(f"❌ Error: {str(e)}")
+                    emails[entry['tag']] = entry['data']
+        
+        for (email_id, sender), expense_data in emails.items():
+            self.mark_read(email_id)
             
-            finally:
-                # Clean up temp file
-                if temp_path.exists():
-                    temp_path.unlink()
-        
-        # Mark email as read
-        if success_count > 0:
-            self.gmail.mark_as_read(email_id)
+            # Only duplicates (or confirmed before a restart): nothing new to confirm
+            if expense_data is None:
+                continue
+            if self.journal is not None and self.journal.stage(email_id) == 'confirmed':
+                continue
             
             # Send confirmation (extract sender email)
             sender_email = sender.split('<')[-1].strip('>')
-            expense_data = result.get('data', {})
-            self.gmail.send_confirmation(sender_email, expense_data)
-        
-        return success_count > 0
+            if self.gmail.send_confirmation(sender_email, expense_data) and self.journal is not None:
+                self.journal.advance(email_id, 'confirmed')
     
-    def run_once(self):
-        """Check for new emails and process them (one-time run)"""
+    def run_once(self, incremental=False, full_sync=False, batch_extraction=EXTRACTION_BATCHING):
+        """
+        Check for new emails and process them (one-time run)
+        
+        With incremental=True only emails added since the last saved Gmail
+        history ID are looked at, instead of re-running the full search.
+        full_sync=True forces a full search that also resets the checkpoint.
+        batch_extraction=True packs the receipts of all found emails into as
+        few OpenAI requests as possible (see process_receipts).
+        """
         print("\n🔍 Checking for new receipt emails...\n")
         
         # Get unread receipts
-        emails = self.gmail.get_unread_receipts()
+        if incremental:
+            emails = self.gmail.get_new_receipts(full=full_sync)
+        else:
+            emails = self.gmail.get_unread_receipts()
         
         if not emails:
             print("✨ No new receipts to process")
@@ -105,28 +295,81 @@ class EmailProcessor:
         
         # Process each email
         processed = 0
-        for email in emails:
-            if self.process_single_email(email):
-                processed += 1
+        saved_before = self.writer.total_saved
+        duplicates_before = self.duplicates + self.writer.total_duplicates
+        if batch_extraction:
+            processed = self.process_emails_batched(emails)
+        else:
+            for email in emails:
+                if self.process_single_email(email):
+                    processed += 1
+        
+        # Write everything still buffered in one request, then mark the
+        # emails read together
+        self.writer.flush()
+        self.flush_read()
+        saved = self.writer.total_saved - saved_before
+        duplicates = self.duplicates + self.writer.total_duplicates - duplicates_before
         
         print(f"\n{'='*60}")
-        print(f"📊 SUMMARY: Processed {processed}/{len(emails)} email(s)")
+        print(f"📊 SUMMARY: Processed {processed}/{len(emails)} email(s), saved {saved} row(s), "
+              f"skipped {duplicates} duplicate(s)")
+        print(f"⚡ {ocr_cache.summary()}")
+        print(f"⚡ {extraction_cache.summary()}")
+        print(f"⚡ {fast_path_stats.summary()}")
+        for line in rate_limit.summary():
+            print(f"🚦 {line}")
+        if self.sheets.dedup is not None:
+            print(f"♻️  {self.sheets.dedup.summary()}")
+        if self.journal is not None:
+            print(f"↩️  {self.journal.summary()}")
         print(f"{'='*60}\n")
         
         return processed
     
-    def run_continuous(self, interval=60):
-        """Monitor continuously (check every N seconds)"""
-        print(f"\n🔄 Starting continuous monitoring (checking every {interval}s)")
+    def run_continuous(self, interval=60, incremental=False):
+        """
+        Monitor continuously (check every N seconds)
+        
+        In incremental mode every GMAIL_FULL_SYNC_EVERY-th check is still a
+        full search, so unread emails that failed earlier get retried.
+        Stage latencies and counters are printed every METRICS_SUMMARY_INTERVAL
+        seconds (and served on METRICS_PORT if set).
+        """
+        mode = "incremental" if incremental else "full search"
+        print(f"\n🔄 Starting continuous monitoring (checking every {interval}s, {mode})")
         print("   Press Ctrl+C to stop\n")
+        metrics.serve()
         
         try:
+            tick = 0
+            last_summary = time.monotonic()
             while True:
-                self.run_once()
+                full_sync = incremental and (
+                    tick == 0 or (GMAIL_FULL_SYNC_EVERY > 0 and tick % GMAIL_FULL_SYNC_EVERY == 0)
+                )
+                self.run_once(incremental=incremental, full_sync=full_sync)
+                tick += 1
+                if metrics.enabled() and time.monotonic() - last_summary >= METRICS_SUMMARY_INTERVAL:
+                    self.print_metrics()
+                    last_summary = time.monotonic()
                 print(f"😴 Sleeping for {interval} seconds...")
                 time.sleep(interval)
         except KeyboardInterrupt:
             print("\n\n👋 Stopping email processor...")
+            self.writer.flush()
+            self.flush_read()
+            self.print_metrics()
+    
+    def print_metrics(self):
+        """Per-stage latency and counters since startup (see metrics.py)"""
+        lines = metrics.summary_lines()
+        if not lines:
+            return
+        print("\n📈 METRICS since startup")
+        for line in lines:
+            print(f"   {line}")
+        print()
 
 
 def main():
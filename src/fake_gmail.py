@@ -0,0 +1,347 @@
+"""
+Local fake of the Gmail API service object - lets tests run GmailMonitor offline
+
+Mimics the googleapiclient call chain, e.g.
+    service.users().history().list(userId='me', startHistoryId=...).execute()
+
+Pass faults (see fake_services.Faults) to add latency and injected errors
+to every request, e.g. for benchmarks.
+"""
+import re
+import copy
+import json
+import base64
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+
+def http_error(status, reason='', retry_after=None):
+    """Build the same HttpError googleapiclient raises for a failed request"""
+    headers = {'status': status}
+    if retry_after is not None:
+        headers['retry-after'] = str(retry_after)
+    return HttpError(httplib2.Response(headers), reason.encode())
+
+
+# Default attachment body: big enough not to be skipped as a tracking pixel
+FAKE_IMAGE = b'fake image' + bytes(8 * 1024)
+
+# Body of the text/html part every fake message carries
+FAKE_HTML = ('<html><body><table>' + '<tr><td>Thank you for your order</td></tr>' * 60
+             + '</table></body></html>').encode()
+
+
+def walk_all(part):
+    """Every part of a MIME tree (containers included), depth first"""
+    yield part
+    for child in part.get('parts', []):
+        yield from walk_all(child)
+
+
+def apply_fields(message, fields):
+    """
+    Rough emulation of a partial response (fields=...) for a message
+
+    Keeps the top-level keys named in the mask and drops body data unless
+    the mask asks for it (data, or a whole body). Does not validate the mask.
+    """
+    if not fields:
+        return message
+    top_level = fields
+    while '(' in top_level:
+        top_level = re.sub(r'\([^()]*\)', '', top_level)   # drop sub-selections, innermost first
+    names = {name.strip() for name in top_level.split(',')}
+    result = {key: copy.deepcopy(value) for key, value in message.items() if key in names}
+    if 'payload' in result and not re.search(r'\bdata\b|\bbody\b(?!\()', fields):
+        for part in walk_all(result['payload']):
+            part.get('body', {}).pop('data', None)
+    return result
+
+
+def change_labels(message, body):
+    """Apply a modify / batchModify body's removeLabelIds and addLabelIds"""
+    for label in body.get('removeLabelIds', []):
+        if label in message['labelIds']:
+            message['labelIds'].remove(label)
+    for label in body.get('addLabelIds', []):
+        if label not in message['labelIds']:
+            message['labelIds'].append(label)
+
+
+class FakeRequest:
+    """Deferred call, executed by .execute() like a googleapiclient HttpRequest"""
+
+    def __init__(self, func, faults=None):
+        self.func = func
+        self.faults = faults
+
+    def execute(self):
+        if self.faults is not None:
+            self.faults.hit(http_error)
+        return self.func()
+
+
+class FakeBatchRequest:
+    """Mimics BatchHttpRequest: runs queued requests and reports each to the callback"""
+
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        self.requests.append((request_id or str(len(self.requests)), request))
+
+    def execute(self):
+        self.service.calls.append(('batch', len(self.requests)))
+        faults = self.service.faults
+        if faults is not None:
+            # One round trip for the whole batch; sub-requests can still fail one by one
+            faults.hit(http_error)
+        for request_id, request in self.requests:
+            try:
+                if faults is not None:
+                    faults.check(http_error)
+                response = request.func()
+            except HttpError as e:
+                self.callback(request_id, None, e)
+            else:
+                self.callback(request_id, response, None)
+
+
+class FakeGmailService:
+    """
+    In-memory mailbox with a history log
+
+    add_message() records a 'messageAdded' history entry like Gmail does.
+    expire_history() makes older history IDs answer 404, as Gmail does
+    once a checkpoint falls out of its history window.
+    """
+
+    def __init__(self, page_size=100, faults=None):
+        self.mailbox = {}
+        self.attachment_data = {}
+        self.history_log = []
+        self.history_id = 1000
+        self.oldest_history_id = self.history_id
+        self.page_size = page_size
+        self.faults = faults
+        self.calls = []
+        self.bytes_sent = 0
+        self.user_labels = {}
+
+    # --- test helpers ---
+
+    def add_message(self, subject, filenames=('receipt.jpg',), unread=True, data=FAKE_IMAGE,
+                    sender='Shop <shop@example.com>', mime_type='image/jpeg', inline=True, nested=False):
+        """
+        Add a message to the inbox and return its id
+
+        data and mime_type are one value for all filenames, or a list with one
+        per filename. With inline=False the bodies only carry an attachmentId and
+        have to be downloaded with attachments().get, as Gmail does for all
+        but the smallest files. Every message has a text/html body next to the
+        attachments; nested=True puts both inside a multipart/related part
+        (multipart/mixed → multipart/related), like many shop receipts.
+        """
+        self.history_id += 1
+        message_id = f"msg{len(self.mailbox) + 1}"
+        bodies = data if isinstance(data, (list, tuple)) else [data] * len(filenames)
+        mime_types = mime_type if isinstance(mime_type, (list, tuple)) else [mime_type] * len(filenames)
+        prefix = '0.' if nested else ''
+        parts = [{'partId': f"{prefix}0", 'mimeType': 'text/html', 'filename': '',
+                  'body': {'data': base64.urlsafe_b64encode(FAKE_HTML).decode(), 'size': len(FAKE_HTML)}}]
+        for index, (filename, body, mime_type) in enumerate(zip(filenames, bodies, mime_types)):
+            encoded = base64.urlsafe_b64encode(body).decode()
+            part = {'partId': f"{prefix}{index + 1}", 'filename': filename, 'mimeType': mime_type}
+            if inline:
+                part['body'] = {'data': encoded, 'size': len(body)}
+            else:
+                attachment_id = f"{message_id}-att{index}"
+                self.attachment_data[attachment_id] = encoded
+                part['body'] = {'attachmentId': attachment_id, 'size': len(body)}
+            parts.append(part)
+        if nested:
+            parts = [{'partId': '0', 'mimeType': 'multipart/related', 'filename': '',
+                      'body': {'size': 0}, 'parts': parts}]
+        self.mailbox[message_id] = {
+            'id': message_id,
+            'threadId': message_id,
+            'historyId': str(self.history_id),
+            'labelIds': ['INBOX'] + (['UNREAD'] if unread else []),
+            'snippet': 'Thank you for your order',
+            'payload': {
+                'partId': '',
+                'mimeType': 'multipart/mixed',
+                'filename': '',
+                'headers': [
+                    {'name': 'Subject', 'value': subject},
+                    {'name': 'From', 'value': sender},
+                ],
+                'body': {'size': 0},
+                'parts': parts,
+            },
+        }
+        self.history_log.append({
+            'id': str(self.history_id),
+            'messagesAdded': [{'message': {'id': message_id}}],
+        })
+        return message_id
+
+    def expire_history(self):
+        """Forget all history up to now (old checkpoints will get a 404)"""
+        self.oldest_history_id = self.history_id
+
+    def matches_query(self, message, query):
+        """Tiny subset of Gmail search: is:unread, has:attachment, -label: and subject words"""
+        if 'is:unread' in query and 'UNREAD' not in message['labelIds']:
+            return False
+        for name, label in self.user_labels.items():
+            if f"-label:{re.sub(r'[^a-z0-9_-]+', '-', name.lower())}" in query and label['id'] in message['labelIds']:
+                return False
+        if 'has:attachment' in query and not any(p.get('filename') for p in walk_all(message['payload'])):
+            return False
+        words = [term.split(':', 1)[1] for term in query.replace('(', ' ').replace(')', ' ').split()
+                 if term.startswith('subject:')]
+        if words:
+            subject = next(h['value'] for h in message['payload']['headers'] if h['name'] == 'Subject')
+            return any(word.lower() in subject.lower().split() for word in words)
+        return True
+
+    def request(self, func):
+        """Deferred call that goes through the configured faults (response size counted in bytes_sent)"""
+        def run():
+            response = func()
+            self.bytes_sent += len(json.dumps(response))
+            return response
+        return FakeRequest(run, self.faults)
+
+    # --- googleapiclient-style call chain ---
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return FakeMessages(self)
+
+    def history(self):
+        return FakeHistory(self)
+
+    def labels(self):
+        return FakeLabels(self)
+
+    def getProfile(self, userId):
+        return self.request(lambda: {'historyId': str(self.history_id)})
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatchRequest(self, callback)
+
+
+class FakeMessages:
+    """users().messages()"""
+
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, userId, q='', pageToken=None):
+        def run():
+            self.service.calls.append(('messages.list', q))
+            ids = [m for m, msg in self.service.mailbox.items() if self.service.matches_query(msg, q)]
+            start = int(pageToken or 0)
+            page = ids[start:start + self.service.page_size]
+            result = {'messages': [{'id': m} for m in page], 'resultSizeEstimate': len(ids)}
+            if start + self.service.page_size < len(ids):
+                result['nextPageToken'] = str(start + self.service.page_size)
+            return result
+        return self.service.request(run)
+
+    def get(self, userId, id, format='full', fields=None):
+        def run():
+            self.service.calls.append(('messages.get', id))
+            if id not in self.service.mailbox:
+                raise http_error(404, 'Not Found')
+            return apply_fields(self.service.mailbox[id], fields)
+        return self.service.request(run)
+
+    def modify(self, userId, id, body):
+        def run():
+            self.service.calls.append(('messages.modify', id))
+            message = self.service.mailbox[id]
+            change_labels(message, body)
+            return message
+        return self.service.request(run)
+
+    def batchModify(self, userId, body):
+        def run():
+            self.service.calls.append(('messages.batchModify', len(body['ids'])))
+            for message_id in body['ids']:
+                change_labels(self.service.mailbox[message_id], body)
+            return ''
+        return self.service.request(run)
+
+    def send(self, userId, body):
+        def run():
+            self.service.calls.append(('messages.send', None))
+            return {'id': 'sent'}
+        return self.service.request(run)
+
+    def attachments(self):
+        return FakeAttachments(self.service)
+
+
+class FakeAttachments:
+    """users().messages().attachments()"""
+
+    def __init__(self, service):
+        self.service = service
+
+    def get(self, userId, messageId, id):
+        def run():
+            self.service.calls.append(('attachments.get', id))
+            if id not in self.service.attachment_data:
+                raise http_error(404, 'Not Found')
+            return {'data': self.service.attachment_data[id], 'size': len(self.service.attachment_data[id])}
+        return self.service.request(run)
+
+
+class FakeLabels:
+    """users().labels()"""
+
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, userId):
+        def run():
+            self.service.calls.append(('labels.list', None))
+            return {'labels': list(self.service.user_labels.values())}
+        return self.service.request(run)
+
+    def create(self, userId, body):
+        def run():
+            self.service.calls.append(('labels.create', body['name']))
+            label = dict(body, id=f"Label_{len(self.service.user_labels) + 1}", type='user')
+            self.service.user_labels[body['name']] = label
+            return label
+        return self.service.request(run)
+
+
+class FakeHistory:
+    """users().history()"""
+
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, userId, startHistoryId, historyTypes=None, pageToken=None):
+        def run():
+            self.service.calls.append(('history.list', startHistoryId))
+            if int(startHistoryId) < self.service.oldest_history_id:
+                raise http_error(404, 'Requested entity was not found.')
+            records = [r for r in self.service.history_log if int(r['id']) > int(startHistoryId)]
+            start = int(pageToken or 0)
+            page = records[start:start + self.service.page_size]
+            result = {'history': page, 'historyId': str(self.service.history_id)}
+            if start + self.service.page_size < len(records):
+                result['nextPageToken'] = str(start + self.service.page_size)
+            return result
+        return self.service.request(run)
@@ -0,0 +1,218 @@
+"""
+Local fakes of Sheets, OpenAI and the OCR engine - run the pipeline offline
+
+Together with FakeGmailService (fake_gmail.py) they let EmailProcessor run
+end to end without credentials, e.g. for bench_pipeline.py. Each fake takes
+a Faults object that adds latency and injects throttling / server errors,
+raised the same way the real client libraries raise them so the shared rate
+limiter's retry path is exercised.
+"""
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from types import SimpleNamespace
+
+from fake_gmail import FakeRequest
+from batch_extract import estimate_tokens
+from fast_extract import REQUIRED_FIELDS, OPTIONAL_FIELDS
+
+
+class Faults:
+    """
+    Latency and error injection for one fake service
+
+    Every call waits latency seconds (plus up to jitter more) and then fails
+    with error_status at the given rate. retry_after is sent with the error
+    (None = no Retry-After header).
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=429, retry_after=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.injected = 0
+
+    def wait(self, extra=0.0):
+        """Sleep for one call's latency (extra seconds on top)"""
+        with self.lock:
+            self.calls += 1
+            delay = self.latency + extra + (self.random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def check(self, make_error):
+        """Raise make_error(status, reason, retry_after) for a share of calls"""
+        with self.lock:
+            fail = self.error_rate > 0 and self.random.random() < self.error_rate
+            if fail:
+                self.injected += 1
+        if fail:
+            raise make_error(self.error_status, 'Injected error', self.retry_after)
+
+    def hit(self, make_error, extra=0.0):
+        """wait() then check()"""
+        self.wait(extra)
+        self.check(make_error)
+
+
+class FakeSheetsService:
+    """
+    In-memory spreadsheet behind the spreadsheets().values() call chain
+
+    append() reports the rows it wrote in updates.updatedRange like the real
+    API, so the ledger and dedup index see real row numbers.
+    """
+
+    def __init__(self, faults=None):
+        self.faults = faults
+        self.rows = [['Date', 'Vendor', 'Category', 'Total', 'Currency', 'Tax', 'Items', 'Processed At']]
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def request(self, func):
+        return FakeRequest(func, self.faults)
+
+    # --- googleapiclient-style call chain ---
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def append(self, spreadsheetId, range, valueInputOption, body):
+        def run():
+            with self.lock:
+                self.calls.append(('append', len(body['values'])))
+                first = len(self.rows) + 1
+                self.rows.extend(body['values'])
+                last = len(self.rows)
+            return {'updates': {'updatedRange': f"Sheet1!A{first}:H{last}", 'updatedRows': last - first + 1}}
+        return self.request(run)
+
+    def get(self, spreadsheetId, range, **options):
+        def run():
+            with self.lock:
+                self.calls.append(('get', range))
+                start = re.match(r'[A-Z]+(\d+)', range)
+                start = int(start.group(1)) if start else 1
+                return {'range': range, 'values': [list(row) for row in self.rows[start - 1:]]}
+        return self.request(run)
+
+    def update(self, spreadsheetId, range, valueInputOption, body):
+        def run():
+            with self.lock:
+                self.calls.append(('update', range))
+                self.rows[0] = body['values'][0]
+            return {'updatedRange': range}
+        return self.request(run)
+
+
+class FakeAPIError(Exception):
+    """Error shaped like openai.APIStatusError (status_code + response headers)"""
+
+    def __init__(self, status, reason='', retry_after=None):
+        super().__init__(f"Error code: {status} - {reason}")
+        self.status_code = status
+        self.headers = {'retry-after': str(retry_after)} if retry_after is not None else {}
+
+
+class FakeOpenAIClient:
+    """
+    Answers chat.completions.create from known receipt data
+
+    answers maps a receipt number (found in the OCR text by receipt_id) to
+    its data. Single and batched (batch_extract.py) requests are both
+    understood; only the requested fields are returned. per_receipt adds
+    latency for every receipt in a request (longer answers take longer).
+    """
+
+    def __init__(self, answers, faults=None, per_receipt=0.0, receipt_id=r'Bill No:\s*(\S+)'):
+        self.answers = answers
+        self.faults = faults
+        self.per_receipt = per_receipt
+        self.receipt_id = re.compile(receipt_id)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.receipts = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def answer(self, text, fields):
+        match = self.receipt_id.search(text)
+        data = self.answers.get(match.group(1), {}) if match else {}
+        return {field: data.get(field) for field in fields}
+
+    def create(self, model, messages, response_format=None, **kwargs):
+        system, user = messages[0]['content'], messages[-1]['content']
+
+        sections = re.split(r'^### Receipt (\S+) \(fields: ([^)]*)\)\n', user, flags=re.MULTILINE)
+        if len(sections) > 1:
+            # Batched request: [preamble, id, fields, text, id, fields, text, ...]
+            receipts = [
+                dict(self.answer(text, fields.split(', ')), id=item_id)
+                for item_id, fields, text in zip(sections[1::3], sections[2::3], sections[3::3])
+            ]
+            content = {'receipts': receipts}
+        else:
+            needed = re.search(r'Only these fields are needed: (.*)\.', system)
+            content = self.answer(user, needed.group(1).split(', ') if needed else REQUIRED_FIELDS + OPTIONAL_FIELDS)
+            receipts = [content]
+
+        if self.faults is not None:
+            self.faults.hit(FakeAPIError, extra=self.per_receipt * len(receipts))
+        with self.lock:
+            self.requests += 1
+            self.receipts += len(receipts)
+
+        content = json.dumps(content)
+        usage = SimpleNamespace(prompt_tokens=estimate_tokens(system + user), completion_tokens=estimate_tokens(content))
+        usage.total_tokens = usage.prompt_tokens + usage.completion_tokens
+        return SimpleNamespace(
+            model=model, usage=usage,
+            choices=[SimpleNamespace(index=0, finish_reason='stop',
+                                     message=SimpleNamespace(role='assistant', content=content))]
+        )
+
+
+def image_digest(image):
+    """Key for a decoded (and preprocessed) image, as the OCR engine receives it"""
+    return hashlib.sha256(image.mode.encode() + repr(image.size).encode() + image.tobytes()).hexdigest()
+
+
+class FakeOCREngine:
+    """
+    OCR engine (see ocr_engine.py) that returns known text for known images
+
+    texts maps image_digest() of the image the engine will be given to its
+    text; unknown images read as empty text.
+    """
+
+    name = 'fake'
+
+    def __init__(self, texts, faults=None):
+        self.texts = texts
+        self.faults = faults
+        self.misses = 0
+
+    def version(self):
+        return 'fake'
+
+    def image_to_string(self, image, lang='eng', config=''):
+        if self.faults is not None:
+            self.faults.wait()
+        text = self.texts.get(image_digest(image))
+        if text is None:
+            self.misses += 1
+            return ''
+        return text
+
+    def close(self):
+        pass
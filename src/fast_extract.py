@@ -0,0 +1,278 @@
+"""
+Rule-based receipt extractor (fast path before the LLM)
+
+Reads total, date, currency, tax, vendor and category straight from the
+OCR text with regexes and keyword lists. Every field comes with a
+confidence between 0 and 1; only fields below the threshold are sent to
+the LLM (see process_receipt.extract_fields).
+"""
+import re
+import threading
+from datetime import date
+
+# Fields the LLM is asked for when the fast path is not confident about them
+REQUIRED_FIELDS = ['vendor', 'date', 'total', 'currency', 'category']
+# Filled when found; a missing tax / item list alone never triggers an LLM call
+OPTIONAL_FIELDS = ['tax', 'items']
+
+# Whole numbers only (never starting inside one), 1 or 2 decimals: 1,234.5 / 945.00
+AMOUNT = r'(?<![\d.,])(\d{1,3}(?:,\d{3})+|\d+)(?:[.,](\d{1,2}))?(?!\d)'
+
+# (regex, confidence), strongest wording first. "Amount paid" is left out:
+# it is the cash handed over, which can be more than the bill. "Net amount"
+# is often the amount before tax, so it ranks below a plain "total" (and
+# below FAST_PATH_MIN_CONFIDENCE unless subtotal + tax confirms it).
+TOTAL_KEYWORDS = [
+    (r'grand\s*total', 0.95),
+    (r'(?:amount|balance|total)\s*(?:due|payable)', 0.95),
+    (r'total\s*amount', 0.9),
+    (r'(?<!sub)(?<!sub )(?<!net)(?<!net )total', 0.85),
+    (r'net\s*(?:total|amount)', 0.75),
+]
+NOT_TOTAL = re.compile(
+    r'sub\s*total|total\s*(?:tax|qty|quantity|items?|savings?|discount)|\b(?:paid|tendered|change)\b', re.I
+)
+SUBTOTAL = re.compile(r'sub\s*total', re.I)
+NET_AMOUNT = re.compile(r'net\s*(?:total|amount)', re.I)
+TAX_LINE = re.compile(r'\b(?:c?gst|sgst|igst|vat|tax)\b', re.I)
+PERCENT = re.compile(r'\d+(?:\.\d+)?\s*%')
+
+# Total confidence when subtotal + tax does not add up: below any sensible
+# FAST_PATH_MIN_CONFIDENCE, so the LLM reads the total instead
+MISMATCH_CONFIDENCE = 0.5
+
+CURRENCIES = [
+    (re.compile(r'₹|\bINR\b|\bRs\b', re.I), 'INR'),
+    (re.compile(r'€|\bEUR\b'), 'EUR'),
+    (re.compile(r'£|\bGBP\b'), 'GBP'),
+    (re.compile(r'\bUSD\b|US\$'), 'USD'),
+    (re.compile(r'\$'), 'USD'),
+]
+
+MONTHS = {m: i for i, m in enumerate(
+    ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'], start=1)}
+MONTH = r'(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?'
+
+CATEGORY_KEYWORDS = {
+    'Food': ['restaurant', 'cafe', 'coffee', 'starbucks', 'pizza', 'burger', 'kitchen', 'bakery',
+             'dine', 'food', 'swiggy', 'zomato', 'bar & grill', 'mcdonald', 'domino', 'kfc'],
+    'Transport': ['uber', 'ola', 'lyft', 'taxi', 'cab', 'fuel', 'petrol', 'diesel', 'parking',
+                  'metro', 'railway', 'airlines', 'toll'],
+    'Shopping': ['mart', 'store', 'supermarket', 'retail', 'amazon', 'flipkart', 'mall',
+                 'fashion', 'electronics', 'pharmacy'],
+    'Services': ['salon', 'spa', 'laundry', 'repair', 'clinic', 'hospital', 'internet',
+                 'mobile recharge', 'subscription', 'consulting'],
+}
+
+NOT_VENDOR = re.compile(
+    r'\b(?:receipt|invoice|bill|tax|gst|welcome|thanks?|date|time|order|table|cashier|tel|phone)\b', re.I
+)
+
+
+def parse_amount(match):
+    """Regex match of AMOUNT → float"""
+    whole = match.group(1).replace(',', '')
+    cents = match.group(2) or '00'
+    return float(f"{whole}.{cents}")
+
+
+def last_amount(line):
+    """Last money amount on a line (percentages ignored), or None"""
+    matches = list(re.finditer(AMOUNT, PERCENT.sub(' ', line)))
+    return parse_amount(matches[-1]) if matches else None
+
+
+def find_subtotal(lines, tax=None):
+    """
+    Amount on the first subtotal line, or None
+
+    With tax lines present, a net amount line counts as the subtotal too
+    (without them it could only ever confirm itself).
+    """
+    for pattern in (SUBTOTAL, NET_AMOUNT) if tax else (SUBTOTAL,):
+        for line in lines:
+            if pattern.search(line):
+                value = last_amount(line)
+                if value is not None:
+                    return value
+    return None
+
+
+def find_total(lines, expected=None):
+    """
+    (total, confidence) from the strongest 'total' line
+
+    A candidate equal to expected (subtotal + tax) wins over stronger
+    wording; otherwise the largest amount of the strongest keyword.
+    """
+    found = []
+    for pattern, confidence in TOTAL_KEYWORDS:
+        values = []
+        for line in lines:
+            if re.search(pattern, line, re.I) and not NOT_TOTAL.search(line):
+                value = last_amount(line)
+                if value is not None:
+                    values.append(value)
+        if values:
+            found.append((values, confidence))
+    if not found:
+        return None, 0.0
+    if expected is not None:
+        for values, confidence in found:
+            if any(abs(value - expected) < 0.02 for value in values):
+                return round(expected, 2), confidence
+    values, confidence = found[0]
+    # Several different totals (e.g. before/after rounding, or in other tiers) → less sure
+    if len({value for tier, _ in found for value in tier}) > 1:
+        confidence -= 0.15
+    return max(values), confidence
+
+
+def find_tax(lines):
+    """(tax, confidence): sum of tax lines such as CGST + SGST"""
+    values = []
+    for line in lines:
+        if TAX_LINE.search(line) and not re.search(r'total|incl|gstin|tax\s*invoice', line, re.I):
+            value = last_amount(line)
+            if value is not None:
+                values.append(value)
+    if not values:
+        return None, 0.0
+    return round(sum(values), 2), 0.85
+
+
+def check_total(total, confidence, lines, tax):
+    """Raise confidence when subtotal + tax adds up to the total, lower it when not"""
+    subtotal = find_subtotal(lines, tax)
+    if total is None or subtotal is None:
+        return confidence
+    if abs(subtotal + (tax or 0) - total) < 0.02:
+        return max(confidence, 0.99)
+    return min(confidence, MISMATCH_CONFIDENCE)
+
+
+def make_date(year, month, day):
+    """ISO date string, or None if the numbers are not a real date"""
+    year = int(year)
+    if year < 100:
+        year += 2000
+    try:
+        return date(year, int(month), int(day)).isoformat()
+    except ValueError:
+        return None
+
+
+def find_dates(text):
+    """All (iso_date, confidence) candidates in the text"""
+    found = []
+    for m in re.finditer(r'\b(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})\b', text):
+        found.append((make_date(m.group(1), m.group(2), m.group(3)), 0.95))
+    for m in re.finditer(r'\b(\d{1,2})[-/.](\d{1,2})[-/.](\d{4}|\d{2})\b', text):
+        first, second, year = int(m.group(1)), int(m.group(2)), m.group(3)
+        if first > 12:
+            found.append((make_date(year, second, first), 0.9))
+        elif second > 12:
+            found.append((make_date(year, first, second), 0.9))
+        else:
+            # Ambiguous: day first (the usual order on our receipts)
+            found.append((make_date(year, second, first), 0.6))
+    for m in re.finditer(r'\b(\d{1,2})(?:st|nd|rd|th)?[\s-]*' + MONTH + r'[\s,-]*(\d{4}|\d{2})\b', text, re.I):
+        found.append((make_date(m.group(3), MONTHS[m.group(2).lower()], m.group(1)), 0.95))
+    for m in re.finditer(r'\b' + MONTH + r'\s+(\d{1,2})(?:st|nd|rd|th)?,?\s+(\d{4})\b', text, re.I):
+        found.append((make_date(m.group(3), MONTHS[m.group(1).lower()], m.group(2)), 0.95))
+    return [(value, confidence) for value, confidence in found if value]
+
+
+def find_date(text):
+    """(date, confidence); conflicting dates lower the confidence"""
+    found = find_dates(text)
+    if not found:
+        return None, 0.0
+    value, confidence = max(found, key=lambda candidate: candidate[1])
+    if len({candidate for candidate, _ in found}) > 1:
+        confidence -= 0.2
+    return value, confidence
+
+
+def find_currency(text):
+    """(currency code, confidence) from symbols / codes in the text"""
+    for pattern, code in CURRENCIES:
+        if pattern.search(text):
+            return code, 0.9
+    return None, 0.0
+
+
+def find_vendor(lines):
+    """(vendor, confidence): the first name-like line at the top of the receipt"""
+    for position, line in enumerate(lines[:5]):
+        letters = sum(c.isalpha() for c in line)
+        if letters < 3 or letters < len(line) * 0.6 or NOT_VENDOR.search(line):
+            continue
+        confidence = 0.85 if position <= 1 and len(line) <= 40 else 0.6
+        return line.strip(' *-=#:'), confidence
+    return None, 0.0
+
+
+def find_category(text, vendor):
+    """(category, confidence) from keywords in the vendor name or text"""
+    for source, confidence in ((vendor or '', 0.9), (text, 0.75)):
+        lowered = source.lower()
+        for category, keywords in CATEGORY_KEYWORDS.items():
+            if any(re.search(r'\b' + re.escape(k) + r'\b', lowered) for k in keywords):
+                return category, confidence
+    return None, 0.0
+
+
+def fast_extract(raw_text):
+    """
+    OCR text → (data, confidence) without calling any API
+
+    data has the same keys as the LLM output (None where nothing was found);
+    confidence maps each field to a score between 0 and 1.
+    """
+    lines = [line.strip() for line in raw_text.splitlines() if line.strip()]
+    data = {}
+    confidence = {}
+
+    data['tax'], confidence['tax'] = find_tax(lines)
+    subtotal = find_subtotal(lines, data['tax'])
+    expected = subtotal + (data['tax'] or 0) if subtotal is not None else None
+    total, total_confidence = find_total(lines, expected)
+    data['total'] = total
+    confidence['total'] = check_total(total, total_confidence, lines, data['tax'])
+    data['date'], confidence['date'] = find_date(raw_text)
+    data['currency'], confidence['currency'] = find_currency(raw_text)
+    data['vendor'], confidence['vendor'] = find_vendor(lines)
+    data['category'], confidence['category'] = find_category(raw_text, data['vendor'])
+    data['items'], confidence['items'] = None, 0.0
+
+    return data, confidence
+
+
+def low_confidence_fields(confidence, min_confidence):
+    """Required fields the fast path is not sure enough about"""
+    return [field for field in REQUIRED_FIELDS if confidence.get(field, 0.0) < min_confidence]
+
+
+class FastPathStats:
+    """How often receipts were extracted without (or with a smaller) LLM call"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fast = 0
+        self.partial = 0
+        self.llm = 0
+        self.fields_from_rules = 0
+
+    def record(self, source, fields_from_rules=0):
+        """source: 'fast' (no LLM), 'partial' (LLM for some fields) or 'llm'"""
+        with self.lock:
+            setattr(self, source, getattr(self, source) + 1)
+            self.fields_from_rules += fields_from_rules
+
+    def summary(self):
+        total = self.fast + self.partial + self.llm
+        rate = self.fast / total * 100 if total else 0.0
+        return (f"Fast path: {self.fast}/{total} receipt(s) without LLM ({rate:.0f}%), "
+                f"{self.partial} partial, {self.llm} full LLM, "
+                f"{self.fields_from_rules} field(s) read by rules")
@@ -1,165 +1,619 @@
 """
 Gmail API integration - monitor inbox for receipt emails
 """
+import io
 import os
+import atexit
+import re
+import json
 import base64
 import pickle
+import binascii
+import threading
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 
-from config import GMAIL_CREDENTIALS_PATH, GMAIL_TOKEN_PATH
+from config import (
+    GMAIL_HISTORY_PATH, GMAIL_BATCH_FETCH, GMAIL_BATCH_SIZE, GMAIL_MARK_READ_BATCH, GMAIL_PROCESSED_LABEL,
+    ATTACHMENT_DOWNLOAD_WORKERS, ATTACHMENT_MIN_BYTES, ATTACHMENT_MAX_BYTES,
+    ATTACHMENT_DECORATION_MAX_BYTES
+)
+from google_services import get_service, APIS
+from rate_limit import execute, get_limiter, is_retryable
+import metrics
 
 # Gmail API scopes
-SCOPES = [
-    'https://www.googleapis.com/auth/gmail.readonly',
-    'https://www.googleapis.com/auth/gmail.send',
-    'https://www.googleapis.com/auth/gmail.modify'
-]
+SCOPES = APIS['gmail'][1]
+
+# Search query for receipt emails
+RECEIPT_QUERY = 'is:unread has:attachment (subject:receipt OR subject:invoice OR subject:order)'
+# Local equivalent of the subject part of RECEIPT_QUERY (used for incremental sync)
+RECEIPT_SUBJECT = re.compile(r'\b(receipt|invoice|order)\b', re.IGNORECASE)
+
+# Attachments sent with a generic MIME type are judged by their extension
+GENERIC_MIME_TYPES = ('application/octet-stream', 'binary/octet-stream', 'application/x-download')
+RECEIPT_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.tif', '.tiff', '.bmp', '.heic', '.pdf')
+# Image types that are email decoration (or that Pillow cannot read), never receipts
+DECORATION_MIME_TYPES = ('image/gif', 'image/svg+xml', 'image/x-icon', 'image/vnd.microsoft.icon')
+# Whole filename tokens only: "Iconic_Mall_bill.jpg" or "Silicon.png" is not an icon
+DECORATION_NAME = re.compile(r'(?:^|[\W_\d])(?:logo|icon|banner|spacer|pixel|signature|badge|'
+                             r'facebook|twitter|instagram|linkedin|youtube)s?(?:[\W_\d]|$)', re.IGNORECASE)
+
+# Partial response for the first (metadata) fetch: labels, top-level headers
+# and the MIME tree down to MIME_DEPTH levels of nesting, without body data
+MIME_DEPTH = 5
+
+
+def part_fields(depth):
+    """Field mask of one MIME part and its children (masks do not recurse by themselves)"""
+    fields = 'partId,mimeType,filename,body(size,attachmentId)'
+    if depth > 1:
+        fields += f",parts({part_fields(depth - 1)})"
+    return fields
+
+
+METADATA_FIELDS = f"id,threadId,historyId,labelIds,payload(headers,{part_fields(MIME_DEPTH)})"
+
+# Most message ids one batchModify call accepts
+BATCH_MODIFY_MAX = 1000
+
+# Base64 text decoded per step (a multiple of 4 characters)
+DECODE_CHUNK_CHARS = 256 * 1024
+URLSAFE_TO_STANDARD = bytes.maketrans(b'-_', b'+/')
+
+
+def receipt_query(processed_label=GMAIL_PROCESSED_LABEL):
+    """RECEIPT_QUERY, also excluding emails that carry the processed label"""
+    if not processed_label:
+        return RECEIPT_QUERY
+    # Search syntax writes label names in lower case, spaces and slashes as dashes
+    return RECEIPT_QUERY + ' -label:' + re.sub(r'[^\w-]+', '-', processed_label.lower())
+
+
+def skip_reason(part, min_bytes=ATTACHMENT_MIN_BYTES, max_bytes=ATTACHMENT_MAX_BYTES,
+                decoration_bytes=ATTACHMENT_DECORATION_MAX_BYTES):
+    """Why a message part is not worth downloading as a receipt (None = download it)"""
+    filename = part.get('filename', '')
+    mime_type = part.get('mimeType', '').lower()
+    if not filename:
+        return 'not an attachment'
+    if mime_type in GENERIC_MIME_TYPES:
+        if not filename.lower().endswith(RECEIPT_EXTENSIONS):
+            return f"not an image or PDF ({mime_type})"
+    elif not (mime_type.startswith('image/') or 'pdf' in mime_type):
+        return f"not an image or PDF ({mime_type})"
+    elif mime_type in DECORATION_MIME_TYPES:
+        return f"{mime_type} is never a receipt"
+
+    # Size and name rules are for images: a one-page text PDF can be 2 KB
+    size = part.get('body', {}).get('size') or 0
+    is_pdf = 'pdf' in mime_type or filename.lower().endswith('.pdf')
+    if size and size < min_bytes and not is_pdf:
+        return f"too small ({size} bytes, likely a logo or tracking pixel)"
+    if size > max_bytes:
+        return f"too large ({size / 1024 / 1024:.1f} MB)"
+    if not is_pdf and 0 < size < decoration_bytes and DECORATION_NAME.search(filename):
+        return "looks like a logo or icon"
+    return None
+
+
+def walk_parts(part):
+    """Leaf parts of a MIME tree, depth first (attachments can sit in multipart/related etc.)"""
+    children = part.get('parts')
+    if not children:
+        yield part
+        return
+    for child in children:
+        yield from walk_parts(child)
+
+
+def receipt_parts(message):
+    """[(part, skip reason or None)] for every attachment anywhere in the message"""
+    return [
+        (part, skip_reason(part))
+        for part in walk_parts(message.get('payload', {}))
+        if part.get('filename')
+    ]
+
+
+def has_receipt_parts(message):
+    """True if at least one attachment of the message is worth downloading"""
+    return any(reason is None for _, reason in receipt_parts(message))
+
+
+def decode_base64url(data, chunk_chars=DECODE_CHUNK_CHARS):
+    """
+    Gmail's URL-safe base64 → bytes, one chunk at a time
+
+    urlsafe_b64decode() makes two full-size copies of the text before
+    decoding; here only one chunk is converted at a time, and the BytesIO
+    buffer becomes the returned bytes without another copy.
+    """
+    output = io.BytesIO()
+    for start in range(0, len(data), chunk_chars):
+        chunk = data[start:start + chunk_chars]
+        if isinstance(chunk, str):
+            chunk = chunk.encode('ascii')
+        chunk = chunk.translate(URLSAFE_TO_STANDARD)
+        if len(chunk) % 4:
+            chunk += b'=' * (-len(chunk) % 4)   # last chunk of unpadded data
+        output.write(binascii.a2b_base64(chunk))
+    return output.getvalue()
 
 
 class GmailMonitor:
     """Monitor Gmail for receipt emails"""
     
-    def __init__(self):
-        """Initialize Gmail API"""
-        self.service = None
-        self.authenticate()
+    def __init__(self, service=None, download_workers=ATTACHMENT_DOWNLOAD_WORKERS,
+                 mark_read_batch=GMAIL_MARK_READ_BATCH, processed_label=GMAIL_PROCESSED_LABEL):
+        """
+        Initialize Gmail API
+        
+        Args:
+            service: ready-made Gmail service (e.g. FakeGmailService in tests);
+                     otherwise the shared per-thread client from
+                     google_services is used (OAuth happens on first use)
+            download_workers: attachments of one email downloaded in parallel
+            mark_read_batch: queued read-marks that trigger a batchModify
+            processed_label: label name added to processed emails ('' = none)
+        """
+        self._service = service
+        self.download_workers = max(1, int(download_workers))
+        self._download_pool = None
+        self._pool_lock = threading.Lock()
+        self.mark_read_batch = max(1, int(mark_read_batch))
+        self.processed_label = processed_label
+        self.query = receipt_query(processed_label)
+        self._processed_label_id = None
+        self._pending_read = []
+        self._read_lock = threading.Lock()
+        
+        # Never leave queued read-marks behind on a normal shutdown
+        atexit.register(self.flush_read)
+    
+    @property
+    def service(self):
+        """Gmail API service for the calling thread (shared registry, built on first use)"""
+        if self._service is not None:
+            return self._service
+        return get_service('gmail')
     
     def authenticate(self):
-        """Authenticate with Gmail API using OAuth"""
-        print("🔐 Authenticating with Gmail...")
+        """Authenticate with Gmail API using OAuth (see google_services.py)"""
+        get_service('gmail')
+    
+    def list_message_ids(self, query):
+        """Return ids of all messages matching query (follows nextPageToken)"""
+        message_ids = []
+        page_token = None
+        
+        while True:
+            results = execute(self.service.users().messages().list(
+                userId='me',
+                q=query,
+                pageToken=page_token
+            ), 'gmail')
+            
+            message_ids.extend(msg['id'] for msg in results.get('messages', []))
+            
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return message_ids
+    
+    def fetch_messages(self, message_ids, format='full', batch=GMAIL_BATCH_FETCH, fields=None):
+        """
+        Fetch messages, in the same order as message_ids
+        
+        With batch=True up to GMAIL_BATCH_SIZE messages.get calls are sent in
+        one HTTP request; otherwise one request per message. fields is an
+        optional partial-response mask (e.g. METADATA_FIELDS).
+        """
+        options = {'format': format}
+        if fields:
+            options['fields'] = fields
         
-        creds = None
+        if not batch:
+            return [
+                execute(self.service.users().messages().get(
+                    userId='me',
+                    id=message_id,
+                    **options
+                ), 'gmail')
+                for message_id in message_ids
+            ]
         
-        # Token file stores user's access and refresh tokens
-        if GMAIL_TOKEN_PATH.exists():
-            print("   Loading saved credentials...")
-            creds = Credentials.from_authorized_user_file(str(GMAIL_TOKEN_PATH), SCOPES)
+        fetched = {}
+        throttled = {}
+        limiter = get_limiter('gmail')
         
-        # If no valid credentials, let user log in
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                print("   Refreshing expired credentials...")
-                creds.refresh(Request())
+        def on_response(request_id, response, exception):
+            limiter.record(exception)
+            if exception is None:
+                fetched[request_id] = response
+            elif is_retryable(exception):
+                throttled[request_id] = exception
             else:
-                print("   Opening browser for authorization...")
-                print("   📱 Check your browser and authorize the app")
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    str(GMAIL_CREDENTIALS_PATH), SCOPES
-                )
-                creds = flow.run_local_server(port=0)
+                print(f"⚠️  Could not fetch message {request_id}: {str(exception)}")
+        
+        for start in range(0, len(message_ids), GMAIL_BATCH_SIZE):
+            chunk = message_ids[start:start + GMAIL_BATCH_SIZE]
             
-            # Save credentials for next time
-            print("   Saving credentials...")
-            with open(GMAIL_TOKEN_PATH, 'w') as token:
-                token.write(creds.to_json())
+            # Messages throttled inside a batch are re-sent in the next round
+            for attempt in range(limiter.max_retries + 1):
+                throttled.clear()
+                batch_request = self.service.new_batch_http_request(callback=on_response)
+                for message_id in chunk:
+                    batch_request.add(
+                        self.service.users().messages().get(
+                            userId='me',
+                            id=message_id,
+                            **options
+                        ),
+                        request_id=message_id
+                    )
+                # One token per sub-request; each is recorded by on_response
+                limiter.call(batch_request.execute, cost=len(chunk), batch=True)
+                
+                chunk = list(throttled)
+                if not chunk:
+                    break
+                if attempt == limiter.max_retries:
+                    for message_id, exception in throttled.items():
+                        print(f"⚠️  Could not fetch message {message_id}: {str(exception)}")
+                    break
+                limiter.wait_before_retry(attempt, next(iter(throttled.values())))
         
-        # Build service
-        self.service = build('gmail', 'v1', credentials=creds)
-        print("✅ Connected to Gmail")
+        return [fetched[message_id] for message_id in message_ids if message_id in fetched]
     
-    def get_unread_receipts(self):
+    @metrics.timed('gmail_fetch')
+    def get_unread_receipts(self, batch=GMAIL_BATCH_FETCH):
         """
         Get unread emails with receipts
         Looking for emails with:
         - Subject containing: receipt, invoice, order
         - Has attachments (images or PDFs)
         - Is unread
+        
+        Only metadata is fetched here (headers and the MIME tree, no body
+        data); emails without an attachment worth downloading are dropped,
+        and get_attachments later pulls just the chosen parts. With
+        batch=True the metadata is fetched in batch HTTP requests instead of
+        one round-trip per email.
         """
         print("\n📬 Checking for new receipt emails...")
         
-        # Search query
-        query = 'is:unread has:attachment (subject:receipt OR subject:invoice OR subject:order)'
+        try:
+            return self.search_receipts(batch=batch)[0]
+        except Exception as e:
+            print(f"❌ Error fetching emails: {str(e)}")
+            return []
+    
+    def search_receipts(self, batch=GMAIL_BATCH_FETCH):
+        """
+        get_unread_receipts without the error handling: raises on API errors
+        and returns (emails, complete), complete=False when some messages
+        could not be fetched
+        """
+        message_ids = self.list_message_ids(self.query)
+        
+        if not message_ids:
+            print("   No new receipt emails found")
+            return [], True
+        
+        print(f"   Found {len(message_ids)} potential receipt email(s)")
         
+        # Phase 1: MIME tree only; bodies are downloaded per part later
+        messages = self.fetch_messages(message_ids, batch=batch, fields=METADATA_FIELDS)
+        return self.drop_without_receipts(messages), len(messages) == len(message_ids)
+    
+    def load_history_id(self):
+        """Read the saved history ID checkpoint (None if there is none)"""
+        if not GMAIL_HISTORY_PATH.exists():
+            return None
         try:
-            results = self.service.users().messages().list(
+            with open(GMAIL_HISTORY_PATH) as f:
+                return json.load(f).get('historyId')
+        except (OSError, ValueError):
+            return None
+    
+    def save_history_id(self, history_id):
+        """Save the history ID checkpoint next to the Gmail token"""
+        with open(GMAIL_HISTORY_PATH, 'w') as f:
+            json.dump({'historyId': str(history_id)}, f)
+    
+    def get_current_history_id(self):
+        """Current mailbox history ID"""
+        profile = execute(self.service.users().getProfile(userId='me'), 'gmail')
+        return profile['historyId']
+    
+    def list_added_message_ids(self, start_history_id):
+        """
+        Ids of messages added since start_history_id, plus the latest history ID
+        
+        Raises HttpError 404 when the checkpoint is too old for Gmail to answer.
+        """
+        message_ids = []
+        page_token = None
+        
+        while True:
+            results = execute(self.service.users().history().list(
                 userId='me',
-                q=query
-            ).execute()
-            
-            messages = results.get('messages', [])
+                startHistoryId=start_history_id,
+                historyTypes=['messageAdded'],
+                pageToken=page_token
+            ), 'gmail')
             
-            if not messages:
-                print("   No new receipt emails found")
-                return []
-            
-            print(f"   Found {len(messages)} potential receipt email(s)")
-            
-            # Get full message details
-            receipt_emails = []
-            for msg in messages:
-                full_msg = self.service.users().messages().get(
-                    userId='me',
-                    id=msg['id'],
-                    format='full'
-                ).execute()
-                receipt_emails.append(full_msg)
-            
-            return receipt_emails
+            for record in results.get('history', []):
+                for added in record.get('messagesAdded', []):
+                    message_id = added['message']['id']
+                    if message_id not in message_ids:
+                        message_ids.append(message_id)
             
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return message_ids, results.get('historyId', start_history_id)
+    
+    def is_receipt_email(self, message):
+        """Local check equivalent to RECEIPT_QUERY (plus the attachment filter) for a fetched message"""
+        if 'UNREAD' not in message.get('labelIds', []):
+            return False
+        if self.processed_label and self.processed_label_id() in message.get('labelIds', []):
+            return False
+        
+        headers = message.get('payload', {}).get('headers', [])
+        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '')
+        if not RECEIPT_SUBJECT.search(subject):
+            return False
+        
+        return has_receipt_parts(message)
+    
+    def drop_without_receipts(self, messages):
+        """Messages that have at least one attachment worth downloading"""
+        receipts = [message for message in messages if has_receipt_parts(message)]
+        if len(receipts) < len(messages):
+            print(f"   {len(messages) - len(receipts)} email(s) have no usable attachment, not downloading them")
+        return receipts
+    
+    def full_sync(self):
+        """
+        Full search, then checkpoint the history ID taken before the search
+        
+        On an API error nothing is returned; the checkpoint only moves after
+        a search that fetched every message, so mail that was missed is
+        looked at again next time.
+        """
+        try:
+            history_id = self.get_current_history_id()
+            emails, complete = self.search_receipts()
+        except Exception as e:
+            print(f"❌ Error running full search: {str(e)}")
+            return []
+        if complete:
+            self.save_history_id(history_id)
+        return emails
+    
+    @metrics.timed('gmail_fetch')
+    def get_new_receipts(self, full=False):
+        """
+        Incremental sync: only look at messages added since the last checkpoint
+        
+        Falls back to a full search when full=True, when there is no checkpoint
+        yet, or when the checkpoint is too old for the history endpoint.
+        """
+        start_history_id = self.load_history_id()
+        
+        if full or start_history_id is None:
+            print("\n📬 Running full search and saving a new sync checkpoint...")
+            return self.full_sync()
+        
+        print(f"\n📬 Checking for receipt emails since history {start_history_id}...")
+        
+        try:
+            message_ids, latest_history_id = self.list_added_message_ids(start_history_id)
+        except HttpError as e:
+            if e.resp.status == 404:
+                print("   Sync checkpoint expired, running full search...")
+                return self.full_sync()
+            print(f"❌ Error fetching history: {str(e)}")
+            return []
+        except Exception as e:
+            print(f"❌ Error fetching history: {str(e)}")
+            return []
+        
+        if not message_ids:
+            print("   No new emails since last check")
+            self.save_history_id(latest_history_id)
+            return []
+        
+        try:
+            messages = self.fetch_messages(message_ids, fields=METADATA_FIELDS)
         except Exception as e:
             print(f"❌ Error fetching emails: {str(e)}")
             return []
+        
+        receipt_emails = [msg for msg in messages if self.is_receipt_email(msg)]
+        print(f"   {len(message_ids)} new email(s), {len(receipt_emails)} look like receipts")
+        
+        # Messages that could not be fetched are tried again from the same checkpoint
+        if len(messages) == len(message_ids):
+            self.save_history_id(latest_history_id)
+        return receipt_emails
+    
+    def download_pool(self):
+        """Thread pool for attachment downloads (long-lived, so its threads keep their Gmail clients)"""
+        with self._pool_lock:
+            if self._download_pool is None:
+                self._download_pool = ThreadPoolExecutor(
+                    max_workers=self.download_workers, thread_name_prefix='gmail-download'
+                )
+            return self._download_pool
+    
+    def fetch_part_bodies(self, message_id):
+        """partId → body for every part of a message, data included"""
+        message = execute(self.service.users().messages().get(
+            userId='me',
+            id=message_id,
+            format='full',
+            fields=f"payload({part_fields(MIME_DEPTH).replace('body(size,attachmentId)', 'body')})"
+        ), 'gmail')
+        return {part.get('partId'): part.get('body', {}) for part in walk_parts(message['payload'])}
     
+    def download_part(self, message_id, part):
+        """Decoded bytes of one attachment part (fetched by attachmentId unless inline)"""
+        body = part['body']
+        if 'data' in body:
+            data = decode_base64url(body['data'])
+        else:
+            response = execute(self.service.users().messages().attachments().get(
+                userId='me',
+                messageId=message_id,
+                id=body['attachmentId']
+            ), 'gmail')
+            # Drop the base64 text as soon as it is decoded
+            data = decode_base64url(response.pop('data'))
+        metrics.inc('attachment_bytes_total', len(data))
+        return data
+    
+    @metrics.timed('download')
     def get_attachments(self, message):
-        """Extract attachments from email message"""
-        attachments = []
+        """
+        Extract receipt attachments from email message
         
-        # Get message payload
-        payload = message.get('payload', {})
+        Attachments are found anywhere in the MIME tree (e.g. inside
+        multipart/related). Parts that cannot be receipts (other file types,
+        tiny logos and tracking pixels, oversized files) are skipped using the
+        size and MIME type already in the message, before anything is
+        downloaded. The rest are fetched in parallel (download_workers threads).
+        """
+        parts = []
+        for part, reason in receipt_parts(message):
+            if reason:
+                print(f"⏭️  Skipping {part['filename']}: {reason}")
+                metrics.inc('attachments_skipped_total')
+                continue
+            parts.append(part)
         
-        # Check parts for attachments
-        parts = payload.get('parts', [])
+        # Small parts have their data inline instead of an attachmentId; the
+        # metadata fetch left it out, so get those bodies in one request
+        if any('data' not in part['body'] and 'attachmentId' not in part['body'] for part in parts):
+            bodies = self.fetch_part_bodies(message['id'])
+            parts = [
+                part if 'data' in part['body'] or 'attachmentId' in part['body']
+                else dict(part, body=bodies.get(part.get('partId'), part['body']))
+                for part in parts
+            ]
         
-        for part in parts:
-            if part.get('filename'):
-                filename = part['filename']
-                
-                # Only get image/PDF attachments
-                mime_type = part.get('mimeType', '')
-                if not any(t in mime_type for t in ['image', 'pdf']):
-                    continue
-                
-                # Get attachment data
-                if 'data' in part['body']:
-                    data = part['body']['data']
-                else:
-                    att_id = part['body']['attachmentId']
-                    att = self.service.users().messages().attachments().get(
-                        userId='me',
-                        messageId=message['id'],
-                        id=att_id
-                    ).execute()
-                    data = att['data']
-                
-                # Decode
-                file_data = base64.urlsafe_b64decode(data)
-                
-                attachments.append({
-                    'filename': filename,
-                    'data': file_data,
-                    'mime_type': mime_type
-                })
+        remote = sum(1 for part in parts if 'data' not in part['body'])
+        if remote > 1 and self.download_workers > 1:
+            contents = list(self.download_pool().map(lambda part: self.download_part(message['id'], part), parts))
+        else:
+            contents = [self.download_part(message['id'], part) for part in parts]
         
-        return attachments
+        return [
+            {
+                'filename': part['filename'],
+                'data': data,
+                'mime_type': part.get('mimeType', ''),
+                'part_id': part.get('partId')
+            }
+            for part, data in zip(parts, contents)
+        ]
+    
+    def processed_label_id(self):
+        """Id of the processed label, created on first use (None when not configured)"""
+        if not self.processed_label:
+            return None
+        if self._processed_label_id is None:
+            try:
+                labels = execute(self.service.users().labels().list(userId='me'), 'gmail').get('labels', [])
+                label = next((l for l in labels if l['name'] == self.processed_label), None)
+                if label is None:
+                    label = execute(self.service.users().labels().create(userId='me', body={
+                        'name': self.processed_label,
+                        'labelListVisibility': 'labelShow',
+                        'messageListVisibility': 'show'
+                    }), 'gmail', idempotent=False)
+                    print(f"🏷️  Created Gmail label '{self.processed_label}'")
+                self._processed_label_id = label['id']
+            except Exception as e:
+                print(f"⚠️  Could not set up label '{self.processed_label}': {str(e)}")
+        return self._processed_label_id
     
+    def read_changes(self):
+        """Label changes for a processed email: drop UNREAD, add the processed label if any"""
+        body = {'removeLabelIds': ['UNREAD']}
+        label_id = self.processed_label_id()
+        if label_id:
+            body['addLabelIds'] = [label_id]
+        return body
+    
+    @metrics.timed('mark_read')
     def mark_as_read(self, message_id):
         """Mark email as read"""
         try:
-            self.service.users().messages().modify(
+            execute(self.service.users().messages().modify(
                 userId='me',
                 id=message_id,
-                body={'removeLabelIds': ['UNREAD']}
-            ).execute()
+                body=self.read_changes()
+            ), 'gmail')
             return True
         except Exception as e:
             print(f"⚠️  Could not mark as read: {str(e)}")
             return False
     
+    def mark_read_later(self, message_id):
+        """
+        Queue an email to be marked read by the next flush_read()
+        
+        Flushes at once when mark_read_batch emails are waiting; returns the
+        ids marked by that flush (usually none).
+        """
+        with self._read_lock:
+            if message_id not in self._pending_read:
+                self._pending_read.append(message_id)
+            due = len(self._pending_read) >= self.mark_read_batch
+        return self.flush_read() if due else []
+    
+    def is_pending_read(self, message_id):
+        """True while an email waits in the read-mark queue"""
+        with self._read_lock:
+            return message_id in self._pending_read
+    
+    @metrics.timed('mark_read')
+    def flush_read(self):
+        """
+        Mark all queued emails read with one batchModify (per 1000 ids)
+        
+        Returns the ids that were marked. Ids of a failed call are dropped;
+        those emails are still unread, so the next poll finds them again.
+        """
+        with self._read_lock:
+            message_ids = self._pending_read
+            self._pending_read = []
+        if not message_ids:
+            return []
+        
+        changes = self.read_changes()
+        marked = []
+        requests = 0
+        for start in range(0, len(message_ids), BATCH_MODIFY_MAX):
+            chunk = message_ids[start:start + BATCH_MODIFY_MAX]
+            try:
+                execute(self.service.users().messages().batchModify(
+                    userId='me',
+                    body=dict(changes, ids=chunk)
+                ), 'gmail')
+                marked.extend(chunk)
+                requests += 1
+            except Exception as e:
+                print(f"⚠️  Could not mark {len(chunk)} email(s) as read: {str(e)}")
+        if marked:
+            print(f"📭 Marked {len(marked)} email(s) as read in {requests} request(s)")
+        return marked
+    
+    @metrics.timed('confirm')
     def send_confirmation(self, to_email, expense_data):
         """Send confirmation email after processing receipt"""
         vendor = expense_data.get('vendor', 'Unknown')
@@ -186,10 +640,10 @@ Your expense has been added to your Google Sheet.
             
             raw = base64.urlsafe_b64encode(message.as_bytes()).decode()
             
-            self.service.users().messages().send(
+            execute(self.service.users().messages().send(
                 userId='me',
                 body={'raw': raw}
-            ).execute()
+            ), 'gmail', idempotent=False)
             
             print(f"✅ Confirmation email sent to {to_email}")
             return True
@@ -0,0 +1,171 @@
+"""
+Process-wide registry of Google API clients (Gmail, Sheets)
+
+- Credentials are loaded once per process and shared (google-auth refreshes
+  them safely from any thread).
+- Discovery documents are parsed once per process and cached on disk, so
+  building a client never re-downloads or re-parses them.
+- Each thread gets its own client with its own HTTP connection (httplib2 is
+  not thread-safe), kept open and reused for every call from that thread.
+"""
+import json
+import threading
+
+from config import (
+    CACHE_DIR, CREDENTIALS_PATH, GMAIL_CREDENTIALS_PATH, GMAIL_TOKEN_PATH,
+    require_credentials, check_gmail_credentials
+)
+
+# API name → (version, scopes)
+APIS = {
+    'gmail': ('v1', [
+        'https://www.googleapis.com/auth/gmail.readonly',
+        'https://www.googleapis.com/auth/gmail.send',
+        'https://www.googleapis.com/auth/gmail.modify'
+    ]),
+    'sheets': ('v4', ['https://www.googleapis.com/auth/spreadsheets']),
+}
+
+DISCOVERY_CACHE_DIR = CACHE_DIR / 'discovery'
+DISCOVERY_URL = 'https://{api}.googleapis.com/$discovery/rest?version={version}'
+
+# Seconds before an HTTP request to Google gives up
+HTTP_TIMEOUT = 60
+
+_lock = threading.Lock()
+_credentials = {}
+_documents = {}
+_local = threading.local()
+
+
+def load_gmail_credentials(scopes):
+    """OAuth user credentials for Gmail (saved token, refreshed, or browser login)"""
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
+    print("🔐 Authenticating with Gmail...")
+    check_gmail_credentials()
+
+    creds = None
+
+    # Token file stores user's access and refresh tokens
+    if GMAIL_TOKEN_PATH.exists():
+        print("   Loading saved credentials...")
+        creds = Credentials.from_authorized_user_file(str(GMAIL_TOKEN_PATH), scopes)
+
+    # If no valid credentials, let user log in
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            print("   Refreshing expired credentials...")
+            creds.refresh(Request())
+        else:
+            print("   Opening browser for authorization...")
+            print("   📱 Check your browser and authorize the app")
+            flow = InstalledAppFlow.from_client_secrets_file(
+                str(GMAIL_CREDENTIALS_PATH), scopes
+            )
+            creds = flow.run_local_server(port=0)
+
+        # Save credentials for next time
+        print("   Saving credentials...")
+        with open(GMAIL_TOKEN_PATH, 'w') as token:
+            token.write(creds.to_json())
+
+    return creds
+
+
+def load_sheets_credentials(scopes):
+    """Service account credentials for Sheets"""
+    from google.oauth2 import service_account
+
+    print("🔐 Authenticating with Google Sheets...")
+    print(f"   Using credentials: {CREDENTIALS_PATH}")
+    require_credentials()
+
+    return service_account.Credentials.from_service_account_file(
+        str(CREDENTIALS_PATH), scopes=scopes
+    )
+
+
+CREDENTIAL_LOADERS = {
+    'gmail': load_gmail_credentials,
+    'sheets': load_sheets_credentials,
+}
+
+
+def get_credentials(api):
+    """Credentials for an API, loaded once per process"""
+    with _lock:
+        if api not in _credentials:
+            _, scopes = APIS[api]
+            _credentials[api] = CREDENTIAL_LOADERS[api](scopes)
+        return _credentials[api]
+
+
+def get_discovery_document(api):
+    """
+    Parsed discovery document, from memory, the local cache, the copy
+    bundled with google-api-python-client, or (last resort) the network
+    """
+    with _lock:
+        if api in _documents:
+            return _documents[api]
+
+        version, _ = APIS[api]
+        path = DISCOVERY_CACHE_DIR / f"{api}.{version}.json"
+
+        content = None
+        if path.exists():
+            content = path.read_text()
+        else:
+            from googleapiclient.discovery_cache import get_static_doc
+            content = get_static_doc(api, version)
+            if content is None:
+                import httplib2
+                _, body = httplib2.Http(timeout=HTTP_TIMEOUT).request(
+                    DISCOVERY_URL.format(api=api, version=version)
+                )
+                content = body.decode('utf-8')
+            try:
+                DISCOVERY_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                path.write_text(content)
+            except OSError:
+                pass
+
+        _documents[api] = json.loads(content)
+        return _documents[api]
+
+
+def get_service(api):
+    """
+    API client for the calling thread ('gmail' or 'sheets')
+
+    The first call in a thread builds the client from the cached discovery
+    document; later calls return the same object and HTTP connection.
+    """
+    services = getattr(_local, 'services', None)
+    if services is None:
+        services = _local.services = {}
+
+    if api not in services:
+        import httplib2
+        from google_auth_httplib2 import AuthorizedHttp
+        from googleapiclient.discovery import build_from_document
+
+        credentials = get_credentials(api)
+        http = AuthorizedHttp(credentials, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+        services[api] = build_from_document(get_discovery_document(api), http=http)
+
+        if threading.current_thread() is threading.main_thread():
+            print(f"✅ Connected to {api.capitalize()}")
+
+    return services[api]
+
+
+def reset():
+    """Forget all cached clients and credentials (e.g. after changing accounts)"""
+    with _lock:
+        _credentials.clear()
+        _documents.clear()
+    _local.services = {}
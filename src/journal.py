@@ -0,0 +1,172 @@
+"""
+Crash-safe job journal
+
+Records how far each email and each of its attachments got, so a restart
+picks up where the last run stopped instead of starting over:
+
+- attachment 'extracted': OCR + AI finished, the result is stored
+- attachment / email 'written': its rows are in the sheet
+- email 'read': marked read in Gmail
+- email 'confirmed': confirmation email sent
+
+OCR text itself is not journaled: the OCR cache already keeps it by image
+content, so an attachment that crashed between OCR and extraction only
+repeats the extraction.
+"""
+import json
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+from config import JOURNAL_PATH, JOURNAL_KEEP_DAYS
+
+# Email stages in order; an email never moves backwards
+STAGES = ('processing', 'written', 'read', 'confirmed')
+
+# Results worth keeping: anything else (errors) is retried next time
+FINAL_STATUSES = ('success', 'duplicate')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    message_id TEXT PRIMARY KEY,
+    sender     TEXT,
+    stage      TEXT,
+    updated_at TEXT
+);
+CREATE TABLE IF NOT EXISTS attachments (
+    message_id TEXT,
+    part       TEXT,
+    filename   TEXT,
+    stage      TEXT,
+    result     TEXT,
+    updated_at TEXT,
+    PRIMARY KEY (message_id, part)
+);
+CREATE INDEX IF NOT EXISTS idx_messages_updated ON messages(updated_at);
+"""
+
+
+def attachment_key(att):
+    """Stable id of an attachment within its email (MIME part id, else filename)"""
+    return att.get('part_id') or att['filename']
+
+
+def now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+class Journal:
+    """Per-email and per-attachment progress, committed as each step completes"""
+
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.reused = 0
+        self.resumed = 0
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=FULL")   # a recorded step survives a power cut
+            self.db.executescript(SCHEMA)
+
+    def stage(self, message_id):
+        """Stage an email has reached, or None if it was never seen"""
+        with self.lock:
+            row = self.db.execute("SELECT stage FROM messages WHERE message_id = ?", (message_id,)).fetchone()
+        return row[0] if row else None
+
+    def results(self, message_id):
+        """{attachment key: (stage, result)} of an email's finished attachments"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT part, stage, result FROM attachments WHERE message_id = ? ORDER BY rowid", (message_id,)
+            ).fetchall()
+        return {part: (stage, json.loads(result)) for part, stage, result in rows}
+
+    def record_result(self, message_id, sender, att, result):
+        """Store an attachment's OCR + AI result (errors are not stored, so they get retried)"""
+        if result.get('status') not in FINAL_STATUSES:
+            return False
+        stamp = now()
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR IGNORE INTO messages (message_id, sender, stage, updated_at) VALUES (?, ?, ?, ?)",
+                (message_id, sender, STAGES[0], stamp)
+            )
+            self.db.execute(
+                "INSERT OR IGNORE INTO attachments (message_id, part, filename, stage, result, updated_at) "
+                "VALUES (?, ?, ?, 'extracted', ?, ?)",
+                (message_id, attachment_key(att), att['filename'], json.dumps(result, default=str), stamp)
+            )
+        return True
+
+    def mark_written(self, message_id, sender=None):
+        """The email's rows are in the sheet (all its extracted attachments with it)"""
+        stamp = now()
+        with self.lock, self.db:
+            self.db.execute(
+                "UPDATE attachments SET stage = 'written', updated_at = ? "
+                "WHERE message_id = ? AND stage = 'extracted'",
+                (stamp, message_id)
+            )
+            self._advance(message_id, 'written', stamp, sender)
+
+    def advance(self, message_id, stage):
+        """Move an email forward to stage ('read' / 'confirmed')"""
+        with self.lock, self.db:
+            self._advance(message_id, stage, now())
+
+    def _advance(self, message_id, stage, stamp, sender=None):
+        row = self.db.execute("SELECT stage FROM messages WHERE message_id = ?", (message_id,)).fetchone()
+        if row is None:
+            self.db.execute(
+                "INSERT INTO messages (message_id, sender, stage, updated_at) VALUES (?, ?, ?, ?)",
+                (message_id, sender, stage, stamp)
+            )
+        elif STAGES.index(row[0]) < STAGES.index(stage):
+            self.db.execute(
+                "UPDATE messages SET stage = ?, updated_at = ? WHERE message_id = ?",
+                (stage, stamp, message_id)
+            )
+
+    def saved_expense(self, message_id):
+        """Data of the last written (non-duplicate) receipt of an email, for its confirmation"""
+        for stage, result in reversed(list(self.results(message_id).values())):
+            if stage == 'written' and result.get('status') == 'success':
+                return result.get('data')
+        return None
+
+    def prune(self, keep_days=JOURNAL_KEEP_DAYS):
+        """Forget emails not touched for keep_days"""
+        cutoff = (datetime.now() - timedelta(days=keep_days)).strftime('%Y-%m-%d %H:%M:%S')
+        with self.lock, self.db:
+            old = [row[0] for row in self.db.execute(
+                "SELECT message_id FROM messages WHERE updated_at < ?", (cutoff,)
+            )]
+            self.db.executemany("DELETE FROM attachments WHERE message_id = ?", [(m,) for m in old])
+            self.db.executemany("DELETE FROM messages WHERE message_id = ?", [(m,) for m in old])
+        return len(old)
+
+    def summary(self):
+        """One-line report of work saved by the journal this run"""
+        return (f"Journal: {self.reused} attachment result(s) reused, "
+                f"{self.resumed} email(s) resumed after their rows were saved")
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_journal():
+    """Process-wide journal (opened and pruned on first use)"""
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            _journal = Journal()
+            _journal.prune()
+        return _journal
@@ -0,0 +1,195 @@
+"""
+Local expense ledger - SQLite mirror of the Google Sheet
+
+Every row appended by SheetsManager is also written here, so reads and
+queries never have to download the whole sheet. reconcile() pulls rows
+added to the sheet by other means (manual edits, other machines).
+"""
+import sqlite3
+import threading
+
+from config import LEDGER_PATH, GOOGLE_SHEET_ID
+
+COLUMNS = ['date', 'vendor', 'category', 'total', 'currency', 'tax', 'items', 'processed_at']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS expenses (
+    sheet_row    INTEGER PRIMARY KEY,
+    date         TEXT,
+    vendor       TEXT,
+    category     TEXT,
+    total        REAL,
+    currency     TEXT,
+    tax          REAL,
+    items        TEXT,
+    processed_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_expenses_date ON expenses(date);
+CREATE INDEX IF NOT EXISTS idx_expenses_vendor ON expenses(vendor COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_expenses_category ON expenses(category);
+CREATE INDEX IF NOT EXISTS idx_expenses_total ON expenses(total);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def to_number(value):
+    """Sheet cell → float or None"""
+    if value in (None, ''):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class ExpenseLedger:
+    """Indexed local copy of the expense sheet (one row per sheet row)"""
+
+    def __init__(self, path=LEDGER_PATH):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.lock, self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.executescript(SCHEMA)
+
+    def record_rows(self, numbered_rows):
+        """Insert or update (sheet_row, [A..H values]) pairs"""
+        records = []
+        for sheet_row, values in numbered_rows:
+            values = (list(values) + [''] * len(COLUMNS))[:len(COLUMNS)]
+            record = dict(zip(COLUMNS, values))
+            record['total'] = to_number(record['total'])
+            record['tax'] = to_number(record['tax'])
+            record['sheet_row'] = sheet_row
+            records.append(record)
+
+        with self.lock, self.db:
+            self.db.executemany(
+                f"INSERT OR REPLACE INTO expenses (sheet_row, {', '.join(COLUMNS)}) "
+                f"VALUES (:sheet_row, {', '.join(':' + c for c in COLUMNS)})",
+                records
+            )
+        return len(records)
+
+    def get_meta(self, key, default=None):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row else default
+
+    def set_meta(self, key, value):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    @property
+    def synced_row(self):
+        """Last sheet row confirmed by reconcile() (None if never reconciled)"""
+        value = self.get_meta(f'synced_row:{GOOGLE_SHEET_ID}')
+        return int(value) if value is not None else None
+
+    def get_all(self):
+        """All expenses as sheet-style rows (same shape as SheetsManager.get_all_expenses)"""
+        with self.lock:
+            rows = self.db.execute(f"SELECT {', '.join(COLUMNS)} FROM expenses ORDER BY sheet_row").fetchall()
+        return [['' if value is None else value for value in row] for row in rows]
+
+    def query(self, vendor=None, category=None, currency=None, date_from=None, date_to=None,
+              min_total=None, max_total=None, limit=None):
+        """
+        Filter expenses using the local indexes; returns a list of dicts
+
+        vendor matches case-insensitively as a prefix; dates are 'YYYY-MM-DD'.
+        """
+        conditions = []
+        params = []
+        if vendor:
+            conditions.append("vendor LIKE ? COLLATE NOCASE")
+            params.append(f"{vendor}%")
+        if category:
+            conditions.append("category = ?")
+            params.append(category)
+        if currency:
+            conditions.append("currency = ?")
+            params.append(currency)
+        if date_from:
+            conditions.append("date >= ?")
+            params.append(date_from)
+        if date_to:
+            conditions.append("date <= ?")
+            params.append(date_to)
+        if min_total is not None:
+            conditions.append("total >= ?")
+            params.append(min_total)
+        if max_total is not None:
+            conditions.append("total <= ?")
+            params.append(max_total)
+
+        sql = "SELECT * FROM expenses"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY date, sheet_row"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+
+        with self.lock:
+            return [dict(row) for row in self.db.execute(sql, params).fetchall()]
+
+    def totals_by(self, column='category'):
+        """Sum of totals grouped by category / vendor / currency"""
+        if column not in ('category', 'vendor', 'currency'):
+            raise ValueError(f"Cannot group by {column}")
+        with self.lock:
+            rows = self.db.execute(
+                f"SELECT {column}, currency, COUNT(*) AS count, SUM(total) AS total "
+                f"FROM expenses GROUP BY {column}, currency ORDER BY total DESC"
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def reconcile(self, sheets, full=False):
+        """
+        Sync the ledger with the sheet
+
+        Incremental (default): download only rows after the last synced row.
+        full=True: download everything and drop local rows the sheet no longer has.
+        """
+        start_row = 2 if full or self.synced_row is None else self.synced_row + 1
+        print(f"🔄 Reconciling ledger with sheet from row {start_row}...")
+
+        values = sheets.get_rows(start_row)
+        numbered_rows = [
+            (start_row + offset, row) for offset, row in enumerate(values) if any(row)
+        ]
+        last_row = start_row + len(values) - 1
+
+        self.record_rows(numbered_rows)
+        if full:
+            with self.lock, self.db:
+                self.db.execute("DELETE FROM expenses WHERE sheet_row > ?", (last_row,))
+        if values or self.synced_row is None:
+            self.set_meta(f'synced_row:{GOOGLE_SHEET_ID}', max(last_row, 1))
+
+        print(f"✅ Ledger synced: {len(numbered_rows)} row(s) pulled, up to sheet row {max(last_row, 1)}")
+        return len(numbered_rows)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger():
+    """Process-wide ledger (opened on first use)"""
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = ExpenseLedger()
+        return _ledger
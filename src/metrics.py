@@ -0,0 +1,264 @@
+"""
+In-process metrics for the receipt pipeline: counters, gauges and latency histograms
+
+- @timed(stage) records how long each stage call takes (Gmail fetch,
+  download, OCR, extraction, Sheets append, confirmation) and counts calls
+  that raised
+- counters for emails, attachments, OCR characters, OpenAI tokens, API
+  retries and failures; gauges for pipeline queue depth
+- served in Prometheus text format on http://127.0.0.1:METRICS_PORT/metrics
+  when METRICS_PORT is set, and printed by summary_lines()
+
+With METRICS_ENABLED=0 nothing is recorded: timed() leaves functions
+undecorated and every other call returns straight away.
+"""
+import time
+import bisect
+import functools
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from config import METRICS_ENABLED, METRICS_PORT
+
+PREFIX = 'receipt_pipeline_'
+
+# Histogram bucket upper bounds in seconds (+Inf is implied)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# name → (type, help text)
+DEFINITIONS = {
+    'stage_seconds': ('histogram', 'Time spent in one call of a pipeline stage'),
+    'stage_failures_total': ('counter', 'Stage calls that raised an exception'),
+    'api_request_seconds': ('histogram', 'Time of one OpenAI / Gmail / Sheets request attempt'),
+    'api_errors_total': ('counter', 'API request attempts that failed'),
+    'api_throttled_total': ('counter', 'API request attempts refused with a rate limit error'),
+    'api_retries_total': ('counter', 'API requests sent again after a retryable error'),
+    'emails_total': ('counter', 'Receipt emails processed'),
+    'attachments_total': ('counter', 'Receipt attachments processed'),
+    'receipts_total': ('counter', 'Processed receipts by outcome'),
+    'attachments_skipped_total': ('counter', 'Attachments not downloaded because they cannot be receipts'),
+    'attachment_bytes_total': ('counter', 'Attachment bytes downloaded'),
+    'ocr_chars_total': ('counter', 'Characters read by OCR'),
+    'openai_tokens_total': ('counter', 'OpenAI tokens used'),
+    'rows_saved_total': ('counter', 'Rows appended to the sheet'),
+    'sheet_writer_pending_rows': ('gauge', 'Rows waiting in the buffered sheet writer'),
+    'queue_depth': ('gauge', 'Items waiting in a pipeline queue'),
+    'emails_in_flight': ('gauge', 'Emails somewhere in the pipeline'),
+}
+
+_enabled = METRICS_ENABLED
+_lock = threading.Lock()
+_values = {}
+_server = None
+
+
+class Histogram:
+    """Bucketed observations (cumulative only when rendered)"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimated q-quantile, interpolated inside its bucket like Prometheus' histogram_quantile"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                if index == len(BUCKETS):
+                    return BUCKETS[-1]
+                lower = BUCKETS[index - 1] if index else 0.0
+                return lower + (BUCKETS[index] - lower) * (rank - seen) / count
+            seen += count
+        return BUCKETS[-1]
+
+
+def enabled():
+    return _enabled
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    """Add value to a counter"""
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _values[key] = _values.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    """Set a gauge to its current value"""
+    if not _enabled:
+        return
+    with _lock:
+        _values[_key(name, labels)] = value
+
+
+def observe(name, value, **labels):
+    """Add one observation (seconds) to a histogram"""
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        histogram = _values.get(key)
+        if histogram is None:
+            histogram = _values[key] = Histogram()
+        histogram.observe(value)
+
+
+def timed(stage):
+    """Decorator: record each call's duration as stage_seconds{stage=...}, count exceptions"""
+    def decorate(func):
+        if not _enabled:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                inc('stage_failures_total', stage=stage)
+                raise
+            finally:
+                observe('stage_seconds', time.perf_counter() - start, stage=stage)
+        return wrapper
+    return decorate
+
+
+def record_usage(response):
+    """Count the tokens of an OpenAI response"""
+    usage = getattr(response, 'usage', None)
+    if usage is None:
+        return
+    inc('openai_tokens_total', getattr(usage, 'prompt_tokens', 0) or 0, kind='prompt')
+    inc('openai_tokens_total', getattr(usage, 'completion_tokens', 0) or 0, kind='completion')
+
+
+def get(name, **labels):
+    """Current value of a counter / gauge (a Histogram for histograms), or None"""
+    with _lock:
+        return _values.get(_key(name, labels))
+
+
+def collect(name):
+    """[(labels dict, value)] for every label set of a metric"""
+    with _lock:
+        return [(dict(labels), value) for (metric, labels), value in _values.items() if metric == name]
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    with _lock:
+        items = sorted(_values.items(), key=lambda item: item[0])
+        lines = []
+        current = None
+        for (name, labels), value in items:
+            kind, help_text = DEFINITIONS.get(name, ('untyped', ''))
+            full_name = PREFIX + name
+            if name != current:
+                lines.append(f"# HELP {full_name} {help_text}")
+                lines.append(f"# TYPE {full_name} {kind}")
+                current = name
+            labels = dict(labels)
+            if isinstance(value, Histogram):
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), value.counts):
+                    cumulative += count
+                    lines.append(f"{full_name}_bucket{format_labels(dict(labels, le=str(bound)))} {cumulative}")
+                lines.append(f"{full_name}_sum{format_labels(labels)} {value.sum}")
+                lines.append(f"{full_name}_count{format_labels(labels)} {value.count}")
+            else:
+                lines.append(f"{full_name}{format_labels(labels)} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+def summary_lines():
+    """Human-readable summary: one line per stage, then the counters"""
+    lines = []
+    for labels, histogram in sorted(collect('stage_seconds'), key=lambda item: item[0].get('stage', '')):
+        stage = labels.get('stage', '?')
+        failures = get('stage_failures_total', stage=stage) or 0
+        lines.append(f"{stage:<14} {histogram.count} call(s), avg {histogram.sum / histogram.count * 1000:.0f} ms, "
+                     f"p50 ~{histogram.quantile(0.5) * 1000:.0f} ms, p95 ~{histogram.quantile(0.95) * 1000:.0f} ms"
+                     + (f", {failures} failed" if failures else ""))
+    for labels, histogram in sorted(collect('api_request_seconds'), key=lambda item: item[0].get('service', '')):
+        service = labels.get('service', '?')
+        lines.append(f"{service + ' API':<14} {histogram.count} request(s), "
+                     f"p95 ~{histogram.quantile(0.95) * 1000:.0f} ms, "
+                     f"{get('api_errors_total', service=service) or 0} error(s), "
+                     f"{get('api_retries_total', service=service) or 0} retried")
+
+    counters = []
+    for name, label in (('emails_total', 'emails'), ('attachments_total', 'attachments'),
+                        ('ocr_chars_total', 'OCR chars'), ('rows_saved_total', 'rows saved')):
+        value = get(name)
+        if value:
+            counters.append(f"{value} {label}")
+    tokens = sum(value for _, value in collect('openai_tokens_total'))
+    if tokens:
+        counters.append(f"{tokens} OpenAI tokens")
+    for labels, value in sorted(collect('receipts_total'), key=lambda item: item[0].get('status', '')):
+        counters.append(f"{value} {labels.get('status')}")
+    if counters:
+        lines.append(', '.join(counters))
+    return lines
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(port=METRICS_PORT, host='127.0.0.1'):
+    """
+    Start the /metrics endpoint in a background thread (once per process)
+
+    Returns the server, or None when metrics or the endpoint are turned off.
+    """
+    global _server
+    if not _enabled or not port:
+        return None
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), MetricsHandler)
+            threading.Thread(target=_server.serve_forever, daemon=True, name='metrics').start()
+            print(f"📈 Metrics at http://{host}:{_server.server_address[1]}/metrics")
+        return _server
+
+
+def reset():
+    """Forget all recorded values (tests)"""
+    with _lock:
+        _values.clear()
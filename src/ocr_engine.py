@@ -0,0 +1,232 @@
+"""
+Pluggable OCR engines behind process_receipt
+
+- tesserocr: in-process binding to the Tesseract C API. The language model
+  stays loaded between calls (a bounded pool of API objects, OCR_API_POOL_SIZE).
+- pytesseract: starts a `tesseract` subprocess per call (fallback, no extra install)
+"""
+import sys
+import time
+import shlex
+import statistics
+import threading
+from pathlib import Path
+
+import pytesseract
+
+from config import OCR_ENGINE, OCR_API_POOL_SIZE, RECEIPTS_DIR
+
+
+class PytesseractEngine:
+    """One tesseract subprocess per image (writes a temp file, reloads the model)"""
+
+    name = 'pytesseract'
+
+    def __init__(self):
+        self._version = None
+
+    def version(self):
+        if self._version is None:
+            try:
+                self._version = str(pytesseract.get_tesseract_version())
+            except Exception:
+                self._version = 'unknown'
+        return self._version
+
+    def image_to_string(self, image, lang='eng', config=''):
+        return pytesseract.image_to_string(image, lang=lang, config=config)
+
+    def close(self):
+        pass
+
+
+class TesserocrEngine:
+    """
+    Pool of long-lived Tesseract API objects, each model is loaded once
+
+    Tesseract API objects are not thread-safe, so every call checks one out
+    (keyed by language and config) and returns it afterwards. At most
+    max_apis exist at a time, however many threads call in: short-lived
+    thread pools reuse the same loaded models instead of each loading new ones.
+    """
+
+    name = 'tesserocr'
+
+    def __init__(self, max_apis=OCR_API_POOL_SIZE):
+        import tesserocr  # optional dependency; ImportError means "not available"
+        self.tesserocr = tesserocr
+        self.max_apis = max(1, int(max_apis))
+        self.idle = {}      # (lang, config) → [api]
+        self.count = 0      # APIs in existence (idle or checked out)
+        self.created = 0
+        self.cond = threading.Condition()
+
+    def version(self):
+        return self.tesserocr.tesseract_version().split()[1]
+
+    def new_api(self, lang, config):
+        options = parse_config(config)
+        api = self.tesserocr.PyTessBaseAPI(lang=lang, oem=options.get('oem', self.tesserocr.OEM.DEFAULT))
+        if 'psm' in options:
+            api.SetPageSegMode(options['psm'])
+        for name, value in options['variables'].items():
+            api.SetVariable(name, value)
+        return api
+
+    def checkout(self, lang, config):
+        """An idle API for (lang, config), a new one while below max_apis, else wait"""
+        key = (lang, config)
+        with self.cond:
+            while True:
+                if self.idle.get(key):
+                    return self.idle[key].pop()
+                if self.count < self.max_apis:
+                    self.count += 1
+                    break
+                # Pool full: retire an idle API loaded for another language / config
+                other = next((apis for apis in self.idle.values() if apis), None)
+                if other:
+                    other.pop().End()
+                    self.count -= 1
+                    continue
+                self.cond.wait()
+        try:
+            api = self.new_api(lang, config)
+        except Exception:
+            with self.cond:
+                self.count -= 1
+                self.cond.notify()
+            raise
+        with self.cond:
+            self.created += 1
+        return api
+
+    def checkin(self, lang, config, api):
+        with self.cond:
+            self.idle.setdefault((lang, config), []).append(api)
+            self.cond.notify()
+
+    def image_to_string(self, image, lang='eng', config=''):
+        api = self.checkout(lang, config)
+        try:
+            api.SetImage(image)
+            return api.GetUTF8Text()
+        finally:
+            self.checkin(lang, config, api)
+
+    def close(self):
+        """End idle APIs (ones still checked out are ended by a later close)"""
+        with self.cond:
+            for apis in self.idle.values():
+                for api in apis:
+                    api.End()
+                    self.count -= 1
+            self.idle = {}
+            self.cond.notify_all()
+
+
+def parse_config(config):
+    """Translate a pytesseract config string ('--psm 6 -c key=value') for tesserocr"""
+    options = {'variables': {}}
+    tokens = shlex.split(config or '')
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token in ('--psm', '--oem') and i + 1 < len(tokens):
+            options[token[2:]] = int(tokens[i + 1])
+            i += 2
+        elif token == '-c' and i + 1 < len(tokens) and '=' in tokens[i + 1]:
+            name, value = tokens[i + 1].split('=', 1)
+            options['variables'][name] = value
+            i += 2
+        else:
+            i += 1
+    return options
+
+
+ENGINES = {
+    'tesserocr': TesserocrEngine,
+    'pytesseract': PytesseractEngine,
+}
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def create_engine(name):
+    """Build an engine by name; 'auto' prefers tesserocr and falls back to pytesseract"""
+    if name == 'auto':
+        try:
+            return TesserocrEngine()
+        except ImportError:
+            return PytesseractEngine()
+
+    try:
+        return ENGINES[name]()
+    except KeyError:
+        raise ValueError(f"Unknown OCR engine '{name}' (choose from: auto, {', '.join(ENGINES)})")
+    except ImportError:
+        print(f"⚠️  OCR engine '{name}' is not installed, falling back to pytesseract")
+        return PytesseractEngine()
+
+
+def get_engine():
+    """Process-wide OCR engine chosen by OCR_ENGINE (created on first use)"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = create_engine(OCR_ENGINE)
+            print(f"🔤 OCR engine: {_engine.name} (Tesseract {_engine.version()})")
+        return _engine
+
+
+def benchmark_engines(paths, repeat=3):
+    """Compare per-image OCR latency of every available engine"""
+    from image_preprocess import preprocess
+
+    images = []
+    for path in paths:
+        image, _ = preprocess(Path(path).read_bytes())
+        image.load()
+        images.append((Path(path).name, image))
+
+    print(f"\n🧪 Benchmarking OCR engines on {len(images)} image(s), {repeat} run(s) each\n")
+
+    for name in ENGINES:
+        try:
+            engine = create_engine(name)
+        except Exception as e:
+            print(f"⏭️  {name}: not available ({str(e)})")
+            continue
+        if engine.name != name:
+            continue
+
+        # First call includes model load for in-process engines
+        start = time.perf_counter()
+        engine.image_to_string(images[0][1])
+        first_call = time.perf_counter() - start
+
+        latencies = []
+        for _ in range(repeat):
+            for _, image in images:
+                start = time.perf_counter()
+                engine.image_to_string(image)
+                latencies.append(time.perf_counter() - start)
+        engine.close()
+
+        latencies.sort()
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"📊 {name:<12} first call {first_call*1000:7.0f} ms | "
+              f"mean {statistics.mean(latencies)*1000:7.0f} ms | "
+              f"median {statistics.median(latencies)*1000:7.0f} ms | "
+              f"p95 {p95*1000:7.0f} ms")
+
+
+if __name__ == "__main__":
+    # python ocr_engine.py [directory]
+    directory = Path(sys.argv[1]) if len(sys.argv) > 1 else RECEIPTS_DIR
+    files = sorted(list(directory.glob("*.jpg")) + list(directory.glob("*.png")))
+    if not files:
+        print(f"❌ No receipt images found in {directory}")
+    else:
+        benchmark_engines(files)
@@ -0,0 +1,98 @@
+"""
+PDF receipts: embedded text is used directly, scanned pages are OCR'd in parallel
+
+Pages are handled one at a time: each scanned page is rasterized only when
+it is reached, and at most a few rendered pages are held in memory at once.
+A PDF is one receipt: only its first PDF_MAX_PAGES pages are read, and when
+several pages carry their own total (several receipts in one file) only the
+first receipt is kept, so its total is not mixed with the others.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from config import MAX_WORKERS, PDF_RENDER_DPI, PDF_MAX_PAGES
+from fast_extract import find_total
+
+# A page with less embedded text than this is treated as a scanned image
+MIN_EMBEDDED_TEXT = 20
+
+
+def is_pdf(data):
+    """True if the bytes look like a PDF document"""
+    return b'%PDF-' in data[:1024]
+
+
+def first_receipt(page_texts):
+    """Pages up to the first one with its own total, if a later page has a total too"""
+    with_total = [
+        number for number, text in enumerate(page_texts)
+        if find_total([line.strip() for line in text.splitlines() if line.strip()])[0] is not None
+    ]
+    if len(with_total) < 2:
+        return page_texts
+    print(f"⚠️  PDF holds {len(with_total)} receipts (totals on pages "
+          f"{', '.join(str(number + 1) for number in with_total)}), only the first is read")
+    return page_texts[:with_total[0] + 1]
+
+
+def pdf_to_text(pdf_bytes, ocr_page, workers=MAX_WORKERS, max_pages=PDF_MAX_PAGES):
+    """
+    Text of the receipt's pages, merged in page order
+
+    Args:
+        pdf_bytes: the PDF file contents
+        ocr_page: function(png_bytes) → text, used for scanned pages
+        workers: scanned pages OCR'd in parallel
+        max_pages: pages read at most (the rest are ignored)
+    """
+    import pymupdf  # PyMuPDF, only needed once a PDF shows up
+
+    start = time.perf_counter()
+    workers = max(1, workers)
+    embedded_pages = 0
+    scanned_pages = 0
+
+    with pymupdf.open(stream=pdf_bytes, filetype='pdf') as doc:
+        page_count = min(doc.page_count, max(1, max_pages))
+        if page_count < doc.page_count:
+            print(f"⚠️  PDF has {doc.page_count} pages, only the first {page_count} are read")
+        page_texts = [''] * page_count
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            in_flight = {}
+
+            for page_number in range(page_count):
+                page = doc.load_page(page_number)
+                text = page.get_text().strip()
+
+                if len(text) >= MIN_EMBEDDED_TEXT:
+                    # Digital PDF page: no OCR needed
+                    page_texts[page_number] = text
+                    embedded_pages += 1
+                    continue
+
+                # Keep at most `workers` rendered pages waiting for OCR
+                if len(in_flight) >= workers:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        page_texts[in_flight.pop(future)] = future.result()
+
+                # Scanned page: rasterize lazily, OCR in a worker thread
+                pixmap = page.get_pixmap(dpi=PDF_RENDER_DPI, colorspace=pymupdf.csGRAY)
+                png_bytes = pixmap.tobytes('png')
+                del pixmap, page
+                in_flight[pool.submit(ocr_page, png_bytes)] = page_number
+                scanned_pages += 1
+
+            for future, page_number in in_flight.items():
+                page_texts[page_number] = future.result()
+
+    print(f"📄 PDF: {len(page_texts)} page(s), {embedded_pages} with embedded text, "
+          f"{scanned_pages} OCR'd in {time.perf_counter() - start:.2f}s")
+
+    page_texts = first_receipt(page_texts)
+    if len(page_texts) == 1:
+        return page_texts[0]
+    return '\n\n'.join(
+        f"--- Page {number} ---\n{text}" for number, text in enumerate(page_texts, start=1)
+    )
@@ -0,0 +1,374 @@
+"""
+Staged asyncio pipeline: Gmail → download → OCR → extract → sheet → confirm → mark read
+
+Each stage runs its own workers and hands work to the next through a bounded
+queue, so Gmail polling, OCR, OpenAI calls and sheet writes overlap instead of
+taking turns. A full queue makes the stage in front of it wait (backpressure).
+The blocking client libraries run in one thread pool per stage.
+
+Ctrl+C stops polling, lets everything already fetched finish, flushes the
+sheet writer and confirms the last emails; a second Ctrl+C exits at once.
+"""
+import time
+import signal
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (
+    GMAIL_FULL_SYNC_EVERY, EXTRACTION_BATCHING, EXTRACTION_BATCH_MAX,
+    PIPELINE_QUEUE_SIZE, PIPELINE_DOWNLOAD_WORKERS, PIPELINE_OCR_WORKERS,
+    PIPELINE_EXTRACT_WORKERS, PIPELINE_CONFIRM_WORKERS
+)
+from email_processor import EmailProcessor
+from process_receipt import (
+    prepare_receipt, extract_fields, extract_many, finish_receipt,
+    ocr_cache, extraction_cache, fast_path_stats
+)
+from sheets_helper import BufferedSheetWriter
+from journal import attachment_key
+import rate_limit
+import metrics
+
+# An email still in the pipeline after this many seconds (e.g. its sheet write
+# failed) may be picked up again by the next poll
+IN_FLIGHT_TTL = 600
+
+# How often the writer's age threshold is checked
+FLUSH_CHECK_INTERVAL = 1.0
+
+
+class EmailJob:
+    """One email on its way through the pipeline"""
+
+    def __init__(self, email_id, sender, attachments):
+        self.email_id = email_id
+        self.sender = sender
+        self.expected = len(attachments)
+        self.pairs = []
+
+    def add(self, att, result):
+        """Record one attachment result; True once all attachments are done"""
+        self.pairs.append((att, result))
+        return len(self.pairs) == self.expected
+
+
+class ReceiptPipeline:
+    """asyncio pipeline around an EmailProcessor"""
+
+    def __init__(self, processor=None, queue_size=PIPELINE_QUEUE_SIZE, download_workers=PIPELINE_DOWNLOAD_WORKERS,
+                 ocr_workers=PIPELINE_OCR_WORKERS, extract_workers=PIPELINE_EXTRACT_WORKERS,
+                 confirm_workers=PIPELINE_CONFIRM_WORKERS, batch_extraction=EXTRACTION_BATCHING):
+        self.processor = processor or EmailProcessor()
+        self.queue_size = queue_size
+        self.workers = {
+            'download': max(1, download_workers),
+            'ocr': max(1, ocr_workers),
+            'extract': max(1, extract_workers),
+            'write': 1,
+            'confirm': max(1, confirm_workers),
+        }
+        self.batch_extraction = batch_extraction
+        self.executors = {
+            stage: ThreadPoolExecutor(max_workers=count, thread_name_prefix=f"pipeline-{stage}")
+            for stage, count in self.workers.items()
+        }
+        self.counts = {stage: 0 for stage in ['fetch'] + list(self.workers)}
+        self.in_flight = {}
+        self.stopping = None
+        self.loop = None
+
+        # Rows landing in the sheet go to the confirm stage instead of being
+        # confirmed inside the flush
+        self.writer = BufferedSheetWriter(self.processor.sheets, on_flush=self.on_rows_saved)
+        self.processor.writer = self.writer
+
+    async def run_blocking(self, stage, func, *args):
+        """Run a blocking call in the stage's thread pool"""
+        return await self.loop.run_in_executor(self.executors[stage], func, *args)
+
+    def on_rows_saved(self, landed):
+        """Writer callback (any thread): journal landed rows, hand them to the confirm stage per email"""
+        if self.loop is None or self.loop.is_closed():
+            # Flushed at interpreter exit, after the pipeline stopped
+            self.processor.on_rows_saved(landed)
+            return
+        self.processor.record_written(landed)
+        groups = {}
+        for entry in landed:
+            groups.setdefault(entry['tag'], []).append(entry)
+        for group in groups.values():
+            self.loop.call_soon_threadsafe(self.queues['confirm'].put_nowait, group)
+
+    async def fetch_stage(self, interval, incremental):
+        """Poll Gmail every `interval` seconds and queue emails not already in flight"""
+        gmail = self.processor.gmail
+        tick = 0
+        while not self.stopping.is_set():
+            # Emails confirmed since the last poll are marked read in one request
+            await self.run_blocking('confirm', self.processor.flush_read)
+            full_sync = incremental and (
+                tick == 0 or (GMAIL_FULL_SYNC_EVERY > 0 and tick % GMAIL_FULL_SYNC_EVERY == 0)
+            )
+            if incremental:
+                emails = await self.run_blocking('download', gmail.get_new_receipts, full_sync)
+            else:
+                emails = await self.run_blocking('download', gmail.get_unread_receipts)
+            tick += 1
+
+            now = time.monotonic()
+            self.in_flight = {k: t for k, t in self.in_flight.items() if now - t < IN_FLIGHT_TTL}
+            new_emails = [email for email in emails
+                          if email['id'] not in self.in_flight and not gmail.is_pending_read(email['id'])]
+            if new_emails:
+                print(f"📬 Queued {len(new_emails)} email(s) ({len(emails) - len(new_emails)} already in progress)")
+            for email in new_emails:
+                self.in_flight[email['id']] = now
+                self.counts['fetch'] += 1
+                await self.queues['download'].put(email)   # waits while downstream is busy
+
+            try:
+                await asyncio.wait_for(self.stopping.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def download_stage(self):
+        """Email → its attachments (one item per attachment; journaled results skip OCR / AI)"""
+        queue = self.queues['download']
+        while True:
+            email = await queue.get()
+            try:
+                if await self.run_blocking('download', self.processor.resume_email, email):
+                    self.in_flight.pop(email['id'], None)
+                    continue
+                email_id, sender, attachments = await self.run_blocking(
+                    'download', self.processor.open_email, email
+                )
+                self.counts['download'] += 1
+                if not attachments:
+                    self.in_flight.pop(email_id, None)
+                    continue
+                known, _ = await self.run_blocking(
+                    'download', self.processor.journaled_results, email_id, attachments
+                )
+                job = EmailJob(email_id, sender, attachments)
+                for att in attachments:
+                    if attachment_key(att) in known:
+                        await self.queues['write'].put((job, att, known[attachment_key(att)]))
+                    else:
+                        await self.queues['ocr'].put((job, att))
+            except Exception as e:
+                print(f"❌ Could not download email {email.get('id')}: {str(e)}")
+                self.in_flight.pop(email.get('id'), None)
+            finally:
+                queue.task_done()
+
+    async def ocr_stage(self):
+        """Attachment → duplicate check + OCR"""
+        queue = self.queues['ocr']
+        while True:
+            job, att = await queue.get()
+            try:
+                prepared = await self.run_blocking('ocr', prepare_receipt, att['data'], att['filename'])
+            except Exception as e:
+                prepared = {"status": "error", "message": f"OCR failed: {str(e)}"}
+            try:
+                self.counts['ocr'] += 1
+                if prepared['status'] == 'ocr':
+                    await self.queues['extract'].put((job, att, prepared))
+                else:
+                    await self.queues['write'].put((job, att, prepared))
+            finally:
+                queue.task_done()
+
+    def finish_one(self, prepared, outcome):
+        """Extraction outcome → final result; failures become error results"""
+        if isinstance(outcome, Exception):
+            return {"status": "error", "message": f"AI extraction failed: {str(outcome)}"}
+        try:
+            return finish_receipt(prepared, *outcome)
+        except Exception as e:
+            return {"status": "error", "message": f"Could not finish receipt: {str(e)}"}
+
+    def extract_one(self, prepared):
+        """OCR text → final result (runs in the extract thread pool)"""
+        try:
+            outcome = extract_fields(prepared['raw_text'])
+        except Exception as e:
+            outcome = e
+        return self.finish_one(prepared, outcome)
+
+    def extract_batch(self, prepared_list):
+        """Several OCR texts → final results, packed into as few OpenAI requests as possible"""
+        try:
+            outcomes = extract_many([prepared['raw_text'] for prepared in prepared_list], workers=1)
+        except Exception as e:
+            outcomes = [e] * len(prepared_list)
+        return [self.finish_one(prepared, outcome) for prepared, outcome in zip(prepared_list, outcomes)]
+
+    async def extract_stage(self):
+        """OCR text → structured data (several at once with batch extraction)"""
+        queue = self.queues['extract']
+        while True:
+            items = [await queue.get()]
+            if self.batch_extraction:
+                # Take whatever else is already waiting, up to one request's worth
+                while len(items) < EXTRACTION_BATCH_MAX and not queue.empty():
+                    items.append(queue.get_nowait())
+            try:
+                try:
+                    if len(items) > 1:
+                        results = await self.run_blocking('extract', self.extract_batch, [p for _, _, p in items])
+                    else:
+                        results = [await self.run_blocking('extract', self.extract_one, items[0][2])]
+                except Exception as e:
+                    # Every item still reaches the write stage, so its email completes and drain() ends
+                    results = [{"status": "error", "message": f"AI extraction failed: {str(e)}"} for _ in items]
+                for (job, att, _), result in zip(items, results):
+                    self.counts['extract'] += 1
+                    await self.queues['write'].put((job, att, result))
+            finally:
+                for _ in items:
+                    queue.task_done()
+
+    async def write_stage(self):
+        """Collect results per email; complete emails are queued for the sheet writer"""
+        queue = self.queues['write']
+        while True:
+            job, att, result = await queue.get()
+            try:
+                if job.add(att, result):
+                    self.counts['write'] += 1
+                    handled = await self.run_blocking(
+                        'write', self.processor.handle_results, job.email_id, job.sender, job.pairs
+                    )
+                    if not handled or not any(r['status'] == 'success' for _, r in job.pairs):
+                        # No rows to wait for: done with this email
+                        self.in_flight.pop(job.email_id, None)
+            except Exception as e:
+                print(f"❌ Could not queue rows for email {job.email_id}: {str(e)}")
+            finally:
+                queue.task_done()
+
+    async def flush_stage(self):
+        """Flush the sheet writer when its age threshold is reached (and sample queue depths)"""
+        while True:
+            await asyncio.sleep(FLUSH_CHECK_INTERVAL)
+            for stage, queue in self.queues.items():
+                metrics.set_gauge('queue_depth', queue.qsize(), stage=stage)
+            metrics.set_gauge('emails_in_flight', len(self.in_flight))
+            if self.writer.is_due():
+                await self.run_blocking('write', self.writer.flush_if_due)
+
+    async def confirm_stage(self):
+        """Rows of one email landed → mark it read and send the confirmation"""
+        queue = self.queues['confirm']
+        while True:
+            group = await queue.get()
+            try:
+                await self.run_blocking('confirm', self.processor.confirm_emails, group)
+                self.counts['confirm'] += 1
+                if group[0]['tag']:
+                    self.in_flight.pop(group[0]['tag'][0], None)
+            except Exception as e:
+                print(f"⚠️  Could not confirm email: {str(e)}")
+            finally:
+                queue.task_done()
+
+    def request_stop(self):
+        """First Ctrl+C: drain; second: cancel everything"""
+        if self.stopping.is_set():
+            print("\n⛔ Stopping immediately")
+            for task in self.tasks:
+                task.cancel()
+            self.main_task.cancel()
+            return
+        print("\n\n👋 Stopping: finishing emails already in the pipeline (Ctrl+C again to quit now)...")
+        self.stopping.set()
+
+    async def drain(self, fetcher):
+        """Wait for every queue to empty, stage by stage, then flush and confirm"""
+        await fetcher
+        for stage in ('download', 'ocr', 'extract', 'write'):
+            await self.queues[stage].join()
+        await self.run_blocking('write', self.writer.flush)
+        await self.queues['confirm'].join()
+        await self.run_blocking('confirm', self.processor.flush_read)
+
+    async def run(self, interval=60, incremental=False):
+        """Run until Ctrl+C, then drain"""
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        self.main_task = asyncio.current_task()
+        self.queues = {stage: asyncio.Queue(maxsize=self.queue_size) for stage in self.workers}
+        # Landed rows must never block the writer thread
+        self.queues['confirm'] = asyncio.Queue()
+
+        stage_funcs = {
+            'download': self.download_stage,
+            'ocr': self.ocr_stage,
+            'extract': self.extract_stage,
+            'write': self.write_stage,
+            'confirm': self.confirm_stage,
+        }
+        self.tasks = [
+            asyncio.create_task(func(), name=f"{stage}-{n}")
+            for stage, func in stage_funcs.items()
+            for n in range(self.workers[stage])
+        ]
+        self.tasks.append(asyncio.create_task(self.flush_stage(), name='flush'))
+        fetcher = asyncio.create_task(self.fetch_stage(interval, incremental), name='fetch')
+
+        try:
+            self.loop.add_signal_handler(signal.SIGINT, self.request_stop)
+        except (NotImplementedError, RuntimeError):
+            pass   # e.g. Windows: KeyboardInterrupt ends the run without draining
+
+        metrics.serve()
+        mode = "incremental" if incremental else "full search"
+        print(f"\n🔄 Pipeline running (polling every {interval}s, {mode}, "
+              + ", ".join(f"{stage} ×{count}" for stage, count in self.workers.items()) + ")")
+        print("   Press Ctrl+C to stop\n")
+
+        try:
+            await self.drain(fetcher)
+        finally:
+            for task in self.tasks:
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+            try:
+                self.loop.remove_signal_handler(signal.SIGINT)
+            except (NotImplementedError, RuntimeError):
+                pass
+            for executor in self.executors.values():
+                executor.shutdown(wait=False, cancel_futures=True)
+            self.print_summary()
+
+    def print_summary(self):
+        print(f"\n{'='*60}")
+        print("📊 PIPELINE SUMMARY: " + ", ".join(f"{stage} {count}" for stage, count in self.counts.items()))
+        print(f"   Rows saved: {self.writer.total_saved}, duplicates skipped: "
+              f"{self.processor.duplicates + self.writer.total_duplicates}")
+        print(f"⚡ {ocr_cache.summary()}")
+        print(f"⚡ {extraction_cache.summary()}")
+        print(f"⚡ {fast_path_stats.summary()}")
+        for line in rate_limit.summary():
+            print(f"🚦 {line}")
+        if self.processor.journal is not None:
+            print(f"↩️  {self.processor.journal.summary()}")
+        for line in metrics.summary_lines():
+            print(f"📈 {line}")
+        print(f"{'='*60}\n")
+
+
+def run_pipeline(interval=60, incremental=False, processor=None, **options):
+    """Blocking entry point used by run.py"""
+    pipeline = ReceiptPipeline(processor, **options)
+    try:
+        asyncio.run(pipeline.run(interval, incremental))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    return pipeline
+
+
+if __name__ == "__main__":
+    run_pipeline()
@@ -1,102 +1,505 @@
 """
 Main receipt processing pipeline: Image → OCR → AI → Structured Data
 """
-import os
+import io
+import re
 import json
+import hashlib
+import threading
 from pathlib import Path
-import pytesseract
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
-from openai import OpenAI
 from dotenv import load_dotenv
 
 # Import configuration
-from config import OPENAI_API_KEY, RECEIPTS_DIR, GOOGLE_SHEET_ID
+from config import (
+    OPENAI_API_KEY, RECEIPTS_DIR, GOOGLE_SHEET_ID, CACHE_DIR,
+    OCR_CACHE_ENABLED, OCR_CACHE_MAX_MB, PREPROCESS_IMAGES, PREPROCESS_MAX_SIDE,
+    EXTRACTION_CACHE_ENABLED, EXTRACTION_CACHE_BYPASS,
+    EXTRACTION_CACHE_MAX_MB, EXTRACTION_CACHE_TTL_DAYS, DEDUP_ENABLED,
+    FAST_PATH_ENABLED, FAST_PATH_MIN_CONFIDENCE, MAX_WORKERS,
+    EXTRACTION_BATCH_TOKENS, EXTRACTION_BATCH_MAX
+)
+from cache import DiskCache
+from fast_extract import (
+    fast_extract, low_confidence_fields, FastPathStats, REQUIRED_FIELDS, OPTIONAL_FIELDS
+)
+from batch_extract import pack_batches, build_batch_messages, parse_batch_response
+from rate_limit import get_limiter
+import metrics
+from dedup import get_dedup_index, image_fingerprint, expense_key
+from ocr_engine import get_engine
+from image_preprocess import preprocess, describe, PREPROCESS_VERSION
+from pdf_receipts import is_pdf, pdf_to_text
 from sheets_helper import SheetsManager
 
 load_dotenv()
-# Initialize OpenAI
-client = OpenAI(api_key=OPENAI_API_KEY)
 
-def process_receipt(image_path):
+# OpenAI client, created on first use (see get_openai_client)
+client = None
+_client_lock = threading.Lock()
+
+# Tesseract options (part of the OCR cache key)
+TESSERACT_LANG = 'eng'
+TESSERACT_CONFIG = ''
+
+# AI extraction settings
+EXTRACTION_MODEL = "gpt-4o-mini"
+EXTRACTION_PROMPT = """Extract receipt data as JSON:
+                    {
+                        "vendor": "merchant name",
+                        "date": "YYYY-MM-DD",
+                        "total": number,
+                        "currency": "INR/USD/etc",
+                        "category": "Food|Transport|Shopping|Services|Other",
+                        "tax": number or null,
+                        "items": ["item1", "item2"] or null
+                    }
+                    Use null for missing fields."""
+# Changing the prompt changes this hash, which invalidates old cache entries
+PROMPT_VERSION = hashlib.sha256(EXTRACTION_PROMPT.encode('utf-8')).hexdigest()[:12]
+ALL_FIELDS = REQUIRED_FIELDS + OPTIONAL_FIELDS
+
+# OCR results keyed by image bytes + Tesseract version + options
+ocr_cache = DiskCache(CACHE_DIR / 'ocr', max_bytes=OCR_CACHE_MAX_MB * 1024 * 1024, name='OCR cache')
+
+# Extraction results keyed by normalized OCR text + model + prompt version
+extraction_cache = DiskCache(
+    CACHE_DIR / 'extraction',
+    max_bytes=EXTRACTION_CACHE_MAX_MB * 1024 * 1024,
+    name='Extraction cache',
+    ttl=EXTRACTION_CACHE_TTL_DAYS * 24 * 3600
+)
+
+# How many receipts the rule-based extractor handled without OpenAI
+fast_path_stats = FastPathStats()
+
+
+def get_openai_client():
+    """Create the OpenAI client on first use (importing openai is slow)"""
+    global client
+    with _client_lock:
+        if client is None:
+            from openai import OpenAI
+            # Retries are handled by the shared rate limiter (rate_limit.py)
+            client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+        return client
+
+
+def run_ocr(image_bytes, preprocess_image=PREPROCESS_IMAGES):
     """
-    Complete pipeline: Receipt image → Structured JSON
+    Image bytes → text, served from the OCR cache when the same image
+    was already read with the same Tesseract version and options
     
-    Args:
-        image_path: str or Path object pointing to receipt image
+    With preprocess_image the photo is downscaled, deskewed and binarized
+    before Tesseract sees it (see image_preprocess.py). The OCR engine is
+    chosen by OCR_ENGINE (see ocr_engine.py).
     """
-    # Convert to Path object for consistent handling
-    image_path = Path(image_path)
+    engine = get_engine()
+    prep_options = f"{PREPROCESS_VERSION}:{PREPROCESS_MAX_SIDE}" if preprocess_image else 'raw'
+    
+    key = None
+    if OCR_CACHE_ENABLED:
+        key = ocr_cache.make_key(image_bytes, engine.version(), TESSERACT_LANG, TESSERACT_CONFIG, prep_options)
+        cached = ocr_cache.get(key)
+        if cached is not None:
+            print("⚡ OCR cache hit, skipping Tesseract")
+            return cached['text']
+    
+    if preprocess_image:
+        image, info = preprocess(image_bytes)
+        print(f"🖼️  Preprocessed {describe(info)}")
+    else:
+        image = Image.open(io.BytesIO(image_bytes))
+    text = engine.image_to_string(image, lang=TESSERACT_LANG, config=TESSERACT_CONFIG)
+    
+    if key is not None:
+        ocr_cache.set(key, {'text': text})
+    return text
+
+
+@metrics.timed('ocr')
+def receipt_to_text(data):
+    """Receipt file contents → text (PDFs page by page, images via OCR)"""
+    if is_pdf(data):
+        return pdf_to_text(data, ocr_page=run_ocr)
+    return run_ocr(data)
+
+
+def normalize_ocr_text(raw_text):
+    """Collapse whitespace and blank lines so trivially different OCR output shares a cache key"""
+    lines = (re.sub(r'\s+', ' ', line).strip() for line in raw_text.splitlines())
+    return '\n'.join(line for line in lines if line)
+
+
+def extraction_key(raw_text, fields=None):
+    """Extraction cache key: normalized text, model, prompt version (and requested fields)"""
+    parts = [normalize_ocr_text(raw_text), EXTRACTION_MODEL, PROMPT_VERSION]
+    if fields:
+        parts.append(','.join(fields))
+    return extraction_cache.make_key(*parts)
+
+
+def llm_extract(raw_text, fields=None, refresh=False):
+    """
+    OCR text → structured receipt data via OpenAI
+    
+    fields limits the answer to those keys (None = the whole schema).
+    Results are cached by normalized text, model, prompt version and fields.
+    refresh=True (or EXTRACTION_CACHE_BYPASS=1) skips the cache lookup and
+    stores the fresh result.
+    """
+    prompt = EXTRACTION_PROMPT
+    if fields:
+        prompt += f"\nOnly these fields are needed: {', '.join(fields)}."
+    
+    key = None
+    if EXTRACTION_CACHE_ENABLED:
+        key = extraction_key(raw_text, fields)
+        if not (refresh or EXTRACTION_CACHE_BYPASS):
+            cached = extraction_cache.get(key)
+            if cached is not None:
+                print("⚡ Extraction cache hit, skipping OpenAI")
+                return cached
+    
+    response = get_limiter('openai').call(
+        get_openai_client().chat.completions.create,
+        model=EXTRACTION_MODEL,
+        messages=[
+            {
+                "role": "system",
+                "content": prompt
+            },
+            {
+                "role": "user",
+                "content": f"Receipt text:\n\n{raw_text}"
+            }
+        ],
+        response_format={"type": "json_object"}
+    )
+    metrics.record_usage(response)
+    
+    data = json.loads(response.choices[0].message.content)
+    
+    if key is not None:
+        extraction_cache.set(key, data)
+    return data
+
+
+def llm_extract_batch(batch):
+    """
+    Several (id, text, fields) receipts in one OpenAI request → {id: data}
+    
+    Receipts missing from (or malformed in) the answer are retried one by
+    one; a receipt that still fails maps to its exception.
+    """
+    answers = {}
+    try:
+        response = get_limiter('openai').call(
+            get_openai_client().chat.completions.create,
+            model=EXTRACTION_MODEL,
+            messages=build_batch_messages(EXTRACTION_PROMPT, batch, ALL_FIELDS),
+            response_format={"type": "json_object"}
+        )
+        metrics.record_usage(response)
+        answers = parse_batch_response(
+            response.choices[0].message.content, {item_id for item_id, _, _ in batch}
+        )
+    except Exception as e:
+        print(f"⚠️  Batched extraction of {len(batch)} receipt(s) failed: {str(e)}")
+    
+    results = {}
+    for item_id, text, fields in batch:
+        if item_id in answers:
+            if EXTRACTION_CACHE_ENABLED:
+                extraction_cache.set(extraction_key(text, fields), answers[item_id])
+            results[item_id] = answers[item_id]
+            continue
+        print(f"↩️  Receipt {item_id} missing from the batched answer, retrying on its own")
+        try:
+            results[item_id] = llm_extract(text, fields, refresh=True)
+        except Exception as e:
+            results[item_id] = e
+    return results
+
+
+def plan_extraction(raw_text, use_fast_path=FAST_PATH_ENABLED):
+    """
+    Run the rule-based extractor and decide what still needs the LLM
+    
+    Returns a dict with data, confidence, fields (None = whole schema,
+    [] = no LLM call needed), source ('fast', 'partial' or 'llm') and
+    from_rules (required fields the rules were sure about).
+    """
+    if not use_fast_path:
+        return {'data': {}, 'confidence': {}, 'fields': None, 'source': 'llm', 'from_rules': 0}
+    
+    data, confidence = fast_extract(raw_text)
+    uncertain = low_confidence_fields(confidence, FAST_PATH_MIN_CONFIDENCE)
+    plan = {'data': data, 'confidence': confidence, 'from_rules': len(REQUIRED_FIELDS) - len(uncertain)}
+    
+    if not uncertain:
+        plan.update(fields=[], source='fast')
+    elif plan['from_rules'] == 0:
+        plan.update(fields=None, source='llm')
+    else:
+        missing_optional = [field for field in OPTIONAL_FIELDS if data.get(field) is None]
+        plan.update(fields=uncertain + missing_optional, source='partial')
+    return plan
+
+
+def apply_answer(plan, answer):
+    """Merge an LLM answer into a plan → (data, field_confidence, source)"""
+    data = dict(plan['data'])
+    confidence = dict(plan['confidence'])
+    if plan['fields'] is None:
+        data.update(answer)
+    for field in plan['fields'] or ALL_FIELDS:
+        data[field] = answer.get(field)
+        confidence[field] = None
+    fast_path_stats.record(plan['source'], plan['from_rules'])
+    return data, confidence, plan['source']
+
+
+@metrics.timed('extract')
+def extract_fields(raw_text, refresh=False, use_fast_path=FAST_PATH_ENABLED):
+    """
+    OCR text → (data, field_confidence, source)
+    
+    The rule-based extractor runs first. If it is confident about every
+    required field OpenAI is not called at all (source 'fast'); otherwise
+    only the uncertain fields, plus tax/items if missing, are asked from the
+    LLM (source 'partial'). field_confidence is None for LLM-provided fields.
+    """
+    plan = plan_extraction(raw_text, use_fast_path)
+    
+    if plan['fields'] == []:
+        print("⚡ Fast path: all fields read from OCR text, skipping OpenAI")
+        fast_path_stats.record('fast', plan['from_rules'])
+        return plan['data'], plan['confidence'], 'fast'
+    
+    if plan['source'] == 'partial':
+        uncertain = [field for field in plan['fields'] if field in REQUIRED_FIELDS]
+        print(f"🤖 Fast path unsure about {', '.join(uncertain)}, asking OpenAI for those only")
+    
+    answer = llm_extract(raw_text, fields=plan['fields'], refresh=refresh)
+    return apply_answer(plan, answer)
+
+
+def extract_data(raw_text, refresh=False):
+    """OCR text → structured receipt data (fast path first, then OpenAI)"""
+    data, _, _ = extract_fields(raw_text, refresh=refresh)
+    return data
+
+
+@metrics.timed('extract_batch')
+def extract_many(texts, refresh=False, use_fast_path=FAST_PATH_ENABLED,
+                 max_tokens=EXTRACTION_BATCH_TOKENS, max_items=EXTRACTION_BATCH_MAX, workers=MAX_WORKERS):
+    """
+    Extract several OCR texts, packing the LLM work into as few requests as possible
+    
+    Fast-path and cached receipts need no request; the rest are packed into
+    batches of at most max_items receipts / max_tokens tokens (see
+    batch_extract.py), sent by up to `workers` threads. Returns one entry per
+    text, in order: (data, field_confidence, source) or the exception that
+    made that receipt fail.
+    """
+    plans = [plan_extraction(text, use_fast_path) for text in texts]
+    results = [None] * len(texts)
+    answers = {}
+    pending = []
+    
+    for index, (text, plan) in enumerate(zip(texts, plans)):
+        if plan['fields'] == []:
+            fast_path_stats.record('fast', plan['from_rules'])
+            results[index] = (plan['data'], plan['confidence'], 'fast')
+            continue
+        if EXTRACTION_CACHE_ENABLED and not (refresh or EXTRACTION_CACHE_BYPASS):
+            cached = extraction_cache.get(extraction_key(text, plan['fields']))
+            if cached is not None:
+                answers[str(index)] = cached
+                continue
+        pending.append((str(index), text, plan['fields']))
+    
+    batches = pack_batches(pending, max_tokens, max(1, max_items))
+    if pending:
+        print(f"📦 {len(pending)} receipt(s) need OpenAI: sending {len(batches)} request(s) "
+              f"({len(texts) - len(pending) - len(answers)} fast path, {len(answers)} cached)")
+    
+    def send(batch):
+        if len(batch) == 1:
+            item_id, text, fields = batch[0]
+            try:
+                return {item_id: llm_extract(text, fields, refresh=True)}
+            except Exception as e:
+                return {item_id: e}
+        return llm_extract_batch(batch)
+    
+    if batches:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(batches)))) as pool:
+            for batch_answers in pool.map(send, batches):
+                answers.update(batch_answers)
     
+    for item_id, answer in answers.items():
+        index = int(item_id)
+        if isinstance(answer, Exception):
+            results[index] = answer
+        else:
+            results[index] = apply_answer(plans[index], answer)
+    return results
+
+
+def load_receipt(source, name=None):
+    """
+    Read receipt bytes from a path, raw bytes or a binary file-like object
+    
+    Returns (image_bytes, display_name); image_bytes is None if a path does not exist.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source), name or 'in-memory receipt'
+    
+    if hasattr(source, 'read'):
+        return source.read(), name or getattr(source, 'name', None) or 'in-memory receipt'
+    
+    # Convert to Path object for consistent handling
+    image_path = Path(source)
     if not image_path.exists():
+        return None, name or str(image_path)
+    return image_path.read_bytes(), name or image_path.name
+
+
+def prepare_receipt(source, name=None, check_duplicates=DEDUP_ENABLED):
+    """
+    Load, duplicate-check and OCR one receipt
+    
+    Returns a result dict: status 'ocr' (with raw_text and fingerprint) when
+    the receipt is ready for extraction, otherwise 'duplicate' or 'error'.
+    """
+    image_bytes, name = load_receipt(source, name)
+    
+    if image_bytes is None:
         return {
             "status": "error",
-            "message": f"Image not found: {image_path}"
+            "message": f"Image not found: {name}"
         }
     
     print(f"\n{'='*60}")
-    print(f"🎯 PROCESSING: {image_path.name}")
-    print(f"   Full path: {image_path}")
+    print(f"🎯 PROCESSING: {name}")
+    if isinstance(source, (str, Path)):
+        print(f"   Full path: {source}")
     print(f"{'='*60}\n")
     
+    # Step 0: Same image already saved? Then skip OCR and AI entirely
+    fingerprint = image_fingerprint(image_bytes)
+    if check_duplicates:
+        seen = get_dedup_index().find_image(fingerprint)
+        if seen:
+            print(f"♻️  Duplicate image (already saved as {seen}), skipping")
+            return {"status": "duplicate", "message": f"Same image as {seen}", "fingerprint": fingerprint}
+    
     # Step 1: OCR
     print("📸 Step 1: Running OCR...")
     try:
-        image = Image.open(image_path)
-        raw_text = pytesseract.image_to_string(image)
+        raw_text = receipt_to_text(image_bytes)
         print(f"✅ Extracted {len(raw_text)} characters")
+        metrics.inc('ocr_chars_total', len(raw_text))
     except Exception as e:
         return {"status": "error", "message": f"OCR failed: {str(e)}"}
     
-    # Step 2: AI Extraction
-    print("\n🤖 Step 2: AI extraction...")
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system",
-                    "content": """Extract receipt data as JSON:
-                    {
-                        "vendor": "merchant name",
-                        "date": "YYYY-MM-DD",
-                        "total": number,
-                        "currency": "INR/USD/etc",
-                        "category": "Food|Transport|Shopping|Services|Other",
-                        "tax": number or null,
-                        "items": ["item1", "item2"] or null
-                    }
-                    Use null for missing fields."""
-                },
-                {
-                    "role": "user",
-                    "content": f"Receipt text:\n\n{raw_text}"
-                }
-            ],
-            response_format={"type": "json_object"}
-        )
-        
-        data = json.loads(response.choices[0].message.content)
-        print("✅ Data extracted successfully")
-        
-    except Exception as e:
-        return {"status": "error", "message": f"AI extraction failed: {str(e)}"}
+    return {"status": "ocr", "name": name, "raw_text": raw_text, "fingerprint": fingerprint}
+
+
+def finish_receipt(prepared, data, field_confidence, extraction_source, check_duplicates=DEDUP_ENABLED):
+    """Duplicate-check the extracted data and build the final result"""
+    fingerprint = prepared['fingerprint']
+    raw_text = prepared['raw_text']
+    
+    # Same vendor / date / total already saved from another file?
+    if check_duplicates:
+        seen = get_dedup_index().find_expense(expense_key(data))
+        if seen:
+            print(f"♻️  Duplicate expense (already saved as {seen}), skipping")
+            return {"status": "duplicate", "message": f"Same expense as {seen}",
+                    "data": data, "fingerprint": fingerprint}
     
     # Step 3: Return result
     result = {
         "status": "success",
         "data": data,
         "raw_text": raw_text,
-        "confidence": "high" if len(raw_text) > 50 else "low"
+        "fingerprint": fingerprint,
+        "confidence": "high" if len(raw_text) > 50 else "low",
+        "field_confidence": field_confidence,
+        "extraction": extraction_source
     }
     
     print(f"\n{'='*60}")
-    print("📊 FINAL RESULT:")
+    print(f"📊 FINAL RESULT: {prepared['name']}")
     print(f"{'='*60}")
     print(json.dumps(data, indent=2))
     print(f"{'='*60}\n")
     
     return result
 
+
+def process_receipt(source, refresh_extraction=False, name=None, check_duplicates=DEDUP_ENABLED):
+    """
+    Complete pipeline: Receipt image → Structured JSON
+    
+    Args:
+        source: str/Path pointing to a receipt image or PDF, or the file itself
+                as bytes or a binary file-like object (nothing is written to disk)
+        refresh_extraction: re-run AI extraction even if it is cached
+        name: label used in log output (defaults to the file name)
+        check_duplicates: return status 'duplicate' for receipts already in the
+                          sheet (same image, or same vendor/date/total/currency)
+    """
+    prepared = prepare_receipt(source, name, check_duplicates)
+    if prepared['status'] != 'ocr':
+        return prepared
+    
+    # Step 2: AI Extraction
+    print("\n🤖 Step 2: AI extraction...")
+    try:
+        data, field_confidence, extraction_source = extract_fields(
+            prepared['raw_text'], refresh=refresh_extraction
+        )
+        print(f"✅ Data extracted successfully ({extraction_source})")
+        
+    except Exception as e:
+        return {"status": "error", "message": f"AI extraction failed: {str(e)}"}
+    
+    return finish_receipt(prepared, data, field_confidence, extraction_source, check_duplicates)
+
+
+def process_receipts(sources, names=None, refresh_extraction=False,
+                     check_duplicates=DEDUP_ENABLED, workers=MAX_WORKERS):
+    """
+    Several receipts at once: OCR in parallel, then extraction packed into
+    as few OpenAI requests as possible (see extract_many)
+    
+    Returns one result per source, in order (same shape as process_receipt).
+    """
+    names = names or [None] * len(sources)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(sources) or 1))) as pool:
+        prepared = list(pool.map(
+            lambda source, name: prepare_receipt(source, name, check_duplicates), sources, names
+        ))
+    
+    ready = [index for index, item in enumerate(prepared) if item['status'] == 'ocr']
+    print(f"\n🤖 AI extraction for {len(ready)} receipt(s)...")
+    extracted = extract_many(
+        [prepared[index]['raw_text'] for index in ready], refresh=refresh_extraction, workers=workers
+    )
+    
+    results = list(prepared)
+    for index, outcome in zip(ready, extracted):
+        if isinstance(outcome, Exception):
+            results[index] = {"status": "error", "message": f"AI extraction failed: {str(outcome)}"}
+        else:
+            results[index] = finish_receipt(prepared[index], *outcome, check_duplicates=check_duplicates)
+    return results
+
 def test_multiple_receipts():
     """Test with all receipts in receipts/ folder"""
     
@@ -132,9 +535,14 @@ def test_multiple_receipts():
     print("📈 TEST SUMMARY")
     print(f"{'='*60}")
     successful = sum(1 for r in results if r["status"] == "success")
+    duplicates = sum(1 for r in results if r["status"] == "duplicate")
     print(f"✅ Successful: {successful}/{len(results)}")
-    print(f"❌ Failed: {len(results) - successful}/{len(results)}")
+    print(f"♻️  Duplicates: {duplicates}/{len(results)}")
+    print(f"❌ Failed: {len(results) - successful - duplicates}/{len(results)}")
     print(f"📊 Success Rate: {successful/len(results)*100:.1f}%")
+    print(f"⚡ {ocr_cache.summary()}")
+    print(f"⚡ {extraction_cache.summary()}")
+    print(f"⚡ {fast_path_stats.summary()}")
     print(f"{'='*60}\n")
     
     return results
@@ -159,8 +567,8 @@ def process_and_save_receipt(image_path):
     print("\n💾 Saving to Google Sheets...")
     try:
         sheets_manager = SheetsManager()
-        sheets_manager.add_expense(result['data'])
-        print("✅ Saved to Google Sheets!")
+        if sheets_manager.add_expense(result['data'], fingerprint=result['fingerprint']):
+            print("✅ Saved to Google Sheets!")
     except Exception as e:
         print(f"⚠️  Warning: Could not save to sheets: {str(e)}")
         # Don't fail completely if sheets fails
@@ -201,6 +609,9 @@ def test_full_pipeline():
     
     print(f"\n{'='*60}")
     print("✅ ALL RECEIPTS PROCESSED AND SAVED!")
+    print(f"⚡ {ocr_cache.summary()}")
+    print(f"⚡ {extraction_cache.summary()}")
+    print(f"⚡ {fast_path_stats.summary()}")
     print(f"{'='*60}")
     print("\n🔗 Check your Google Sheet:")
     print(f"https://docs.google.com/spreadsheets/d/{GOOGLE_SHEET_ID}/edit")
@@ -0,0 +1,269 @@
+"""
+Shared rate limiting and retries for OpenAI, Gmail and Sheets calls
+
+Each service gets one RateLimiter per process:
+- a token bucket caps the request rate (requests/second plus a burst)
+- an adaptive concurrency limit halves when the service throttles us and
+  creeps back up while calls succeed (AIMD)
+- 429 / 5xx / connection errors are retried with jittered exponential
+  backoff, waiting at least as long as the server's Retry-After says
+"""
+import time
+import random
+import threading
+
+import metrics
+from config import (
+    RATE_LIMIT_OPENAI, RATE_LIMIT_GMAIL, RATE_LIMIT_SHEETS,
+    RATE_LIMIT_MAX_CONCURRENCY, RATE_LIMIT_MAX_RETRIES
+)
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# Google reports some quota errors as 403 with one of these reasons
+RATE_LIMIT_REASONS = ('ratelimitexceeded', 'userratelimitexceeded', 'quotaexceeded')
+# Transport errors worth retrying (matched by class name so openai/httplib2 stay optional)
+RETRYABLE_ERRORS = ('APIConnectionError', 'APITimeoutError', 'ConnectionError', 'TimeoutError',
+                    'timeout', 'ServerNotFoundError', 'RemoteDisconnected')
+
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+
+
+def error_status(exc):
+    """HTTP status of an API error (OpenAI, googleapiclient, urllib), or None"""
+    for attr in ('status_code', 'code', 'status'):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    resp = getattr(exc, 'resp', None)
+    if resp is not None and getattr(resp, 'status', None) is not None:
+        return int(resp.status)
+    return None
+
+
+def error_headers(exc):
+    """Response headers of an API error as a case-insensitive getter"""
+    for source in (getattr(exc, 'response', None), exc):
+        headers = getattr(source, 'headers', None)
+        if headers is not None:
+            return headers
+    return getattr(exc, 'resp', None) or {}
+
+
+def retry_after(exc):
+    """Seconds the server asked us to wait (Retry-After header), or None"""
+    headers = error_headers(exc)
+    value = None
+    for name in ('retry-after', 'Retry-After'):
+        try:
+            value = headers.get(name)
+        except AttributeError:
+            return None
+        if value is not None:
+            break
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(exc):
+    """True for throttling, server errors and dropped connections"""
+    status = error_status(exc)
+    if status in RETRYABLE_STATUSES:
+        return True
+    if status == 403:
+        content = getattr(exc, 'content', b'') or b''
+        if isinstance(content, bytes):
+            content = content.decode('utf-8', 'replace')
+        return any(reason in content.lower() for reason in RATE_LIMIT_REASONS)
+    if status is None:
+        return any(cls.__name__ in RETRYABLE_ERRORS for cls in type(exc).__mro__)
+    return False
+
+
+def is_throttle(exc):
+    """True if the error means 'slow down' (as opposed to a server failure)"""
+    status = error_status(exc)
+    return status == 429 or (status == 403 and is_retryable(exc))
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, bursts of up to `burst`"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Block until `tokens` requests may be sent"""
+        if self.rate <= 0:
+            return
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveConcurrency:
+    """
+    Concurrency limit that adapts to throttling (AIMD)
+
+    A throttled call halves the limit; each successful call adds 1/limit,
+    so the limit grows by about one per round of successful calls.
+    """
+
+    def __init__(self, maximum, minimum=1):
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.limit = float(self.maximum)
+        self.active = 0
+        self.condition = threading.Condition()
+
+    def __enter__(self):
+        with self.condition:
+            while self.active >= int(self.limit):
+                self.condition.wait()
+            self.active += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def on_success(self):
+        with self.condition:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def on_throttle(self):
+        with self.condition:
+            self.limit = max(self.minimum, self.limit / 2)
+
+
+class RateLimiter:
+    """Token bucket + adaptive concurrency + retries for one service"""
+
+    def __init__(self, name, rate, burst=None, max_concurrency=RATE_LIMIT_MAX_CONCURRENCY,
+                 max_retries=RATE_LIMIT_MAX_RETRIES, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+
+    def backoff(self, attempt, server_delay=None):
+        """Seconds to wait before retry number `attempt` (0-based)"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if server_delay is not None:
+            delay = max(delay, min(server_delay, self.max_delay))
+        return delay
+
+    def record(self, exc=None):
+        """Feed the outcome of a call into the stats and the concurrency limit"""
+        with self.lock:
+            self.calls += 1
+            if exc is not None and is_throttle(exc):
+                self.throttled += 1
+        if exc is not None:
+            metrics.inc('api_errors_total', service=self.name)
+            if is_throttle(exc):
+                metrics.inc('api_throttled_total', service=self.name)
+        if exc is None:
+            self.concurrency.on_success()
+        elif is_throttle(exc):
+            self.concurrency.on_throttle()
+
+    def wait_before_retry(self, attempt, exc):
+        """Sleep for the backoff of a failed attempt and count the retry"""
+        delay = self.backoff(attempt, retry_after(exc))
+        with self.lock:
+            self.retries += 1
+        metrics.inc('api_retries_total', service=self.name)
+        print(f"⏳ {self.name}: {error_status(exc) or type(exc).__name__}, "
+              f"retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+        time.sleep(delay)
+
+    def call(self, func, *args, cost=1, idempotent=True, batch=False, **kwargs):
+        """
+        Run func(*args, **kwargs) within the limits, retrying retryable errors
+
+        cost is the number of requests the call makes (e.g. a batch request).
+        batch=True: func sends a batch envelope whose sub-requests are recorded
+        by their own callbacks, so a successful envelope is not counted again.
+        idempotent=False (appends, sends) only retries when the service
+        refused the call outright (429), never after a 5xx or dropped
+        connection where it may already have been applied.
+        """
+        attempt = 0
+        while True:
+            with self.concurrency:
+                self.bucket.acquire(cost)
+                start = time.perf_counter()
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as e:
+                    metrics.observe('api_request_seconds', time.perf_counter() - start, service=self.name)
+                    self.record(e)
+                    retryable = is_retryable(e) if idempotent else is_throttle(e)
+                    if not retryable or attempt >= self.max_retries:
+                        raise
+                    error = e
+                else:
+                    metrics.observe('api_request_seconds', time.perf_counter() - start, service=self.name)
+                    if not batch:
+                        self.record()
+                    return result
+            self.wait_before_retry(attempt, error)
+            attempt += 1
+
+    def summary(self):
+        return (f"{self.name}: {self.calls} call(s), {self.throttled} throttled, "
+                f"{self.retries} retried, concurrency limit {int(self.concurrency.limit)}")
+
+
+# Requests per second allowed per service (0 = no rate cap)
+RATES = {
+    'openai': RATE_LIMIT_OPENAI,
+    'gmail': RATE_LIMIT_GMAIL,
+    'sheets': RATE_LIMIT_SHEETS,
+}
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(service):
+    """Process-wide RateLimiter for 'openai', 'gmail' or 'sheets'"""
+    with _limiters_lock:
+        if service not in _limiters:
+            _limiters[service] = RateLimiter(service, RATES.get(service, 0))
+        return _limiters[service]
+
+
+def execute(request, service, idempotent=True):
+    """request.execute() for a googleapiclient request, rate limited and retried"""
+    return get_limiter(service).call(request.execute, idempotent=idempotent)
+
+
+def summary():
+    """One line per service that has been called"""
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return [limiter.summary() for limiter in limiters if limiter.calls]
@@ -2,16 +2,24 @@
 Google Sheets integration - write expense data to spreadsheet
 """
 import os
+import re
+import time
+import atexit
+import weakref
+import threading
 from datetime import datetime
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
 from dotenv import load_dotenv
 
 # Import configuration
-from config import CREDENTIALS_PATH, GOOGLE_SHEET_ID
+from config import GOOGLE_SHEET_ID, SHEETS_BATCH_SIZE, SHEETS_BATCH_MAX_AGE, LEDGER_ENABLED, DEDUP_ENABLED
+from google_services import get_service, APIS
+from ledger import get_ledger
+from dedup import get_dedup_index, expense_key
+from rate_limit import execute
+import metrics
 
 # Configuration
-SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+SCOPES = APIS['sheets'][1]
 load_dotenv()
 
 
@@ -23,21 +31,35 @@ load_dotenv()
 class SheetsManager:
     """Manage Google Sheets operations"""
     
-    def __init__(self):
-        """Initialize Google Sheets API client"""
-        print("🔐 Authenticating with Google Sheets...")
-        print(f"   Using credentials: {CREDENTIALS_PATH}")
-        
-        # Load credentials (using absolute path)
-        creds = service_account.Credentials.from_service_account_file(
-            str(CREDENTIALS_PATH), scopes=SCOPES
-        )
-        
-        # Build service
-        self.service = build('sheets', 'v4', credentials=creds)
-        self.sheet = self.service.spreadsheets()
+    def __init__(self, service=None, ledger=None, dedup=None):
+        """
+        Initialize Google Sheets API client
         
-        print("✅ Connected to Google Sheets")
+        Args:
+            service: ready-made Sheets service; otherwise the shared per-thread
+                     client from google_services is used (built on first use)
+            ledger: local ExpenseLedger mirror (default: the shared one,
+                    unless LEDGER_ENABLED=0)
+            dedup: DedupIndex that saved rows are registered in (default: the
+                   shared one, unless DEDUP_ENABLED=0)
+        """
+        self.service = service
+        if ledger is None and LEDGER_ENABLED:
+            ledger = get_ledger()
+        self.ledger = ledger
+        if dedup is None and DEDUP_ENABLED:
+            dedup = get_dedup_index()
+        self.dedup = dedup
+    
+    @property
+    def sheet(self):
+        """spreadsheets() resource for the calling thread"""
+        service = self.service if self.service is not None else get_service('sheets')
+        return service.spreadsheets()
+    
+    def connect(self):
+        """Authenticate with the service account and build the Sheets client"""
+        get_service('sheets')
         
     def setup_sheet(self):
         """Create headers if sheet is empty"""
@@ -59,34 +81,18 @@ class SheetsManager:
             'values': [headers]
         }
         
-        self.sheet.values().update(
+        execute(self.sheet.values().update(
             spreadsheetId=GOOGLE_SHEET_ID,
             range='A1:H1',
             valueInputOption='RAW',
             body=body
-        ).execute()
+        ), 'sheets')
         
         print("✅ Headers created")
     
-    def add_expense(self, expense_data):
-        """
-        Add expense to sheet
-        
-        expense_data format:
-        {
-            'vendor': 'Starbucks',
-            'date': '2025-10-22',
-            'total': 735.00,
-            'currency': 'INR',
-            'category': 'Food',
-            'tax': 35.00,
-            'items': ['Latte', 'Croissant']
-        }
-        """
-        print(f"📝 Adding expense: {expense_data.get('vendor', 'Unknown')}")
-        
-        # Prepare row data
-        row = [
+    def build_row(self, expense_data):
+        """Convert extracted expense data into a sheet row (A:H)"""
+        return [
             expense_data.get('date', ''),
             expense_data.get('vendor', ''),
             expense_data.get('category', 'Other'),
@@ -96,28 +102,132 @@ class SheetsManager:
             ', '.join(expense_data.get('items', [])) if expense_data.get('items') else '',
             datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         ]
+    
+    def find_duplicates(self, expenses):
+        """
+        Indexes of expenses that are already in the sheet, or repeat an
+        earlier expense in the same list (same vendor/date/total/currency)
+        """
+        if self.dedup is None:
+            return set()
+        duplicates = set()
+        seen_keys = set()
+        for index, expense_data in enumerate(expenses):
+            key = expense_key(expense_data)
+            if key is None:
+                continue
+            if key in seen_keys or self.dedup.find_expense(key):
+                duplicates.add(index)
+            seen_keys.add(key)
+        return duplicates
+    
+    @metrics.timed('sheets_append')
+    def add_expenses(self, expenses, fingerprints=None):
+        """
+        Add several expenses to the sheet in a single append request
+        
+        fingerprints (image hashes, one per expense) are registered in the
+        dedup index together with the expense keys once the rows landed.
+        Returns the raw API result; updates.updatedRange tells which rows landed.
+        """
+        rows = [self.build_row(expense_data) for expense_data in expenses]
         
         # Append to sheet
         body = {
-            'values': [row]
+            'values': rows
         }
         
-        result = self.sheet.values().append(
+        result = execute(self.sheet.values().append(
             spreadsheetId=GOOGLE_SHEET_ID,
             range='A:H',
             valueInputOption='USER_ENTERED',
             body=body
-        ).execute()
+        ), 'sheets', idempotent=False)
+        
+        self.mirror_to_ledger(result, rows)
+        self.register_saved(result, expenses, fingerprints)
+        return result
+    
+    def register_saved(self, result, expenses, fingerprints=None):
+        """Record saved expenses in the dedup index (never fails the append)"""
+        if self.dedup is None:
+            return
+        row_numbers = parse_updated_rows(result.get('updates', {}).get('updatedRange', ''))
+        if len(row_numbers) != len(expenses):
+            row_numbers = [None] * len(expenses)
+        fingerprints = fingerprints or [None] * len(expenses)
+        try:
+            for expense_data, fingerprint, row in zip(expenses, fingerprints, row_numbers):
+                self.dedup.register(expense_data, fingerprint, label=f"row {row}" if row else '')
+        except Exception as e:
+            print(f"⚠️  Could not update dedup index: {str(e)}")
+    
+    def mirror_to_ledger(self, result, rows):
+        """Write appended rows to the local ledger (never fails the append)"""
+        if self.ledger is None:
+            return
+        row_numbers = parse_updated_rows(result.get('updates', {}).get('updatedRange', ''))
+        if len(row_numbers) != len(rows):
+            print("⚠️  Ledger not updated (unknown row numbers), run: python run.py reconcile")
+            return
+        try:
+            self.ledger.record_rows(zip(row_numbers, rows))
+        except Exception as e:
+            print(f"⚠️  Could not update local ledger: {str(e)}")
+    
+    def add_expense(self, expense_data, fingerprint=None):
+        """
+        Add expense to sheet (skipped, returning None, if it is already there)
+        
+        expense_data format:
+        {
+            'vendor': 'Starbucks',
+            'date': '2025-10-22',
+            'total': 735.00,
+            'currency': 'INR',
+            'category': 'Food',
+            'tax': 35.00,
+            'items': ['Latte', 'Croissant']
+        }
+        """
+        print(f"📝 Adding expense: {expense_data.get('vendor', 'Unknown')}")
+        
+        if self.find_duplicates([expense_data]):
+            print("♻️  Already in the sheet, skipping")
+            return None
+        
+        result = self.add_expenses([expense_data], [fingerprint])
         
         print(f"✅ Expense added to row {result.get('updates', {}).get('updatedRange', '')}")
         return result
     
-    def get_all_expenses(self):
-        """Get all expenses from sheet"""
-        result = self.sheet.values().get(
+    def get_rows(self, start_row=2):
+        """Raw sheet rows from start_row to the end (numbers unformatted)"""
+        result = execute(self.sheet.values().get(
+            spreadsheetId=GOOGLE_SHEET_ID,
+            range=f'A{start_row}:H',
+            valueRenderOption='UNFORMATTED_VALUE',
+            dateTimeRenderOption='FORMATTED_STRING'
+        ), 'sheets')
+        
+        return result.get('values', [])
+    
+    def get_all_expenses(self, from_sheet=False):
+        """
+        Get all expenses
+        
+        Served from the local ledger (synced first if it never was);
+        from_sheet=True downloads the whole sheet instead.
+        """
+        if self.ledger is not None and not from_sheet:
+            if self.ledger.synced_row is None:
+                self.ledger.reconcile(self)
+            return self.ledger.get_all()
+        
+        result = execute(self.sheet.values().get(
             spreadsheetId=GOOGLE_SHEET_ID,
             range='A:H'
-        ).execute()
+        ), 'sheets')
         
         values = result.get('values', [])
         
@@ -126,6 +236,173 @@ class SheetsManager:
         
         # Skip header row
         return values[1:]
+    
+    def reconcile(self, full=False):
+        """Sync the local ledger with the sheet (incremental unless full=True)"""
+        if self.ledger is None:
+            print("⚠️  Local ledger is disabled (LEDGER_ENABLED=0)")
+            return 0
+        return self.ledger.reconcile(self, full=full)
+
+
+def parse_updated_rows(updated_range):
+    """Turn an updatedRange like 'Sheet1!A5:H7' into row numbers [5, 6, 7]"""
+    match = re.search(r'[A-Z]+(\d+)(?::[A-Z]+(\d+))?$', updated_range or '')
+    if not match:
+        return []
+    first = int(match.group(1))
+    last = int(match.group(2) or first)
+    return list(range(first, last + 1))
+
+
+# Writers still alive at interpreter exit get flushed (without being kept alive)
+_writers = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_writers():
+    for writer in list(_writers):
+        writer.flush()
+
+
+class BufferedSheetWriter:
+    """
+    Collect expense rows and append them to the sheet in one request.
+    
+    Rows are flushed when max_rows are pending, when the oldest pending row is
+    older than max_age seconds, when flush() is called, or at interpreter exit.
+    on_flush(landed) is called with the rows that made it to the sheet, each as
+    {'row': sheet_row_number, 'data': expense_data, 'tag': tag}. Rows that
+    turned out to be duplicates are not written; they are passed to on_flush
+    with 'row': None and 'duplicate': True so their source is still handled.
+    """
+    
+    def __init__(self, sheets=None, max_rows=SHEETS_BATCH_SIZE, max_age=SHEETS_BATCH_MAX_AGE, on_flush=None):
+        self.sheets = sheets or SheetsManager()
+        self.max_rows = max(1, int(max_rows))
+        self.max_age = max_age
+        self.on_flush = on_flush
+        self.pending = []
+        self.oldest = None
+        self.total_saved = 0
+        self.total_duplicates = 0
+        # lock guards pending; flush_lock keeps flushes in order without
+        # holding up add() during the Sheets request
+        self.lock = threading.RLock()
+        self.flush_lock = threading.Lock()
+        
+        # Never lose buffered rows on a normal shutdown
+        _writers.add(self)
+    
+    def add(self, expense_data, tag=None, fingerprint=None):
+        """Queue one expense row"""
+        self.add_many([expense_data], tag, [fingerprint])
+    
+    def add_many(self, expenses, tag=None, fingerprints=None):
+        """Queue several rows that belong together (they always land in the same flush)"""
+        fingerprints = fingerprints or [None] * len(expenses)
+        with self.lock:
+            if not self.pending:
+                self.oldest = time.monotonic()
+            self.pending.extend(
+                (expense_data, tag, fingerprint)
+                for expense_data, fingerprint in zip(expenses, fingerprints)
+            )
+            print(f"📥 Queued {len(expenses)} row(s) for sheets ({len(self.pending)} pending)")
+            metrics.set_gauge('sheet_writer_pending_rows', len(self.pending))
+        
+        self.flush_if_due()
+    
+    def is_due(self):
+        """True when the row-count or age threshold has been reached"""
+        with self.lock:
+            if not self.pending:
+                return False
+            if len(self.pending) >= self.max_rows:
+                return True
+            return self.max_age is not None and time.monotonic() - self.oldest >= self.max_age
+    
+    def flush_if_due(self):
+        """Flush only if a threshold has been reached (and no flush is running)"""
+        if not self.is_due() or not self.flush_lock.acquire(blocking=False):
+            return []
+        try:
+            landed = self.write_pending()
+        finally:
+            self.flush_lock.release()
+        return self.settle(landed)
+    
+    def flush(self):
+        """
+        Append all pending rows in one request
+        
+        Returns the list of rows that landed. If the append fails the rows are
+        dropped and reported, so the source emails stay unread and get retried.
+        """
+        with self.flush_lock:
+            landed = self.write_pending()
+        return self.settle(landed)
+    
+    def settle(self, landed):
+        """Hand a flush's rows to on_flush (None: nothing was written)"""
+        if landed is None:
+            return []
+        if self.on_flush:
+            self.on_flush(landed)
+        return landed
+    
+    def write_pending(self):
+        """Take the pending rows and append them (caller holds flush_lock); None if nothing landed"""
+        with self.lock:
+            if not self.pending:
+                return None
+            batch = self.pending
+            self.pending = []
+            self.oldest = None
+            metrics.set_gauge('sheet_writer_pending_rows', 0)
+        
+        # Rows already in the sheet (or twice in this batch) are not written again
+        duplicate_indexes = self.sheets.find_duplicates([expense_data for expense_data, _, _ in batch])
+        duplicates = [
+            {'row': None, 'data': expense_data, 'tag': tag, 'duplicate': True}
+            for index, (expense_data, tag, _) in enumerate(batch) if index in duplicate_indexes
+        ]
+        batch = [entry for index, entry in enumerate(batch) if index not in duplicate_indexes]
+        for entry in duplicates:
+            print(f"♻️  Duplicate, not written: {entry['data'].get('vendor', 'Unknown')} "
+                  f"{entry['data'].get('date', '')} {entry['data'].get('total', '')}")
+        with self.lock:
+            self.total_duplicates += len(duplicates)
+        
+        landed = []
+        if batch:
+            print(f"\n💾 Writing {len(batch)} row(s) to Google Sheets in one request...")
+            try:
+                result = self.sheets.add_expenses(
+                    [expense_data for expense_data, _, _ in batch],
+                    [fingerprint for _, _, fingerprint in batch]
+                )
+            except Exception as e:
+                print(f"❌ Could not write {len(batch)} row(s): {str(e)}")
+                for expense_data, _, _ in batch:
+                    print(f"   - not saved: {expense_data.get('vendor', 'Unknown')} {expense_data.get('total', '')}")
+                return None
+            
+            updated_range = result.get('updates', {}).get('updatedRange', '')
+            rows = parse_updated_rows(updated_range)
+            if len(rows) != len(batch):
+                rows = [None] * len(batch)
+            
+            landed = [
+                {'row': row, 'data': expense_data, 'tag': tag}
+                for row, (expense_data, tag, _) in zip(rows, batch)
+            ]
+            with self.lock:
+                self.total_saved += len(landed)
+            metrics.inc('rows_saved_total', len(landed))
+            print(f"✅ {len(landed)} row(s) saved to {updated_range}")
+        landed += duplicates
+        return landed
 
 
 def test_sheets():
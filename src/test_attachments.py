@@ -0,0 +1,142 @@
+"""
+Test attachment selection and download against the local fake Gmail service
+
+Covers the pre-download filters (type, size, logo heuristics), chunked
+base64 decoding, parallel downloads of attachments fetched by id and the
+two-phase fetch (metadata first, then only the chosen parts).
+"""
+import os
+import time
+import base64
+
+from fake_gmail import FakeGmailService
+from fake_services import Faults
+from gmail_monitor import GmailMonitor, skip_reason, decode_base64url, RECEIPT_QUERY
+
+
+def part(filename, mime_type, size):
+    return {'filename': filename, 'mimeType': mime_type, 'body': {'attachmentId': 'x', 'size': size}}
+
+
+def test_skip_reasons():
+    """Only parts that can be receipts are downloaded"""
+    assert skip_reason(part('receipt.jpg', 'image/jpeg', 250_000)) is None
+    assert skip_reason(part('invoice.pdf', 'application/pdf', 80_000)) is None
+    assert skip_reason(part('scan.PDF', 'application/octet-stream', 80_000)) is None
+    assert skip_reason(part('unknown.bin', 'application/octet-stream', 80_000))
+    assert skip_reason(part('terms.html', 'text/html', 80_000))
+    assert skip_reason(part('open.gif', 'image/gif', 43))
+    assert 'too small' in skip_reason(part('pixel.png', 'image/png', 68))
+    assert 'too large' in skip_reason(part('video_still.png', 'image/png', 200 * 1024 * 1024))
+    assert 'logo' in skip_reason(part('company_logo.png', 'image/png', 40_000))
+    assert 'logo' in skip_reason(part('fb-icon@2x.png', 'image/png', 12_000))
+    assert skip_reason({'filename': '', 'mimeType': 'image/png', 'body': {'size': 40_000}})
+    print("✅ Non-receipt parts are skipped before download")
+
+
+def test_receipt_names_containing_decoration_words():
+    """Decoration words inside other words, big images and PDFs (even tiny ones) are never skipped"""
+    for filename, mime_type in [('Silicon_Valley_Cafe.jpg', 'image/jpeg'), ('Iconic_Mall_bill.jpg', 'image/jpeg'),
+                                ('Bannerghatta_store.png', 'image/png'), ('invoice_signature.pdf', 'application/pdf'),
+                                ('signature.PDF', 'application/octet-stream')]:
+        assert skip_reason(part(filename, mime_type, 40_000)) is None, filename
+    assert skip_reason(part('store_logo_receipt.jpg', 'image/jpeg', 400_000)) is None
+    assert skip_reason(part('invoice.pdf', 'application/pdf', 2_400)) is None
+    assert skip_reason(part('bill.pdf', 'application/octet-stream', 1_800)) is None
+    print("✅ Receipts named like decoration are still downloaded")
+
+
+def test_chunked_decode_matches_base64():
+    """Chunked decoding gives the same bytes as urlsafe_b64decode, padded or not"""
+    for size in (0, 1, 2, 3, 4, 5, 1000, 4096, 65_537):
+        data = os.urandom(size)
+        encoded = base64.urlsafe_b64encode(data).decode()
+        assert decode_base64url(encoded, chunk_chars=64) == data
+        assert decode_base64url(encoded.rstrip('='), chunk_chars=64) == data
+        assert decode_base64url(encoded.encode()) == data
+    print("✅ Chunked base64 decoding is exact")
+
+
+def test_parallel_download_keeps_order_and_skips_pixels():
+    """Four 0.2s downloads take about one round trip; the tracking pixel is never fetched"""
+    service = FakeGmailService(faults=Faults(latency=0.2))
+    bodies = [os.urandom(20_000 + i) for i in range(4)] + [b'GIF89a' + b'\0' * 37]
+    names = [f"receipt_{i}.jpg" for i in range(4)] + ['open.gif']
+    message_id = service.add_message('Your receipts', filenames=names, data=bodies,
+                                     mime_type=['image/jpeg'] * 4 + ['image/gif'], inline=False)
+
+    gmail = GmailMonitor(service, download_workers=4)
+    start = time.monotonic()
+    attachments = gmail.get_attachments(service.mailbox[message_id])
+    elapsed = time.monotonic() - start
+
+    assert [att['filename'] for att in attachments] == names[:4]
+    assert [att['data'] for att in attachments] == bodies[:4]
+    fetched = [call for call in service.calls if call[0] == 'attachments.get']
+    assert len(fetched) == 4
+    assert elapsed < 0.6, elapsed   # serial would be 0.8s
+    print(f"✅ 4 attachments downloaded in {elapsed:.2f}s, tracking pixel skipped")
+
+
+def test_inline_attachments_need_no_download():
+    """Small inline bodies are decoded from the message itself"""
+    service = FakeGmailService()
+    data = os.urandom(8_000)
+    message_id = service.add_message('Receipt', filenames=['receipt.png'], data=data, mime_type='image/png')
+    attachments = GmailMonitor(service).get_attachments(service.mailbox[message_id])
+    assert attachments[0]['data'] == data
+    assert not any(call[0] == 'attachments.get' for call in service.calls)
+    print("✅ Inline attachment decoded without a request")
+
+
+def test_nested_receipts_are_found():
+    """Receipts inside multipart/mixed → multipart/related are downloaded too"""
+    service = FakeGmailService()
+    data = os.urandom(30_000)
+    service.add_message('Your order receipt', filenames=['receipt.png'], data=data,
+                        mime_type='image/png', inline=False, nested=True)
+    gmail = GmailMonitor(service)
+    emails = gmail.get_unread_receipts()
+    assert len(emails) == 1
+    attachments = gmail.get_attachments(emails[0])
+    assert [att['data'] for att in attachments] == [data]
+    print("✅ Nested receipt attachment found")
+
+
+def test_metadata_fetch_transfers_less():
+    """Phase 1 fetches no body data; emails with only logos and pixels are never downloaded"""
+    service = FakeGmailService()
+    for i in range(5):
+        service.add_message(f"Receipt {i}", filenames=['receipt.jpg'], data=os.urandom(20_000), nested=True)
+    service.add_message('Order update', filenames=['logo.png', 'open.gif'], data=[os.urandom(9_000), b'GIF89a'],
+                        mime_type=['image/png', 'image/gif'])
+    gmail = GmailMonitor(service)
+
+    ids = gmail.list_message_ids(RECEIPT_QUERY)
+    before = service.bytes_sent
+    gmail.fetch_messages(ids, format='full')
+    full_bytes = service.bytes_sent - before
+
+    before = service.bytes_sent
+    emails = gmail.get_unread_receipts()
+    metadata_bytes = service.bytes_sent - before
+    assert len(emails) == 5
+    assert metadata_bytes * 10 < full_bytes, (metadata_bytes, full_bytes)
+
+    # Small inline bodies left out of the metadata come with one more request per email
+    before = service.bytes_sent
+    attachments = [att for email in emails for att in gmail.get_attachments(email)]
+    assert len(attachments) == 5 and all(len(att['data']) == 20_000 for att in attachments)
+    print(f"✅ Metadata fetch: {metadata_bytes} bytes instead of {full_bytes} "
+          f"(+{service.bytes_sent - before} for the receipts themselves)")
+
+
+if __name__ == "__main__":
+    test_skip_reasons()
+    test_receipt_names_containing_decoration_words()
+    test_chunked_decode_matches_base64()
+    test_parallel_download_keeps_order_and_skips_pixels()
+    test_inline_attachments_need_no_download()
+    test_nested_receipts_are_found()
+    test_metadata_fetch_transfers_less()
+    print("✅ All attachment tests passed")
@@ -0,0 +1,87 @@
+"""
+Test multi-receipt extraction: packing stops at the token budget and a
+batched answer with broken entries still yields the good ones
+"""
+import json
+
+import process_receipt
+from batch_extract import item_cost, pack_batches, parse_batch_response
+from fake_services import FakeOpenAIClient
+
+
+def receipt(number, length=396):
+    """(id, text, fields) item whose text is `length` characters"""
+    text = f"Bill No: {number}\n"
+    return (str(number), text + 'x' * (length - len(text)), None)
+
+
+def sizes(batches):
+    return [len(batch) for batch in batches]
+
+
+def test_packing_splits_at_token_budget():
+    """Batches hold as many receipts as the budget allows, never more"""
+    items = [receipt(i) for i in range(5)]
+    cost = item_cost(items[0][1])
+
+    assert sizes(pack_batches(items, 2 * cost, 10)) == [2, 2, 1]
+    assert sizes(pack_batches(items, 2 * cost - 1, 10)) == [1, 1, 1, 1, 1]
+    assert sizes(pack_batches(items, 10 * cost, 3)) == [3, 2]
+
+    # A receipt larger than the budget goes on its own
+    items.insert(1, receipt(9, length=10000))
+    assert sizes(pack_batches(items, 2 * cost, 10)) == [1, 1, 2, 2]
+    print("✅ Packing splits at the token budget")
+
+
+def test_partly_malformed_response():
+    """Broken, unknown and repeated entries are dropped, the rest are kept"""
+    content = json.dumps({'receipts': [
+        {'id': '0', 'vendor': 'Shop 0'},
+        'not an object',
+        {'id': '1', 'vendor': 'Shop 1'},
+        {'id': '1', 'vendor': 'Shop 1 again'},
+        {'id': '7', 'vendor': 'Unknown'},
+        {'vendor': 'No id'},
+        {'id': 2, 'vendor': 'Shop 2'},
+    ]})
+    answers = parse_batch_response(content, {'0', '1', '2', '3'})
+    assert answers == {'0': {'vendor': 'Shop 0'}, '2': {'vendor': 'Shop 2'}}
+    assert parse_batch_response('{"receipts": [', {'0'}) == {}
+    print("✅ Partly malformed answers keep their good entries")
+
+
+class BrokenEntryClient(FakeOpenAIClient):
+    """Answers batched requests with the second entry replaced by garbage"""
+
+    def create(self, model, messages, **kwargs):
+        response = super().create(model, messages, **kwargs)
+        message = response.choices[0].message
+        content = json.loads(message.content)
+        if 'receipts' in content:
+            content['receipts'][1] = 'garbage'
+            message.content = json.dumps(content)
+        return response
+
+
+def test_broken_entry_retried_alone():
+    """Only the receipt that came back malformed is sent again"""
+    answers = {str(i): {'vendor': f"Shop {i}", 'date': '2026-01-01', 'total': 10 + i} for i in range(3)}
+    fake = BrokenEntryClient(answers)
+    client = process_receipt.client
+    process_receipt.client = fake
+    try:
+        results = process_receipt.llm_extract_batch([receipt(i) for i in range(3)])
+    finally:
+        process_receipt.client = client
+
+    assert [results[str(i)]['vendor'] for i in range(3)] == ['Shop 0', 'Shop 1', 'Shop 2']
+    assert fake.requests == 2 and fake.receipts == 4
+    print("✅ Broken entry retried on its own")
+
+
+if __name__ == "__main__":
+    test_packing_splits_at_token_budget()
+    test_partly_malformed_response()
+    test_broken_entry_retried_alone()
+    print("✅ All batch extraction tests passed")
@@ -0,0 +1,63 @@
+"""
+Test the end-to-end benchmark: a small run against the fakes saves every
+receipt exactly once and reports the stages it timed
+"""
+import sys
+import json
+import tempfile
+import subprocess
+from pathlib import Path
+
+from bench_pipeline import build_corpus, percentile
+
+SRC_DIR = Path(__file__).parent
+
+
+def test_corpus_is_reproducible():
+    """Same seed → same corpus; re-sent attachments reuse an earlier image"""
+    messages, answers = build_corpus(4, 3, duplicates=0.5, image_size=(200, 300), seed=3)
+    again, _ = build_corpus(4, 3, duplicates=0.5, image_size=(200, 300), seed=3)
+    assert messages == again
+
+    images = {answer['image'] for answer in answers.values()}
+    files = [(name, data) for _, _, attachments in messages for name, data in attachments]
+    resent = [data for name, data in files if name.startswith('resent_')]
+    assert resent and all(data in images for data in resent)
+    assert len(files) == len(answers) + len(resent)
+    print("✅ Corpus is reproducible")
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 0.5) == 50
+    assert percentile(values, 0.95) == 95
+    assert percentile([7], 0.99) == 7
+    print("✅ Nearest-rank percentile")
+
+
+def test_small_run_saves_every_receipt():
+    """A run without injected latency saves or skips every receipt and marks all emails read"""
+    path = Path(tempfile.mkdtemp()) / 'results.json'
+    # Own process: the benchmark points config at a scratch directory and patches module globals
+    subprocess.run(
+        [sys.executable, 'bench_pipeline.py', '--emails', '3', '--attachments', '2', '--duplicates', '0.3',
+         '--gmail-latency', '0', '--sheets-latency', '0', '--openai-latency', '0', '--openai-per-receipt', '0',
+         '--ocr-latency', '0', '--save', str(path)],
+        cwd=SRC_DIR, check=True, capture_output=True
+    )
+    results = json.loads(path.read_text())
+
+    assert results['receipts'] == 6
+    assert results['failed'] == 0
+    assert results['rows_saved'] + results['duplicates'] == results['receipts']
+    assert results['emails_left_unread'] == 0
+    assert {'fetch', 'receipt', 'sheets_append'} <= set(results['stages'])
+    assert results['calls']['ocr_misses'] == 0
+    print("✅ Small benchmark run saves every receipt")
+
+
+if __name__ == "__main__":
+    test_corpus_is_reproducible()
+    test_percentile()
+    test_small_run_saves_every_receipt()
+    print("✅ All benchmark tests passed")
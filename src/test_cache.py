@@ -0,0 +1,61 @@
+"""
+Test the on-disk cache: hits and misses are counted, old entries expire,
+and the least recently used entries are evicted first
+"""
+import os
+import json
+import time
+import tempfile
+
+from cache import DiskCache
+
+
+def make_cache(max_bytes=1024 * 1024, ttl=None):
+    return DiskCache(tempfile.mkdtemp(), max_bytes, name='Test cache', ttl=ttl)
+
+
+def test_hits_and_misses():
+    """A stored value is a hit; counts from elsewhere (worker processes) are added"""
+    cache = make_cache()
+    key = DiskCache.make_key(b'image bytes', 'tesseract 5.3.0')
+    assert cache.get(key) is None
+    cache.set(key, 'Total 630')
+    assert cache.get(key) == 'Total 630'
+    cache.record(hits=2, misses=1)
+    assert cache.stats() == {'hits': 3, 'misses': 2, 'hit_rate': 0.6}
+    print("✅ Hits and misses counted")
+
+
+def test_expired_entry_is_a_miss():
+    """Entries older than ttl read as misses"""
+    cache = make_cache(ttl=60)
+    cache.set('ab12', {'total': 10})
+    assert cache.get('ab12') == {'total': 10}
+
+    # Written an hour ago
+    cache.path_for('ab12').write_text(json.dumps({'created': time.time() - 3600, 'value': {'total': 10}}))
+    assert cache.get('ab12') is None
+    print("✅ Expired entries are misses")
+
+
+def test_least_recently_used_evicted_first():
+    """Room for three entries: the fourth evicts the one used longest ago"""
+    value = 'x' * 60
+    entry_size = len(json.dumps({'created': time.time(), 'value': value}))
+    cache = make_cache(max_bytes=int(entry_size * 3.5))
+    for age, key in enumerate(['aa01', 'bb02', 'cc03']):
+        cache.set(key, value)
+        os.utime(cache.path_for(key), (age, age))    # distinct ages, aa01 oldest
+    assert cache.get('aa01') == value                # aa01 becomes the most recently used
+
+    cache.set('dd04', value)
+    assert not cache.path_for('bb02').exists()
+    assert all(cache.path_for(key).exists() for key in ['aa01', 'cc03', 'dd04'])
+    assert cache.scan_size() <= cache.max_bytes
+    print("✅ Least recently used entries evicted first")
+
+if __name__ == "__main__":
+    test_hits_and_misses()
+    test_expired_entry_is_a_miss()
+    test_least_recently_used_evicted_first()
+    print("✅ All cache tests passed")
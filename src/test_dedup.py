@@ -0,0 +1,107 @@
+"""
+Test the duplicate-receipt index: only byte-identical files are skipped
+before OCR, different receipts on the same background never are
+"""
+import io
+import sqlite3
+import tempfile
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageChops
+
+import process_receipt
+from dedup import DedupIndex, SCHEMA_VERSION, image_fingerprint, expense_key
+
+
+def receipt_photo(lines):
+    """A small receipt slip photographed on a large wooden-table background"""
+    image = Image.new('RGB', (800, 600), (120, 80, 40))
+    draw = ImageDraw.Draw(image)
+    for x in range(0, 800, 40):
+        draw.line([(x, 0), (x + 200, 600)], fill=(90, 60, 30), width=6)
+    draw.rectangle([340, 200, 460, 400], fill=(250, 250, 245))
+    for i, line in enumerate(lines):
+        draw.text((348, 210 + i * 14), line, fill=(20, 20, 20))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def index():
+    return DedupIndex(Path(tempfile.mkdtemp()) / 'dedup.sqlite3')
+
+
+def test_exact_copy_is_skipped():
+    """The same file sent twice is found before OCR"""
+    dedup = index()
+    photo = receipt_photo(['Blue Tokai', 'Latte 250', 'Total 250'])
+    dedup.register({'vendor': 'Blue Tokai', 'date': '2026-01-02', 'total': 250}, image_fingerprint(photo), 'row 2')
+    assert dedup.find_image(image_fingerprint(bytes(photo))) == 'row 2'
+    assert dedup.image_hits == 1
+    print("✅ Exact copy skipped before OCR")
+
+
+def test_same_background_different_receipt_reaches_ocr():
+    """Through prepare_receipt: a copy of a saved receipt is skipped, another receipt on the same table is not"""
+    first = receipt_photo(['Blue Tokai', 'Latte 250', 'Total 250'])
+    second = receipt_photo(['Pizza Palace', 'Margherita 480', 'Total 480'])
+    # Same layout and background: the photos differ only inside the paper slip
+    diff = ImageChops.difference(Image.open(io.BytesIO(first)), Image.open(io.BytesIO(second))).convert('L')
+    left, top, right, bottom = diff.point(lambda v: 255 if v > 40 else 0).getbbox()
+    assert left >= 330 and top >= 190 and right <= 470 and bottom <= 410
+
+    dedup = index()
+    dedup.register({'vendor': 'Blue Tokai', 'date': '2026-01-02', 'total': 250}, image_fingerprint(first), 'row 2')
+    original = process_receipt.get_dedup_index, process_receipt.receipt_to_text
+    process_receipt.get_dedup_index, process_receipt.receipt_to_text = (lambda: dedup), (lambda data: 'text')
+    try:
+        copy = process_receipt.prepare_receipt(bytes(first), 'first_again.jpg', check_duplicates=True)
+        other = process_receipt.prepare_receipt(second, 'second.jpg', check_duplicates=True)
+    finally:
+        process_receipt.get_dedup_index, process_receipt.receipt_to_text = original
+
+    assert copy['status'] == 'duplicate' and 'row 2' in copy['message']
+    assert other['status'] == 'ocr'
+    print("✅ Different receipt on the same background reaches OCR")
+
+
+def test_migration_runs_once():
+    """The old image_hashes table is dropped when an old index is opened, never again"""
+    path = Path(tempfile.mkdtemp()) / 'dedup.sqlite3'
+    with sqlite3.connect(str(path)) as db:
+        db.execute("CREATE TABLE image_hashes (hash TEXT PRIMARY KEY)")
+
+    def tables():
+        with sqlite3.connect(str(path)) as db:
+            return {row[0] for row in db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+    DedupIndex(path).close()
+    assert 'image_hashes' not in tables() and 'content_hashes' in tables()
+    with sqlite3.connect(str(path)) as db:
+        assert db.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+        db.execute("CREATE TABLE image_hashes (hash TEXT PRIMARY KEY)")
+    DedupIndex(path).close()
+    assert 'image_hashes' in tables()
+    print("✅ Schema migration applied once")
+
+
+def test_recompressed_copy_caught_after_extraction():
+    """A re-encoded copy goes through OCR, then matches on vendor / date / total"""
+    dedup = index()
+    photo = receipt_photo(['Blue Tokai', 'Latte 250', 'Total 250'])
+    recompressed = io.BytesIO()
+    Image.open(io.BytesIO(photo)).save(recompressed, format='JPEG', quality=60)
+    data = {'vendor': 'Blue Tokai', 'date': '2026-01-02', 'total': 250, 'currency': 'INR'}
+    dedup.register(data, image_fingerprint(photo), 'row 2')
+
+    assert dedup.find_image(image_fingerprint(recompressed.getvalue())) is None
+    assert dedup.find_expense(expense_key(dict(data, vendor='BLUE TOKAI'))) == 'row 2'
+    print("✅ Re-compressed copy caught by the expense check")
+
+
+if __name__ == "__main__":
+    test_exact_copy_is_skipped()
+    test_same_background_different_receipt_reaches_ocr()
+    test_migration_runs_once()
+    test_recompressed_copy_caught_after_extraction()
+    print("✅ All dedup tests passed")
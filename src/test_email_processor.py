@@ -0,0 +1,51 @@
+"""
+Test EmailProcessor: attachments processed in parallel still land in the
+sheet in attachment order
+"""
+import time
+import tempfile
+from pathlib import Path
+
+from dedup import DedupIndex
+from ledger import ExpenseLedger
+from journal import Journal
+from fake_gmail import FakeGmailService
+from fake_services import FakeSheetsService
+from gmail_monitor import GmailMonitor
+from sheets_helper import SheetsManager
+from email_processor import EmailProcessor
+
+
+def make_processor(gmail_service, sheets_service, max_workers):
+    directory = Path(tempfile.mkdtemp())
+    return EmailProcessor(
+        max_workers=max_workers,
+        gmail=GmailMonitor(gmail_service),
+        sheets=SheetsManager(sheets_service, ledger=ExpenseLedger(directory / 'ledger.sqlite3'),
+                             dedup=DedupIndex(directory / 'dedup.sqlite3')),
+        journal=Journal(directory / 'journal.sqlite3')
+    )
+
+
+def test_parallel_results_keep_attachment_order():
+    """Earlier attachments finish last, rows still follow the attachment order"""
+    gmail_service = FakeGmailService()
+    sheets_service = FakeSheetsService()
+    gmail_service.add_message('Your receipt', filenames=[f"receipt_{i}.jpg" for i in range(4)])
+    processor = make_processor(gmail_service, sheets_service, max_workers=4)
+
+    def process_attachment(att):
+        number = int(att['filename'].split('_')[1].split('.')[0])
+        time.sleep(0.05 * (4 - number))
+        return {'status': 'success', 'data': {'vendor': f"Shop {number}", 'date': '2026-01-01',
+                                              'total': 10 + number, 'currency': 'INR'}}
+    processor.process_attachment = process_attachment
+
+    assert processor.run_once(batch_extraction=False) == 1
+    assert [row[1] for row in sheets_service.rows[1:]] == [f"Shop {i}" for i in range(4)]
+    print("✅ Parallel results keep attachment order")
+
+
+if __name__ == "__main__":
+    test_parallel_results_keep_attachment_order()
+    print("✅ All email processor tests passed")
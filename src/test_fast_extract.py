@@ -0,0 +1,99 @@
+"""
+Test the rule-based extractor's total: cash tendered is never read as the
+total, and a total that does not add up goes to the LLM
+"""
+from config import FAST_PATH_MIN_CONFIDENCE
+from fast_extract import fast_extract, find_total, last_amount, low_confidence_fields
+
+CASH_RECEIPT = """Blue Tokai Coffee
+Date: 12/03/2026
+Latte x2 600
+Subtotal 600
+CGST 2.5% 15
+SGST 2.5% 15
+Total 630
+Amount Paid 1000
+Change 370"""
+
+
+def test_amount_paid_is_not_the_total():
+    """Cash handed over (1000) and change (370) lose to the bill total (630)"""
+    data, confidence = fast_extract(CASH_RECEIPT)
+    assert data['total'] == 630.0 and data['tax'] == 30.0
+    assert confidence['total'] >= 0.99
+    print("✅ Total 630 read, amount paid 1000 ignored")
+
+
+def test_tendered_wording_is_ignored():
+    """'Total paid' / 'cash tendered' lines are not total candidates"""
+    lines = ['Total 450.00', 'Total Paid 500.00', 'Cash Tendered 500.00', 'Change 50.00']
+    assert find_total(lines) == (450.0, 0.85)
+    print("✅ Tendered cash lines skipped")
+
+
+def test_candidate_matching_subtotal_plus_tax_wins():
+    """Of several totals, the one equal to subtotal + tax is taken"""
+    lines = ['Subtotal 600', 'Tax 30', 'Total 630', 'Total 1000']
+    assert find_total(lines, expected=630.0) == (630.0, 0.85)
+    total, confidence = find_total(lines)
+    assert total == 1000.0 and confidence < 0.85
+    print("✅ Subtotal + tax picks the right total")
+
+
+def test_net_amount_before_tax_is_not_the_total():
+    """Net amount + CGST + SGST = Total: the total line wins, confirmed by the sum"""
+    data, confidence = fast_extract("Spice Kitchen\n2026-01-05\nNet Amount 900\n"
+                                    "CGST 22.50\nSGST 22.50\nTotal 945\n")
+    assert data['total'] == 945.0 and confidence['total'] >= 0.99
+    print("✅ Net amount 900 read as the pre-tax amount, total 945")
+
+
+def test_tiers_disagreeing_go_to_llm():
+    """Different amounts under different keywords, nothing adds up → not trusted"""
+    data, confidence = fast_extract("Spice Kitchen\n2026-01-05\nTotal 945\nNet Amount 900\n")
+    assert data['total'] == 945.0
+    assert confidence['total'] < FAST_PATH_MIN_CONFIDENCE
+    print("✅ Disagreeing total keywords fall back to the LLM")
+
+
+def test_amount_formats():
+    """One or two decimals, thousands separators; never a number cut in the middle"""
+    assert last_amount('Total 1234.5') == 1234.5
+    assert last_amount('Total 1234.56') == 1234.56
+    assert last_amount('Total 945') == 945.0
+    assert last_amount('Grand Total ₹1,234.50') == 1234.5
+    assert last_amount('Total 12,345.6') == 12345.6
+    assert last_amount('Total 1,234,567') == 1234567.0
+    assert last_amount('CGST 2.5% 15') == 15.0
+    data, confidence = fast_extract("Spice Kitchen\n2026-01-05\nTotal 1234.5\n")
+    assert data['total'] == 1234.5
+    print("✅ Amounts read whole with one or two decimals")
+
+
+def test_mismatch_sends_total_to_llm():
+    """A total that does not equal subtotal + tax is no longer trusted"""
+    data, confidence = fast_extract("Pizza Palace\n2026-01-05\nSubtotal 600\nGST 30\nGrand Total 1000\n")
+    assert data['total'] == 1000.0
+    assert confidence['total'] < FAST_PATH_MIN_CONFIDENCE
+    assert 'total' in low_confidence_fields(confidence, FAST_PATH_MIN_CONFIDENCE)
+    print("✅ Mismatched total falls back to the LLM")
+
+
+def test_total_without_subtotal_keeps_keyword_confidence():
+    """No subtotal line: the keyword alone decides"""
+    data, confidence = fast_extract("Uber Trip\n2026-02-01\nTrip fare 230\nGrand Total ₹250.00\n")
+    assert data['total'] == 250.0 and confidence['total'] == 0.95
+    assert data['currency'] == 'INR'
+    print("✅ Keyword confidence kept without a subtotal")
+
+
+if __name__ == "__main__":
+    test_amount_paid_is_not_the_total()
+    test_tendered_wording_is_ignored()
+    test_candidate_matching_subtotal_plus_tax_wins()
+    test_net_amount_before_tax_is_not_the_total()
+    test_tiers_disagreeing_go_to_llm()
+    test_amount_formats()
+    test_mismatch_sends_total_to_llm()
+    test_total_without_subtotal_keeps_keyword_confidence()
+    print("✅ All rule-based extractor tests passed")
@@ -0,0 +1,40 @@
+"""
+Test batched Gmail fetches: long listings are split into batch requests of
+GMAIL_BATCH_SIZE messages and come back in listing order
+"""
+from config import GMAIL_BATCH_SIZE
+from gmail_monitor import GmailMonitor
+from fake_gmail import FakeGmailService
+
+
+def test_listing_split_into_batches():
+    """120 receipt emails are fetched in batches of 50, 50 and 20"""
+    service = FakeGmailService()
+    message_ids = [service.add_message(f"Receipt {i}") for i in range(120)]
+    monitor = GmailMonitor(service)
+
+    emails = monitor.get_unread_receipts(batch=True)
+
+    assert [email['id'] for email in emails] == message_ids
+    assert [call[1] for call in service.calls if call[0] == 'batch'] == [GMAIL_BATCH_SIZE, GMAIL_BATCH_SIZE, 20]
+    assert sum(1 for call in service.calls if call[0] == 'messages.get') == 120
+    print("✅ Long listings are fetched in batches")
+
+
+def test_unbatched_fetch_same_result():
+    """batch=False fetches the same emails one request at a time"""
+    service = FakeGmailService()
+    message_ids = [service.add_message(f"Receipt {i}") for i in range(60)]
+    monitor = GmailMonitor(service)
+
+    emails = monitor.get_unread_receipts(batch=False)
+
+    assert [email['id'] for email in emails] == message_ids
+    assert not any(call[0] == 'batch' for call in service.calls)
+    print("✅ Unbatched fetch returns the same emails")
+
+
+if __name__ == "__main__":
+    test_listing_split_into_batches()
+    test_unbatched_fetch_same_result()
+    print("✅ All Gmail fetch tests passed")
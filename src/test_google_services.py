@@ -0,0 +1,83 @@
+"""
+Test the Google API client registry: credentials and discovery documents
+are loaded once per process, clients are built once per thread
+"""
+import tempfile
+import threading
+from pathlib import Path
+
+from google.auth.credentials import AnonymousCredentials
+import googleapiclient.discovery_cache
+
+import google_services
+
+
+class Registry:
+    """Point the registry at counting credential loaders and a scratch discovery cache"""
+
+    def __enter__(self):
+        self.loads = []
+        self.loaders = dict(google_services.CREDENTIAL_LOADERS)
+        self.cache_dir = google_services.DISCOVERY_CACHE_DIR
+        for api in self.loaders:
+            google_services.CREDENTIAL_LOADERS[api] = lambda scopes, api=api: self.load(api)
+        google_services.DISCOVERY_CACHE_DIR = Path(tempfile.mkdtemp())
+        google_services.reset()
+        return self
+
+    def load(self, api):
+        self.loads.append(api)
+        return AnonymousCredentials()
+
+    def __exit__(self, *exc):
+        google_services.CREDENTIAL_LOADERS.update(self.loaders)
+        google_services.DISCOVERY_CACHE_DIR = self.cache_dir
+        google_services.reset()
+
+
+def service_in_thread(api):
+    services = []
+    thread = threading.Thread(target=lambda: services.append(google_services.get_service(api)))
+    thread.start()
+    thread.join()
+    return services[0]
+
+
+def test_one_client_per_thread():
+    """Same thread → same client; another thread → its own client, credentials loaded once"""
+    with Registry() as registry:
+        first = google_services.get_service('gmail')
+        assert google_services.get_service('gmail') is first
+
+        other = service_in_thread('gmail')
+        assert other is not first
+        assert other._http is not first._http
+        assert registry.loads == ['gmail']
+    print("✅ One client per thread, credentials shared")
+
+
+def test_discovery_document_cached_on_disk():
+    """After the first build the discovery document comes from the local cache"""
+    with Registry():
+        document = google_services.get_discovery_document('sheets')
+        assert (google_services.DISCOVERY_CACHE_DIR / 'sheets.v4.json').exists()
+        assert google_services.get_discovery_document('sheets') is document
+
+        # A new process (reset) reads the cached file, not the bundled copy or the network
+        google_services.reset()
+        get_static_doc = googleapiclient.discovery_cache.get_static_doc
+
+        def no_static_doc(api, version):
+            raise AssertionError("discovery document loaded again")
+        googleapiclient.discovery_cache.get_static_doc = no_static_doc
+        try:
+            assert google_services.get_discovery_document('sheets') == document
+        finally:
+            googleapiclient.discovery_cache.get_static_doc = get_static_doc
+    print("✅ Discovery document cached on disk")
+
+
+if __name__ == "__main__":
+    test_one_client_per_thread()
+    test_discovery_document_cached_on_disk()
+    print("✅ All Google services tests passed")
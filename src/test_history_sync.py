@@ -0,0 +1,145 @@
+"""
+Test incremental Gmail sync (history IDs) against a local fake Gmail service
+"""
+import tempfile
+from pathlib import Path
+
+import gmail_monitor
+from gmail_monitor import GmailMonitor
+from fake_gmail import FakeGmailService, http_error
+
+
+def make_monitor():
+    """GmailMonitor wired to a fake mailbox and a throwaway checkpoint file"""
+    gmail_monitor.GMAIL_HISTORY_PATH = Path(tempfile.mkdtemp()) / 'gmail_history.json'
+    service = FakeGmailService(page_size=2)
+    return GmailMonitor(service=service), service
+
+
+def test_first_sync_is_full_search():
+    """No checkpoint yet: full search, then a checkpoint is saved"""
+    monitor, service = make_monitor()
+    service.add_message('Your receipt')
+    service.add_message('Lunch plans')
+
+    emails = monitor.get_new_receipts()
+
+    assert [e['id'] for e in emails] == ['msg1']
+    assert monitor.load_history_id() == str(service.history_id)
+    print("✅ First sync ran a full search and saved a checkpoint")
+
+
+def test_incremental_sync_only_sees_new_mail():
+    """After the checkpoint only newly added receipt emails are fetched"""
+    monitor, service = make_monitor()
+    service.add_message('Old receipt')
+    monitor.get_new_receipts()
+
+    service.calls.clear()
+    service.add_message('Invoice #42')
+    service.add_message('Newsletter')
+    service.add_message('Order shipped', filenames=())
+    service.add_message('Another receipt')
+
+    emails = monitor.get_new_receipts()
+
+    assert [e['id'] for e in emails] == ['msg2', 'msg5']
+    assert not any(name == 'messages.list' for name, _ in service.calls)
+    assert sum(1 for name, _ in service.calls if name == 'history.list') == 2   # paged
+    print("✅ Incremental sync fetched only new receipt emails")
+
+
+def test_nothing_new_costs_one_request():
+    """A quiet mailbox costs a single history.list call"""
+    monitor, service = make_monitor()
+    service.add_message('Receipt')
+    monitor.get_new_receipts()
+
+    service.calls.clear()
+    assert monitor.get_new_receipts() == []
+    assert [name for name, _ in service.calls] == ['history.list']
+    print("✅ Quiet mailbox costs one request")
+
+
+def test_expired_checkpoint_falls_back_to_full_search():
+    """A 404 from history.list triggers a full search and a fresh checkpoint"""
+    monitor, service = make_monitor()
+    service.add_message('Receipt one')
+    monitor.get_new_receipts()
+
+    service.add_message('Receipt two')
+    service.expire_history()
+
+    emails = monitor.get_new_receipts()
+
+    assert [e['id'] for e in emails] == ['msg1', 'msg2']
+    assert monitor.load_history_id() == str(service.history_id)
+    print("✅ Expired checkpoint fell back to a full search")
+
+
+def failing(service):
+    """A request that fails with a (non-retryable) API error"""
+    def run():
+        raise http_error(400, 'Bad Request')
+    return service.request(run)
+
+
+class FailingSearch:
+    """users().messages() whose list() fails"""
+
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, **kwargs):
+        return failing(self.service)
+
+
+def test_profile_error_does_not_escape():
+    """A failed getProfile returns nothing instead of raising, and saves no checkpoint"""
+    monitor, service = make_monitor()
+    service.add_message('Receipt')
+    service.getProfile = lambda userId: failing(service)
+
+    assert monitor.get_new_receipts() == []
+    assert monitor.load_history_id() is None
+    print("✅ getProfile error handled")
+
+
+def test_failed_search_keeps_checkpoint():
+    """A full search that failed (or missed messages) leaves the old checkpoint in place"""
+    monitor, service = make_monitor()
+    service.add_message('Receipt one')
+    monitor.get_new_receipts()
+    checkpoint = monitor.load_history_id()
+    service.add_message('Receipt two')
+
+    search = service.messages
+    service.messages = lambda: FailingSearch(service)
+    assert monitor.get_new_receipts(full=True) == []
+    assert monitor.load_history_id() == checkpoint
+
+    # Search works but one message could not be fetched (e.g. throttled too often)
+    service.messages = search
+    fetch = monitor.fetch_messages
+    monitor.fetch_messages = lambda message_ids, **options: fetch(message_ids[1:], **options)
+    emails = monitor.get_new_receipts(full=True)
+    assert [e['id'] for e in emails] == ['msg2']
+    assert monitor.load_history_id() == checkpoint
+    print("✅ Failed search kept the old checkpoint")
+
+
+if __name__ == "__main__":
+    print("\n" + "="*60)
+    print("🧪 TESTING INCREMENTAL GMAIL SYNC")
+    print("="*60 + "\n")
+
+    test_first_sync_is_full_search()
+    test_incremental_sync_only_sees_new_mail()
+    test_nothing_new_costs_one_request()
+    test_expired_checkpoint_falls_back_to_full_search()
+    test_profile_error_does_not_escape()
+    test_failed_search_keeps_checkpoint()
+
+    print("\n" + "="*60)
+    print("✅ ALL SYNC TESTS PASSED")
+    print("="*60 + "\n")
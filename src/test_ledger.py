@@ -0,0 +1,54 @@
+"""
+Test the local ledger: an incremental reconcile only downloads sheet rows
+after the last synced row, a full one also drops rows the sheet lost
+"""
+import tempfile
+from pathlib import Path
+
+from ledger import ExpenseLedger
+from fake_services import FakeSheetsService
+from sheets_helper import SheetsManager
+
+
+def expense(number):
+    return ['2026-01-01', f"Shop {number}", 'Food', 10 + number, 'INR', '', '', '2026-01-01 10:00:00']
+
+
+def make_sheets(rows):
+    service = FakeSheetsService()
+    service.rows.extend(expense(i) for i in range(rows))
+    ledger = ExpenseLedger(Path(tempfile.mkdtemp()) / 'ledger.sqlite3')
+    return service, SheetsManager(service, ledger=ledger, dedup=None), ledger
+
+
+def test_incremental_reconcile_reads_new_rows_only():
+    """The second reconcile asks for rows after synced_row and pulls only those"""
+    service, sheets, ledger = make_sheets(3)
+    assert ledger.reconcile(sheets) == 3
+    assert ledger.synced_row == 4
+
+    # Rows added outside this process (by hand, another machine)
+    service.rows.extend(expense(i) for i in range(3, 5))
+    assert ledger.reconcile(sheets) == 2
+
+    assert [call for call in service.calls if call[0] == 'get'] == [('get', 'A2:H'), ('get', 'A5:H')]
+    assert ledger.synced_row == 6
+    assert [row[1] for row in ledger.get_all()] == [f"Shop {i}" for i in range(5)]
+    print("✅ Incremental reconcile reads new rows only")
+
+
+def test_full_reconcile_drops_deleted_rows():
+    """full=True re-reads the whole sheet and forgets rows deleted from it"""
+    service, sheets, ledger = make_sheets(3)
+    ledger.reconcile(sheets)
+    del service.rows[-1]
+
+    assert ledger.reconcile(sheets, full=True) == 2
+    assert [row[1] for row in ledger.get_all()] == ['Shop 0', 'Shop 1']
+    print("✅ Full reconcile drops deleted rows")
+
+
+if __name__ == "__main__":
+    test_incremental_reconcile_reads_new_rows_only()
+    test_full_reconcile_drops_deleted_rows()
+    print("✅ All ledger tests passed")
@@ -0,0 +1,75 @@
+"""
+Test batched read-marks: processed emails are marked read with one
+batchModify instead of one messages.modify each, optionally with a label
+"""
+from fake_gmail import FakeGmailService
+from gmail_monitor import GmailMonitor
+
+
+def calls(service, name):
+    return [call for call in service.calls if call[0] == name]
+
+
+def test_one_batch_modify_per_flush():
+    """Five queued emails → a single batchModify, no per-email modify"""
+    service = FakeGmailService()
+    ids = [service.add_message(f"Receipt {i}") for i in range(5)]
+    gmail = GmailMonitor(service)
+
+    for message_id in ids:
+        assert gmail.mark_read_later(message_id) == []
+    assert gmail.is_pending_read(ids[0])
+    assert gmail.flush_read() == ids
+
+    assert calls(service, 'messages.batchModify') == [('messages.batchModify', 5)]
+    assert not calls(service, 'messages.modify')
+    assert not any('UNREAD' in service.mailbox[m]['labelIds'] for m in ids)
+    assert gmail.flush_read() == []
+    print("✅ 5 emails marked read in one request")
+
+
+def test_size_threshold_flushes_early():
+    """The queue is flushed as soon as mark_read_batch emails are waiting"""
+    service = FakeGmailService()
+    ids = [service.add_message(f"Receipt {i}") for i in range(5)]
+    gmail = GmailMonitor(service, mark_read_batch=2)
+
+    flushed = [gmail.mark_read_later(message_id) for message_id in ids]
+    assert flushed == [[], ids[:2], [], ids[2:4], []]
+    assert gmail.flush_read() == ids[4:]
+    assert len(calls(service, 'messages.batchModify')) == 3
+    print("✅ Size threshold flushes the queue")
+
+
+def test_processed_label_is_excluded_from_search():
+    """The processed label is created once, added with the read-mark and excluded server side"""
+    service = FakeGmailService()
+    first = service.add_message('Receipt one')
+    gmail = GmailMonitor(service, processed_label='Receipts/Processed')
+    assert gmail.query.endswith('-label:receipts-processed')
+
+    gmail.mark_read_later(first)
+    gmail.flush_read()
+    label_id = service.user_labels['Receipts/Processed']['id']
+    assert label_id in service.mailbox[first]['labelIds']
+
+    # Marked unread again by hand: still skipped because of the label
+    service.mailbox[first]['labelIds'].append('UNREAD')
+    second = service.add_message('Receipt two')
+    assert [email['id'] for email in gmail.get_unread_receipts()] == [second]
+    assert len(calls(service, 'labels.create')) == 1
+    print("✅ Processed label applied and excluded from the search")
+
+
+if __name__ == "__main__":
+    print("\n" + "="*60)
+    print("🧪 TESTING BATCHED READ-MARKS")
+    print("="*60 + "\n")
+
+    test_one_batch_modify_per_flush()
+    test_size_threshold_flushes_early()
+    test_processed_label_is_excluded_from_search()
+
+    print("\n" + "="*60)
+    print("✅ ALL READ-MARK TESTS PASSED")
+    print("="*60 + "\n")
@@ -0,0 +1,176 @@
+"""
+Test the pipeline metrics: recording, Prometheus text output, the HTTP
+endpoint, rate limiter counters and the disabled (no-op) mode
+"""
+import socket
+import tempfile
+import urllib.request
+from pathlib import Path
+
+import metrics
+from rate_limit import RateLimiter
+from dedup import DedupIndex
+from ledger import ExpenseLedger
+from journal import Journal
+from fake_gmail import FakeGmailService
+from fake_services import FakeSheetsService
+from gmail_monitor import GmailMonitor
+from sheets_helper import SheetsManager
+from email_processor import EmailProcessor
+
+
+class Throttled(Exception):
+    status_code = 429
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def test_render_prometheus_text():
+    """Counters, gauges and histograms come out in the exposition format"""
+    metrics.reset()
+    metrics.inc('ocr_chars_total', 120)
+    metrics.inc('openai_tokens_total', 50, kind='prompt')
+    metrics.set_gauge('queue_depth', 3, stage='ocr')
+    metrics.observe('stage_seconds', 0.2, stage='ocr')
+    metrics.observe('stage_seconds', 3.0, stage='ocr')
+
+    text = metrics.render()
+    assert '# TYPE receipt_pipeline_stage_seconds histogram' in text
+    assert 'receipt_pipeline_stage_seconds_bucket{stage="ocr",le="0.25"} 1' in text
+    assert 'receipt_pipeline_stage_seconds_bucket{stage="ocr",le="+Inf"} 2' in text
+    assert 'receipt_pipeline_stage_seconds_count{stage="ocr"} 2' in text
+    assert 'receipt_pipeline_ocr_chars_total 120' in text
+    assert 'receipt_pipeline_openai_tokens_total{kind="prompt"} 50' in text
+    assert 'receipt_pipeline_queue_depth{stage="ocr"} 3' in text
+    print("✅ Prometheus text output looks right")
+
+
+def test_timed_records_latency_and_failures():
+    """@timed observes every call and counts the ones that raise"""
+    metrics.reset()
+
+    @metrics.timed('ocr')
+    def ocr(fail=False):
+        if fail:
+            raise ValueError("bad image")
+        return 'text'
+
+    assert ocr() == 'text'
+    try:
+        ocr(fail=True)
+    except ValueError:
+        pass
+
+    assert metrics.get('stage_seconds', stage='ocr').count == 2
+    assert metrics.get('stage_failures_total', stage='ocr') == 1
+    assert any(line.startswith('ocr') and '1 failed' in line for line in metrics.summary_lines())
+    print("✅ Stage latency and failures recorded")
+
+
+def test_quantile_estimate():
+    """Histogram quantiles interpolate inside the bucket"""
+    histogram = metrics.Histogram()
+    for _ in range(90):
+        histogram.observe(0.03)   # 0.025 < x <= 0.05
+    for _ in range(10):
+        histogram.observe(2.0)    # 1 < x <= 2.5
+    assert 0.025 < histogram.quantile(0.5) <= 0.05
+    assert 1.0 < histogram.quantile(0.95) <= 2.5
+    print(f"✅ p50 ~{histogram.quantile(0.5):.3f}s, p95 ~{histogram.quantile(0.95):.3f}s")
+
+
+def test_rate_limiter_counts_retries():
+    """Throttled attempts show up as errors, throttles and retries per service"""
+    metrics.reset()
+    limiter = RateLimiter('openai', 0, max_retries=3, base_delay=0.001, max_delay=0.01)
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise Throttled()
+        return 'ok'
+
+    assert limiter.call(flaky) == 'ok'
+    assert metrics.get('api_errors_total', service='openai') == 2
+    assert metrics.get('api_throttled_total', service='openai') == 2
+    assert metrics.get('api_retries_total', service='openai') == 2
+    assert metrics.get('api_request_seconds', service='openai').count == 3
+    print("✅ Rate limiter retries counted")
+
+
+def test_http_endpoint():
+    """/metrics serves the current values"""
+    metrics.reset()
+    metrics.inc('emails_total', 4)
+    server = metrics.serve(port=free_port())
+    url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+    with urllib.request.urlopen(url, timeout=5) as response:
+        body = response.read().decode()
+        assert response.headers['Content-Type'].startswith('text/plain')
+    assert 'receipt_pipeline_emails_total 4' in body
+    print(f"✅ Metrics served at {url}")
+
+
+def test_disabled_is_a_no_op():
+    """With metrics off nothing is recorded and functions stay undecorated"""
+    metrics.reset()
+    metrics._enabled = False
+    try:
+        def ocr():
+            return 'text'
+        assert metrics.timed('ocr')(ocr) is ocr
+        metrics.inc('emails_total')
+        metrics.observe('stage_seconds', 1.0, stage='ocr')
+        metrics.set_gauge('queue_depth', 1, stage='ocr')
+        assert metrics.render() == '\n'
+        assert metrics.serve(port=free_port()) is None
+    finally:
+        metrics._enabled = True
+    print("✅ Disabled metrics record nothing")
+
+
+def test_processor_run_records_stages():
+    """One run over the fakes counts emails, receipts and rows and times every stage"""
+    metrics.reset()
+    directory = Path(tempfile.mkdtemp())
+    gmail_service = FakeGmailService()
+    gmail_service.add_message('Your receipt', filenames=['receipt_0.jpg', 'receipt_1.jpg'])
+    processor = EmailProcessor(
+        max_workers=1,
+        gmail=GmailMonitor(gmail_service),
+        sheets=SheetsManager(FakeSheetsService(), ledger=ExpenseLedger(directory / 'ledger.sqlite3'),
+                             dedup=DedupIndex(directory / 'dedup.sqlite3')),
+        journal=Journal(directory / 'journal.sqlite3')
+    )
+
+    def process_attachment(att):
+        number = int(att['filename'].split('_')[1].split('.')[0])
+        return {'status': 'success', 'data': {'vendor': f"Shop {number}", 'date': '2026-01-01',
+                                              'total': 10 + number, 'currency': 'INR'}}
+    processor.process_attachment = process_attachment
+    processor.run_once(batch_extraction=False)
+
+    assert metrics.get('emails_total') == 1
+    assert metrics.get('attachments_total') == 2
+    assert metrics.get('receipts_total', status='success') == 2
+    assert metrics.get('rows_saved_total') == 2
+    for stage in ('gmail_fetch', 'download', 'sheets_append', 'mark_read'):
+        assert metrics.get('stage_seconds', stage=stage).count >= 1, stage
+    assert 'receipt_pipeline_rows_saved_total 2' in metrics.render()
+    print("✅ A processor run records its stages")
+
+
+if __name__ == "__main__":
+    test_render_prometheus_text()
+    test_timed_records_latency_and_failures()
+    test_quantile_estimate()
+    test_rate_limiter_counts_retries()
+    test_http_endpoint()
+    test_disabled_is_a_no_op()
+    test_processor_run_records_stages()
+    print("✅ All metrics tests passed")
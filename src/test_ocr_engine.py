@@ -0,0 +1,88 @@
+"""
+Test the tesserocr API pool: short-lived thread pools share a bounded set of
+loaded models instead of loading one per thread (runs against a stub tesserocr)
+"""
+import sys
+import time
+import types
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class StubAPI:
+    """Counts live and busy API objects in place of tesserocr.PyTessBaseAPI"""
+    live = 0
+    busy = 0
+    most_busy = 0
+    lock = threading.Lock()
+
+    def __init__(self, lang='eng', oem=None):
+        self.lang = lang
+        with StubAPI.lock:
+            StubAPI.live += 1
+
+    def SetPageSegMode(self, psm):
+        pass
+
+    def SetVariable(self, name, value):
+        pass
+
+    def SetImage(self, image):
+        with StubAPI.lock:
+            StubAPI.busy += 1
+            StubAPI.most_busy = max(StubAPI.most_busy, StubAPI.busy)
+
+    def GetUTF8Text(self):
+        time.sleep(0.01)
+        with StubAPI.lock:
+            StubAPI.busy -= 1
+        return f"text ({self.lang})"
+
+    def End(self):
+        with StubAPI.lock:
+            StubAPI.live -= 1
+
+
+def tesserocr_engine(max_apis):
+    StubAPI.live = StubAPI.busy = StubAPI.most_busy = 0
+    sys.modules['tesserocr'] = types.SimpleNamespace(
+        PyTessBaseAPI=StubAPI, OEM=types.SimpleNamespace(DEFAULT=3),
+        tesseract_version=lambda: 'tesseract 5.3.0'
+    )
+    from ocr_engine import TesserocrEngine
+    try:
+        return TesserocrEngine(max_apis=max_apis)
+    finally:
+        del sys.modules['tesserocr']   # other tests keep seeing the real install (or none)
+
+
+def test_short_lived_threads_share_the_pool():
+    """Ten throwaway executors of 4 threads each → still only 2 models loaded"""
+    engine = tesserocr_engine(max_apis=2)
+    for _ in range(10):
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            texts = list(pool.map(lambda i: engine.image_to_string(i, config='--psm 6'), range(8)))
+        assert texts == ['text (eng)'] * 8
+    assert engine.created == 2 and StubAPI.live == 2
+    assert StubAPI.most_busy <= 2
+    engine.close()
+    assert StubAPI.live == 0
+    print("✅ 80 images from 40 threads used 2 Tesseract APIs")
+
+
+def test_other_languages_retire_idle_apis():
+    """A full pool makes room for a new language by ending an idle API"""
+    engine = tesserocr_engine(max_apis=1)
+    assert engine.image_to_string('img') == 'text (eng)'
+    assert engine.image_to_string('img', lang='hin') == 'text (hin)'
+    assert engine.image_to_string('img', lang='hin') == 'text (hin)'
+    assert engine.created == 2 and StubAPI.live == 1
+    engine.close()
+    assert StubAPI.live == 0
+    print("✅ Idle API ended to load another language")
+
+
+if __name__ == "__main__":
+    test_short_lived_threads_share_the_pool()
+    test_other_languages_retire_idle_apis()
+    print("✅ All OCR engine tests passed")
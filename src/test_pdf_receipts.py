@@ -0,0 +1,57 @@
+"""
+Test PDF receipts: a file with one receipt per page is not merged into one
+receipt, long statements are cut off at max_pages
+"""
+import pymupdf
+
+from fast_extract import fast_extract
+from pdf_receipts import pdf_to_text
+
+
+def make_pdf(pages):
+    """PDF bytes with embedded text, one string per page"""
+    doc = pymupdf.open()
+    for text in pages:
+        doc.new_page().insert_text((72, 72), text, fontsize=11)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def no_ocr(png_bytes):
+    raise AssertionError("pages with embedded text need no OCR")
+
+
+def test_two_receipts_keep_the_first():
+    """Two pages with their own totals → only the first receipt, with its own total"""
+    pdf = make_pdf(["Blue Tokai Coffee\n2026-01-05\nLatte 250\nTotal 250.00",
+                    "Pizza Palace\n2026-01-06\nMargherita 480\nTotal 480.00"])
+    text = pdf_to_text(pdf, ocr_page=no_ocr)
+    assert 'Blue Tokai' in text and 'Pizza Palace' not in text
+    assert fast_extract(text)[0]['total'] == 250.0
+    print("✅ Second receipt of the PDF not merged into the first")
+
+
+def test_receipt_over_two_pages_is_kept_whole():
+    """Items on page 1, the only total on page 2 → both pages"""
+    pdf = make_pdf(["Spice Kitchen\n2026-01-05\nPaneer Tikka 420\nDal Makhani 380",
+                    "Naan 100\nSubtotal 900\nCGST 22.50\nSGST 22.50\nTotal 945.00"])
+    text = pdf_to_text(pdf, ocr_page=no_ocr)
+    assert '--- Page 1 ---' in text and '--- Page 2 ---' in text
+    assert fast_extract(text)[0]['total'] == 945.0
+    print("✅ Two-page receipt read whole")
+
+
+def test_long_statement_is_capped():
+    """Only the first max_pages pages of a long statement are read"""
+    pdf = make_pdf([f"Statement page {number}\nOpening balance {number}00" for number in range(1, 9)])
+    text = pdf_to_text(pdf, ocr_page=no_ocr, max_pages=3)
+    assert 'Statement page 3' in text and 'Statement page 4' not in text
+    print("✅ Long PDF cut off at max_pages")
+
+
+if __name__ == "__main__":
+    test_two_receipts_keep_the_first()
+    test_receipt_over_two_pages_is_kept_whole()
+    test_long_statement_is_capped()
+    print("✅ All PDF receipt tests passed")
@@ -0,0 +1,114 @@
+"""
+Test that a failing extraction never stops the pipeline's extract workers:
+every item still reaches the write stage, so drain() does not hang
+"""
+import asyncio
+import tempfile
+from pathlib import Path
+
+import pipeline
+from dedup import DedupIndex
+from ledger import ExpenseLedger
+from journal import Journal
+from fake_gmail import FakeGmailService
+from fake_services import FakeSheetsService
+from gmail_monitor import GmailMonitor
+from sheets_helper import SheetsManager
+from email_processor import EmailProcessor
+from pipeline import ReceiptPipeline, EmailJob
+
+OUTCOME = ({'vendor': 'Shop', 'date': '2026-01-02', 'total': 10, 'currency': 'INR'}, {}, 'llm')
+
+
+def make_pipeline(batch_extraction):
+    data_dir = Path(tempfile.mkdtemp())
+    processor = EmailProcessor(
+        max_workers=1,
+        gmail=GmailMonitor(FakeGmailService()),
+        sheets=SheetsManager(FakeSheetsService(), ledger=ExpenseLedger(data_dir / 'ledger.sqlite3'),
+                             dedup=DedupIndex(data_dir / 'dedup.sqlite3')),
+        journal=Journal(data_dir / 'journal.sqlite3')
+    )
+    return ReceiptPipeline(processor, extract_workers=1, batch_extraction=batch_extraction)
+
+
+def run_extract_stage(receipt_pipeline, names):
+    """Feed names through one extract worker; (results by name, worker still running)"""
+    async def scenario():
+        receipt_pipeline.loop = asyncio.get_running_loop()
+        receipt_pipeline.queues = {'extract': asyncio.Queue(), 'write': asyncio.Queue()}
+        job = EmailJob('m1', 'me@example.com', names)
+        for name in names:
+            receipt_pipeline.queues['extract'].put_nowait((job, {'filename': name}, {'raw_text': name}))
+        worker = asyncio.create_task(receipt_pipeline.extract_stage())
+        try:
+            await asyncio.wait_for(receipt_pipeline.queues['extract'].join(), timeout=5)
+            alive = not worker.done()
+        finally:
+            worker.cancel()
+        written = receipt_pipeline.queues['write']
+        return {att['filename']: result for _, att, result in
+                (written.get_nowait() for _ in range(written.qsize()))}, alive
+    try:
+        return asyncio.run(scenario())
+    finally:
+        for executor in receipt_pipeline.executors.values():
+            executor.shutdown(wait=False)
+
+
+def test_finish_receipt_error_keeps_worker_alive():
+    """finish_receipt raising for one receipt → an error result for it, the next one still succeeds"""
+    original = pipeline.extract_fields, pipeline.finish_receipt
+
+    def finish(prepared, data, confidence, source):
+        if prepared['raw_text'] == 'bad.jpg':
+            raise RuntimeError('dedup index locked')
+        return {'status': 'success', 'data': data}
+    pipeline.extract_fields, pipeline.finish_receipt = (lambda text: OUTCOME), finish
+    try:
+        results, alive = run_extract_stage(make_pipeline(batch_extraction=False), ['bad.jpg', 'good.jpg'])
+    finally:
+        pipeline.extract_fields, pipeline.finish_receipt = original
+
+    assert alive
+    assert results['bad.jpg']['status'] == 'error' and 'dedup index locked' in results['bad.jpg']['message']
+    assert results['good.jpg']['status'] == 'success'
+    print("✅ finish_receipt failure recorded, worker kept going")
+
+
+def test_batch_failure_marks_every_item_done():
+    """extract_many raising → every receipt of the pack gets an error result"""
+    original = pipeline.extract_many
+
+    def explode(texts, workers=1):
+        raise RuntimeError('OpenAI unavailable')
+    pipeline.extract_many = explode
+    try:
+        results, alive = run_extract_stage(make_pipeline(batch_extraction=True), ['a.jpg', 'b.jpg', 'c.jpg'])
+    finally:
+        pipeline.extract_many = original
+
+    assert alive
+    assert sorted(results) == ['a.jpg', 'b.jpg', 'c.jpg']
+    assert all(result['status'] == 'error' for result in results.values())
+    print("✅ Failed pack reported per receipt, extract queue drained")
+
+
+def test_executor_error_keeps_worker_alive():
+    """An exception out of run_blocking itself is caught in the stage"""
+    receipt_pipeline = make_pipeline(batch_extraction=False)
+
+    def broken(prepared):
+        raise RuntimeError('executor shut down')
+    receipt_pipeline.extract_one = broken
+    results, alive = run_extract_stage(receipt_pipeline, ['a.jpg', 'b.jpg'])
+    assert alive
+    assert [result['status'] for result in results.values()] == ['error', 'error']
+    print("✅ run_blocking failure recorded, extract queue drained")
+
+
+if __name__ == "__main__":
+    test_finish_receipt_error_keeps_worker_alive()
+    test_batch_failure_marks_every_item_done()
+    test_executor_error_keeps_worker_alive()
+    print("✅ All pipeline tests passed")
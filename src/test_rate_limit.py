@@ -0,0 +1,268 @@
+"""
+Test the shared rate limiter against a local fake API server that injects 429s
+
+The server speaks just enough of the OpenAI chat API and the Sheets values
+API for the real client libraries to talk to it, so the retry path is the
+one used in production (status codes, Retry-After headers, client errors).
+"""
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from rate_limit import RateLimiter, TokenBucket, get_limiter
+from fake_gmail import FakeGmailService
+from fake_services import Faults
+from gmail_monitor import GmailMonitor
+
+COMPLETION = {
+    'id': 'chatcmpl-test', 'object': 'chat.completion', 'created': 0, 'model': 'gpt-4o-mini',
+    'choices': [{
+        'index': 0, 'finish_reason': 'stop',
+        'message': {'role': 'assistant', 'content': '{"vendor": "Test Cafe", "total": 5}'}
+    }],
+}
+
+
+class FakeQuotaServer:
+    """
+    Local HTTP server that throttles like a real API
+
+    fail_first: answer the first N requests with `status`
+    max_in_flight: answer 429 whenever more requests than this run at once
+    """
+
+    def __init__(self, fail_first=0, status=429, retry_after='0.1', max_in_flight=None, latency=0.0):
+        self.fail_first = fail_first
+        self.status = status
+        self.retry_after = retry_after
+        self.max_in_flight = max_in_flight
+        self.latency = latency
+        self.requests = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.handle(self, {'range': 'A1:H1', 'values': [['Date', 'Vendor']]})
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                server.handle(self, COMPLETION)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def handle(self, handler, payload):
+        with self.lock:
+            self.requests += 1
+            self.in_flight += 1
+            reject = self.requests <= self.fail_first or (
+                self.max_in_flight is not None and self.in_flight > self.max_in_flight
+            )
+            if reject:
+                self.rejected += 1
+        try:
+            time.sleep(self.latency)
+            if reject:
+                body = json.dumps({'error': {'code': self.status, 'message': 'Slow down',
+                                             'status': 'RESOURCE_EXHAUSTED'}}).encode()
+                handler.send_response(self.status)
+                if self.retry_after is not None:
+                    handler.send_header('Retry-After', self.retry_after)
+            else:
+                body = json.dumps(payload).encode()
+                handler.send_response(200)
+            handler.send_header('Content-Type', 'application/json')
+            handler.send_header('Content-Length', str(len(body)))
+            handler.end_headers()
+            handler.wfile.write(body)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def make_limiter(rate=0, max_concurrency=8, max_retries=5):
+    """Limiter with short delays so tests run quickly"""
+    return RateLimiter('test', rate, max_concurrency=max_concurrency, max_retries=max_retries,
+                       base_delay=0.02, max_delay=0.5)
+
+
+def openai_client(server):
+    from openai import OpenAI
+    return OpenAI(api_key='test', base_url=f"{server.url}/v1", max_retries=0)
+
+
+def sheets_service(server):
+    import httplib2
+    from googleapiclient.discovery import build_from_document
+    from google_services import get_discovery_document
+    return build_from_document(
+        get_discovery_document('sheets'), http=httplib2.Http(timeout=5),
+        client_options={'api_endpoint': server.url + '/'}
+    )
+
+
+def test_token_bucket_caps_rate():
+    """20 requests/second with no burst: 10 acquires take about half a second"""
+    bucket = TokenBucket(rate=20, burst=1)
+    start = time.monotonic()
+    for _ in range(10):
+        bucket.acquire()
+    elapsed = time.monotonic() - start
+    assert 0.4 <= elapsed < 1.0, elapsed
+    print(f"✅ Token bucket held 10 requests to {elapsed:.2f}s at 20/s")
+
+
+def test_openai_429_is_retried_after_retry_after():
+    """OpenAI client gets two 429s, then succeeds; Retry-After is honoured"""
+    server = FakeQuotaServer(fail_first=2, retry_after='0.2')
+    limiter = make_limiter()
+    try:
+        client = openai_client(server)
+        start = time.monotonic()
+        response = limiter.call(
+            client.chat.completions.create,
+            model='gpt-4o-mini', messages=[{'role': 'user', 'content': 'hi'}]
+        )
+        elapsed = time.monotonic() - start
+    finally:
+        server.close()
+
+    assert json.loads(response.choices[0].message.content)['vendor'] == 'Test Cafe'
+    assert server.requests == 3 and limiter.retries == 2 and limiter.throttled == 2
+    assert elapsed >= 0.4, elapsed   # two waits of at least Retry-After
+    assert limiter.concurrency.limit < 8
+    print(f"✅ OpenAI call survived 2 × 429 in {elapsed:.2f}s ({limiter.summary()})")
+
+
+def test_sheets_503_is_retried():
+    """googleapiclient HttpError 503 is retried (server failure, idempotent read)"""
+    server = FakeQuotaServer(fail_first=1, status=503, retry_after=None)
+    limiter = make_limiter()
+    try:
+        request = sheets_service(server).spreadsheets().values().get(spreadsheetId='sheet', range='A1:H1')
+        result = limiter.call(request.execute)
+    finally:
+        server.close()
+
+    assert result['values'][0] == ['Date', 'Vendor']
+    assert server.requests == 2 and limiter.retries == 1 and limiter.throttled == 0
+    print(f"✅ Sheets read survived a 503 ({limiter.summary()})")
+
+
+def test_non_idempotent_call_not_retried_after_5xx():
+    """An append that hit a 500 may have landed, so it is not sent again"""
+    server = FakeQuotaServer(fail_first=1, status=500, retry_after=None)
+    limiter = make_limiter()
+    try:
+        request = sheets_service(server).spreadsheets().values().get(spreadsheetId='sheet', range='A1:H1')
+        try:
+            limiter.call(request.execute, idempotent=False)
+            raise AssertionError("expected HttpError")
+        except Exception as e:
+            assert getattr(e, 'status_code', None) == 500, e
+    finally:
+        server.close()
+
+    assert server.requests == 1 and limiter.retries == 0
+    print("✅ Non-idempotent call was not retried after a 500")
+
+
+def test_gives_up_after_max_retries():
+    """A service that never recovers raises after max_retries attempts"""
+    server = FakeQuotaServer(fail_first=100, retry_after='0')
+    limiter = make_limiter(max_retries=3)
+    try:
+        client = openai_client(server)
+        try:
+            limiter.call(client.chat.completions.create,
+                         model='gpt-4o-mini', messages=[{'role': 'user', 'content': 'hi'}])
+            raise AssertionError("expected RateLimitError")
+        except Exception as e:
+            assert type(e).__name__ == 'RateLimitError', e
+    finally:
+        server.close()
+
+    assert server.requests == 4 and limiter.retries == 3
+    print("✅ Gave up after 3 retries")
+
+
+def test_concurrency_adapts_to_throttling():
+    """Server allows 2 requests in flight; 8 threads still all succeed"""
+    server = FakeQuotaServer(max_in_flight=2, retry_after=None, latency=0.05)
+    limiter = make_limiter(max_concurrency=8, max_retries=10)
+    try:
+        client = openai_client(server)
+
+        def one_call(_):
+            return limiter.call(client.chat.completions.create,
+                                model='gpt-4o-mini', messages=[{'role': 'user', 'content': 'hi'}])
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            responses = list(pool.map(one_call, range(24)))
+    finally:
+        server.close()
+
+    assert len(responses) == 24
+    assert limiter.throttled > 0
+    assert limiter.concurrency.limit < 8
+    print(f"✅ 24 calls succeeded, {server.rejected} throttled, "
+          f"concurrency limit settled at {limiter.concurrency.limit:.1f}")
+
+
+class SubRequestFaults(Faults):
+    """Throttles single sub-requests of a batch, never the batch envelope"""
+
+    def hit(self, make_error, extra=0.0):
+        self.wait(extra)
+
+
+def test_batch_counts_sub_requests_only():
+    """A batch fetch with throttled sub-requests counts each sub-request sent, never the envelope"""
+    service = FakeGmailService()
+    ids = [service.add_message(f"Receipt {i}") for i in range(12)]
+    service.faults = SubRequestFaults(error_rate=0.3, error_status=429, retry_after=0, seed=1)
+    limiter = get_limiter('gmail')
+    base_delay, limiter.base_delay = limiter.base_delay, 0.01
+    calls = limiter.calls
+    try:
+        messages = GmailMonitor(service).fetch_messages(ids, batch=True)
+    finally:
+        limiter.base_delay = base_delay
+
+    sent = sum(size for name, size in service.calls if name == 'batch')
+    assert len(messages) == 12 and sent > 12
+    assert limiter.calls - calls == sent
+    print(f"✅ {sent} sub-request(s) in {sum(1 for call in service.calls if call[0] == 'batch')} "
+          f"batch(es) counted as {sent} call(s)")
+
+
+if __name__ == "__main__":
+    print("\n" + "="*60)
+    print("🧪 TESTING RATE LIMITER AGAINST A FAKE THROTTLING SERVER")
+    print("="*60 + "\n")
+
+    test_token_bucket_caps_rate()
+    test_openai_429_is_retried_after_retry_after()
+    test_sheets_503_is_retried()
+    test_non_idempotent_call_not_retried_after_5xx()
+    test_gives_up_after_max_retries()
+    test_concurrency_adapts_to_throttling()
+    test_batch_counts_sub_requests_only()
+
+    print("\n" + "="*60)
+    print("✅ ALL RATE LIMIT TESTS PASSED")
+    print("="*60 + "\n")
@@ -0,0 +1,106 @@
+"""
+Test the buffered sheet writer: flush thresholds, failed appends, and
+add() not waiting for a Sheets request that is in flight
+"""
+import gc
+import time
+import weakref
+import tempfile
+import threading
+from pathlib import Path
+
+import sheets_helper
+from dedup import DedupIndex
+from ledger import ExpenseLedger
+from fake_services import FakeSheetsService, Faults
+from sheets_helper import SheetsManager, BufferedSheetWriter
+
+
+def expense(number):
+    return {'vendor': f"Shop {number}", 'date': '2026-01-02', 'total': 10 + number, 'currency': 'INR'}
+
+
+def writer_for(service, **options):
+    """Writer on a fake sheet with its own ledger / dedup index; flushes are collected"""
+    data_dir = Path(tempfile.mkdtemp())
+    sheets = SheetsManager(service, ledger=ExpenseLedger(data_dir / 'ledger.sqlite3'),
+                           dedup=DedupIndex(data_dir / 'dedup.sqlite3'))
+    flushes = []
+    return BufferedSheetWriter(sheets, on_flush=flushes.append, **options), flushes
+
+
+def test_flush_at_max_rows():
+    """The third row of max_rows=3 sends all three in one append"""
+    service = FakeSheetsService()
+    writer, flushes = writer_for(service, max_rows=3, max_age=None)
+    writer.add(expense(1))
+    writer.add(expense(2))
+    assert flushes == [] and len(service.rows) == 1
+    writer.add(expense(3), tag='email-3')
+    assert [entry['row'] for entry in flushes[0]] == [2, 3, 4]
+    assert flushes[0][2]['tag'] == 'email-3'
+    assert service.calls == [('append', 3)]
+    print("✅ Flushed at max_rows")
+
+
+def test_flush_at_max_age():
+    """A single row is flushed once it is older than max_age"""
+    service = FakeSheetsService()
+    writer, flushes = writer_for(service, max_rows=100, max_age=0.05)
+    writer.add(expense(1))
+    assert writer.flush_if_due() == [] and flushes == []
+    time.sleep(0.06)
+    assert [entry['row'] for entry in writer.flush_if_due()] == [2]
+    assert len(flushes) == 1 and writer.total_saved == 1
+    print("✅ Flushed at max_age")
+
+
+def test_failed_append_skips_on_flush():
+    """Rows of a failed append are dropped without on_flush, so their emails get retried"""
+    service = FakeSheetsService(faults=Faults(error_rate=1.0, error_status=400))
+    writer, flushes = writer_for(service, max_rows=2, max_age=None)
+    writer.add(expense(1))
+    writer.add(expense(2))
+    assert flushes == [] and writer.total_saved == 0
+    assert writer.flush() == [] and not writer.pending
+    print("✅ on_flush skipped for a failed append")
+
+
+def test_add_does_not_wait_for_append():
+    """add() from another worker returns while a slow append is in flight"""
+    service = FakeSheetsService(faults=Faults(latency=0.5))
+    writer, flushes = writer_for(service, max_rows=100, max_age=None)
+    writer.add(expense(1))
+    flusher = threading.Thread(target=writer.flush)
+    flusher.start()
+    time.sleep(0.1)
+    start = time.monotonic()
+    writer.add(expense(2))
+    assert time.monotonic() - start < 0.2
+    flusher.join()
+    writer.flush()
+    assert [len(landed) for landed in flushes] == [1, 1]
+    print("✅ add() did not wait for the Sheets request")
+
+
+def test_exit_flush_does_not_keep_writers_alive():
+    """Writers are flushed at exit only while something still uses them"""
+    writer, flushes = writer_for(FakeSheetsService())
+    writer.add(expense(1))
+    assert writer in sheets_helper._writers
+    sheets_helper._flush_writers()
+    assert len(flushes) == 1
+    ref = weakref.ref(writer)
+    del writer
+    gc.collect()
+    assert ref() is None
+    print("✅ Exit flush holds writers weakly")
+
+
+if __name__ == "__main__":
+    test_flush_at_max_rows()
+    test_flush_at_max_age()
+    test_failed_append_skips_on_flush()
+    test_add_does_not_wait_for_append()
+    test_exit_flush_does_not_keep_writers_alive()
+    print("✅ All sheet writer tests passed")